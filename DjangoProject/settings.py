@@ -14,6 +14,7 @@ from pathlib import Path
 from datetime import timedelta
 
 import os
+import tempfile
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -148,12 +149,15 @@ CORS_ALLOWED_ORIGINS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'core.authentication.ClaimsJWTAuthentication',
     )
 }
 
 SIMPLE_JWT = {
-    "ACCESS_TOKEN_LIFETIME": timedelta(minutes=60)
+    "ACCESS_TOKEN_LIFETIME": timedelta(minutes=60),
+    # Los tokens llevan username, is_staff e is_superuser para autenticar sin consultar el usuario
+    "TOKEN_OBTAIN_SERIALIZER": "core.authentication.ClaimsTokenObtainPairSerializer",
+    "TOKEN_REFRESH_SERIALIZER": "core.authentication.ClaimsTokenRefreshSerializer",
 }
 
 FLUTTERWAVE_SECRET_KEY = "FLWSECK_TEST-8076f3d93119fe2c8d0ade08b9572a5a-X"
@@ -164,4 +168,95 @@ PAYPAL_MODE = 'sandbox'
 
 REACT_BASE_URL = os.getenv("REACT_BASE_URL", "http://localhost:5173")
 # Al final de settings.py
-FLASK_CHATBOT_URL = os.getenv("FLASK_CHATBOT_URL", "http://localhost:5000")
\ No newline at end of file
+FLASK_CHATBOT_URL = os.getenv("FLASK_CHATBOT_URL", "http://localhost:5000")
+
+# Máximo de productos similares precalculados por producto (shop_app.SimilarProduct)
+SIMILAR_PRODUCTS_LIMIT = int(os.getenv("SIMILAR_PRODUCTS_LIMIT", 4))
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Caché compartida entre workers de la misma máquina (ver CATALOG_RESPONSE_CACHE)
+    'catalog': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv("CATALOG_CACHE_DIR", os.path.join(tempfile.gettempdir(), "pulsebeat_catalog_cache")),
+        'OPTIONS': {'MAX_ENTRIES': 2000},
+    },
+}
+
+# Respuestas JSON del catálogo ya serializadas. Para compartirlas entre workers usar
+# 'shop_app.services.response_cache.DjangoCacheBackend' con OPTIONS {'alias': 'catalog'}.
+# BACKEND = None desactiva la caché.
+CATALOG_RESPONSE_CACHE = {
+    'BACKEND': os.getenv("CATALOG_RESPONSE_CACHE_BACKEND", 'shop_app.services.response_cache.LRUBackend'),
+    'OPTIONS': {'max_entries': 512},
+}
+
+# Motor de búsqueda de productos: 'auto' (FTS5 si existe la tabla) o 'python' (índice en memoria)
+PRODUCT_SEARCH_BACKEND = os.getenv("PRODUCT_SEARCH_BACKEND", "auto")
+
+# Derivadas de Product.image generadas al subir (ver generate_image_variants para el backfill)
+PRODUCT_IMAGE_WIDTHS = (160, 320, 640, 1024)
+PRODUCT_IMAGE_FORMATS = ('avif', 'webp')
+
+# Límites de los rangos de precio para las facetas del catálogo ('<0', '0-50', ..., '500+')
+CATALOG_PRICE_BUCKETS = (0, 50, 100, 200, 500)
+
+# Carritos activos en caché con escritura diferida (shop_app.services.cart_store).
+# BACKEND = None lo desactiva; p. ej. 'shop_app.services.response_cache.LRUBackend' con
+# OPTIONS {'max_entries': 5000}, o DjangoCacheBackend con un alias compartido entre workers.
+# FLUSH_INTERVAL: segundos entre escrituras por lote a Cart/CartItem. TIMEOUT: segundos que
+# vive cada instantánea en un backend compartido (el LRU solo expulsa por tamaño).
+CART_STORE = {
+    'BACKEND': os.getenv("CART_STORE_BACKEND") or None,
+    'OPTIONS': {},
+    'FLUSH_INTERVAL': float(os.getenv("CART_STORE_FLUSH_INTERVAL", 2)),
+    'TIMEOUT': int(os.getenv("CART_STORE_TIMEOUT", 3600)),
+}
+
+# Carritos sin pagar que purge_abandoned_carts archiva (gzip JSONL) y borra
+ABANDONED_CART_DAYS = int(os.getenv("ABANDONED_CART_DAYS", 30))
+CART_ARCHIVE_DIR = os.getenv("CART_ARCHIVE_DIR", os.path.join(BASE_DIR, "archive"))
+
+FLUTTERWAVE_BASE_URL = os.getenv("FLUTTERWAVE_BASE_URL", "https://api.flutterwave.com/v3")
+# Vacío = la URL de PAYPAL_MODE. Para pruebas de carga: manage.py fake_gateway y
+# FLUTTERWAVE_BASE_URL=http://127.0.0.1:8001/v3 PAYPAL_BASE_URL=http://127.0.0.1:8001
+PAYPAL_BASE_URL = os.getenv("PAYPAL_BASE_URL") or None
+
+# Cliente HTTP de las pasarelas (shop_app.services.gateways): timeouts en segundos, reintentos
+# solo para llamadas idempotentes y circuit breaker (fallos seguidos / segundos abierto)
+PAYMENT_GATEWAY = {
+    'CONNECT_TIMEOUT': 3.05,
+    'READ_TIMEOUT': float(os.getenv("PAYMENT_GATEWAY_READ_TIMEOUT", 15)),
+    'RETRIES': 2,
+    'BACKOFF': 0.3,
+    'POOL_SIZE': 10,
+    'BREAKER_THRESHOLD': 5,
+    'BREAKER_RESET': 30,
+    # Segundos antes de caducar en los que se renueva el token OAuth de PayPal
+    'TOKEN_REFRESH_MARGIN': 300,
+}
+
+# Secreto configurado en el panel de Flutterwave para el webhook (cabecera verif-hash).
+# Vacío = se rechazan todos los webhooks.
+FLUTTERWAVE_WEBHOOK_HASH = os.getenv("FLUTTERWAVE_WEBHOOK_HASH", "")
+
+# Cola de tareas en segundo plano (shop_app.services.tasks). EAGER ejecuta en el momento.
+BACKGROUND_TASKS = {
+    'WORKERS': int(os.getenv("BACKGROUND_TASK_WORKERS", 4)),
+    'EAGER': os.getenv("BACKGROUND_TASKS_EAGER", "false").lower() == "true",
+}
+
+# Ejecutar el pago de PayPal en segundo plano: paypal_payment_callback responde 202 y el
+# front consulta payment_status hasta que deje de estar 'pending'
+PAYPAL_EXECUTE_ASYNC = os.getenv("PAYPAL_EXECUTE_ASYNC", "false").lower() == "true"
+
+# Caché en memoria de filas de usuario para las vistas que necesitan más que los claims del
+# JWT (email, teléfono...) y para comprobar que el usuario sigue existiendo y activo. Es de
+# cada proceso: guardar o borrar un usuario la invalida solo en ese worker; en los demás el
+# cambio tarda hasta TTL segundos en verse (también en cortar el acceso a un usuario borrado).
+JWT_USER_CACHE = {
+    'MAX_SIZE': 1024,
+    'TTL': 60,
+}
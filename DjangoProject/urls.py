@@ -18,7 +18,8 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
-from rest_framework_simplejwt.views import (TokenObtainPairView,TokenRefreshView)
+from rest_framework_simplejwt.views import TokenRefreshView
+from shop_app.views import CartTokenObtainPairView
 
 # Personalizar títulos del admin
 admin.site.site_header = "PulseBeat Tech Administration"
@@ -29,7 +30,7 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path("", include("shop_app.urls")),
     path('', include('chatbot.urls', namespace='chatbot')),  # Añadir las URLs del chatbot
-    path('token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
+    path('token/', CartTokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh')
 ]
 
@@ -3,4 +3,7 @@ set -o errexit
 pip install -r requirements.txt
 
 python manage.py collectstatic --no-input
-python manage.py migrate
\ No newline at end of file
+python manage.py migrate
+python manage.py rebuild_similar_products
+python manage.py rebuild_search_index
+python manage.py rebuild_catalog_facets
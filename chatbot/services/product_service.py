@@ -1,7 +1,7 @@
 # chatbot/services/product_service.py
 import logging
 from shop_app.models import Product
-from django.db.models import Q
+from shop_app.services import search
 
 logger = logging.getLogger(__name__)
 
@@ -15,24 +15,8 @@ def search_products(query, limit=5):
         return get_featured_products(limit)
 
     try:
-        # Búsqueda por nombre o descripción
-        name_matches = Product.objects.filter(
-            Q(name__icontains=query) |
-            Q(description__icontains=query)
-        ).distinct()
-
-        # Búsqueda por categoría
-        category_matches = Product.objects.filter(
-            category__icontains=query
-        )
-
-        # Combinar resultados sin duplicados
-        combined_results = list(name_matches)
-        for product in category_matches:
-            if product not in combined_results:
-                combined_results.append(product)
-
-        return combined_results[:limit]
+        # Índice de búsqueda compartido con el endpoint /search (nombre, descripción y categoría)
+        return search.search_products(query, limit=limit)
 
     except Exception as e:
         logger.error(f"Error al buscar productos: {str(e)}")
@@ -74,17 +58,14 @@ def get_product_details(product_id_or_name):
                 isinstance(product_id_or_name, str) and product_id_or_name.isdigit()):
             return Product.objects.filter(id=int(product_id_or_name)).first()
 
-        # Buscar por nombre exacto
-        exact_match = Product.objects.filter(name__iexact=product_id_or_name).first()
-        if exact_match:
-            return exact_match
+        # Buscar en el índice; si algún resultado coincide exactamente con el nombre, se prefiere
+        matches = search.search_products(product_id_or_name, limit=5)
+        wanted = search.fold(product_id_or_name).strip()
+        for product in matches:
+            if search.fold(product.name).strip() == wanted:
+                return product
 
-        # Buscar por nombre parcial
-        partial_matches = Product.objects.filter(name__icontains=product_id_or_name)
-        if partial_matches.exists():
-            return partial_matches.first()
-
-        return None
+        return matches[0] if matches else None
 
     except Exception as e:
         logger.error(f"Error al obtener detalles del producto: {str(e)}")
@@ -0,0 +1,194 @@
+"""
+Autenticación JWT sin consultar el usuario en cada petición.
+
+Los tokens llevan como claims username, is_staff e is_superuser (ClaimsRefreshToken), y
+ClaimsJWTAuthentication devuelve con ellos un ClaimsUser: un SimpleLazyObject que responde
+id, username y los flags desde el token y carga la fila completa de user_cache solo cuando
+una vista necesita otros campos (email, phone...) o el propio CustomUser (guardarlo,
+asignarlo a una FK). user_cache es una caché LRU con caducidad de filas de usuario que se
+invalida al guardar o borrar el usuario. Cada petición comprueba en esa caché que el
+usuario sigue existiendo y activo: sin consulta si la fila está cargada, una si falta o ha
+caducado (como mucho una por usuario cada JWT_USER_CACHE['TTL'] segundos en cada worker).
+
+La caché es de cada proceso: en el worker que guarda o borra el usuario el cambio se ve en
+la siguiente petición, en los demás cuando caduca la entrada (JWT_USER_CACHE['TTL']). Borrar
+o desactivar un usuario le corta el acceso en ese plazo; is_staff, is_superuser y username
+salen del token y se actualizan al renovar el access token (como mucho
+ACCESS_TOKEN_LIFETIME).
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ObjectDoesNotExist
+from django.utils.functional import SimpleLazyObject, empty
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+USER_CLAIMS = ('username', 'is_staff', 'is_superuser')
+
+
+class UserCache:
+    """LRU de filas de usuario por id con caducidad, compartida por los hilos del proceso"""
+
+    def __init__(self, max_size=1024, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._rows = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        """Copia de la fila del usuario (None si no existe); como mucho una consulta cada `ttl` segundos"""
+        if user_id is None:
+            return None
+        # simplejwt guarda el id como texto en el token; la clave es siempre str(pk)
+        key = str(user_id)
+        with self._lock:
+            entry = self._rows.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self._rows.move_to_end(key)
+                return copy.copy(entry[0])
+        user = get_user_model().objects.filter(pk=user_id).first()
+        if user is not None:
+            self.put(user)
+        return user
+
+    def put(self, user):
+        with self._lock:
+            key = str(user.pk)
+            self._rows[key] = (copy.copy(user), time.monotonic() + self.ttl)
+            self._rows.move_to_end(key)
+            while len(self._rows) > self.max_size:
+                self._rows.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._rows.pop(str(user_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._rows.clear()
+
+
+def _build_user_cache():
+    config = {'MAX_SIZE': 1024, 'TTL': 60, **getattr(settings, 'JWT_USER_CACHE', {})}
+    return UserCache(max_size=config['MAX_SIZE'], ttl=config['TTL'])
+
+
+user_cache = _build_user_cache()
+
+
+def _claim(name):
+    def get(self):
+        if self._wrapped is empty:
+            return self.__dict__['_claims'][name]
+        # Ya cargada: la fila manda (la vista puede haberla modificado)
+        return getattr(self._wrapped, name)
+    return property(get)
+
+
+class ClaimsUser(SimpleLazyObject):
+    """
+    Usuario construido con los claims del JWT, sin consultar la base de datos. El resto de
+    atributos carga la fila de user_cache la primera vez; si el usuario ya no existe,
+    AuthenticationFailed.
+    """
+    is_authenticated = True
+    is_anonymous = False
+
+    id = pk = _claim('id')
+    username = _claim('username')
+    is_staff = _claim('is_staff')
+    is_superuser = _claim('is_superuser')
+    is_active = _claim('is_active')
+
+    def __init__(self, user_id, claims):
+        self.__dict__['_claims'] = {
+            'id': get_user_model()._meta.pk.to_python(user_id),
+            'username': claims['username'],
+            'is_staff': claims['is_staff'],
+            'is_superuser': claims['is_superuser'],
+            # Solo se emiten tokens a usuarios activos
+            'is_active': True,
+        }
+        super().__init__(lambda: self._load_user(user_id))
+
+    @staticmethod
+    def _load_user(user_id):
+        user = user_cache.get(user_id)
+        if user is None:
+            # Borrado después de autenticar la petición: no devolver campos vacíos
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        return user
+
+    def __bool__(self):
+        return True
+
+    def __str__(self):
+        return self.username
+
+
+def set_user_claims(token, user):
+    for claim in USER_CLAIMS:
+        token[claim] = getattr(user, claim)
+
+
+class ClaimsRefreshToken(RefreshToken):
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        set_user_claims(token, user)
+        # Recién autenticado: la fila ya está cargada, la siguiente petición no la consulta
+        user_cache.put(user)
+        return token
+
+    @property
+    def access_token(self):
+        # Al renovar, los claims se toman del usuario actual (is_staff o username pueden haber cambiado)
+        access = super().access_token
+        user = user_cache.get(self.payload.get(api_settings.USER_ID_CLAIM))
+        if user is not None:
+            set_user_claims(access, user)
+        return access
+
+
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    token_class = ClaimsRefreshToken
+
+
+class ClaimsTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = ClaimsRefreshToken
+
+    def validate(self, attrs):
+        try:
+            return super().validate(attrs)
+        except ObjectDoesNotExist:
+            # Usuario borrado: 401 como uno desactivado, no un error 500
+            raise AuthenticationFailed(self.error_messages["no_active_account"], "no_active_account")
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        # Sigue existiendo y activo: sin consulta si la fila está en la caché, una si falta o caducó
+        user = user_cache.get(user_id)
+        if user is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if all(claim in validated_token for claim in USER_CLAIMS):
+            return ClaimsUser(user_id, validated_token)
+        # Tokens emitidos sin los claims: la fila completa
+        return user
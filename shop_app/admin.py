@@ -1,15 +1,20 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.utils.html import format_html
 from django.db.models import Sum, Count
 from django.urls import path
 from django.template.response import TemplateResponse
-from .models import Product, Cart, CartItem, Transaction
+from .models import Product, Cart, CartItem, Transaction, Order, OrderLine, SalesDaily
+from .services import analytics
+from .services.images import get_smallest_url
 
 class CartItemInline(admin.TabularInline):
     model = CartItem
     extra = 0
     readonly_fields = ['subtotal']
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('product')
+
     def subtotal(self, obj):
         return obj.quantity * obj.product.price
 
@@ -34,8 +39,10 @@ class ProductAdmin(admin.ModelAdmin):
 
     def image_preview(self, obj):
         if obj.image:
+            # Miniatura derivada cuando existe; la imagen original solo como respaldo
+            url = get_smallest_url(obj.image_variants) or obj.image.url
             return format_html('<img src="{}" width="50" height="50" style="object-fit: cover; border-radius: 5px;" />',
-                               obj.image.url)
+                               url)
         return "No Image"
 
     image_preview.short_description = 'Image'
@@ -52,22 +59,22 @@ class CartAdmin(admin.ModelAdmin):
     list_display = ('cart_code', 'user', 'total_items', 'total_amount', 'paid', 'created_at')
     list_filter = ('paid', 'created_at')
     search_fields = ('cart_code', 'user__username', 'user__email')
-    readonly_fields = ('cart_code', 'created_at', 'modified_at', 'total_amount')
+    list_select_related = ('user',)
+    readonly_fields = ('cart_code', 'created_at', 'modified_at', 'item_count', 'subtotal', 'total_amount')
     inlines = [CartItemInline]
     date_hierarchy = 'created_at'
 
     def total_items(self, obj):
-        return obj.items.aggregate(Sum('quantity'))['quantity__sum'] or 0
+        return obj.item_count
 
     total_items.short_description = 'Items'
+    total_items.admin_order_field = 'item_count'
 
     def total_amount(self, obj):
-        total = 0
-        for item in obj.items.all():
-            total += item.quantity * item.product.price
-        return f"${total:.2f}"
+        return f"${obj.subtotal:.2f}"
 
     total_amount.short_description = 'Total'
+    total_amount.admin_order_field = 'subtotal'
 
     def has_delete_permission(self, request, obj=None):
         # Prevent deletion of paid carts
@@ -81,9 +88,37 @@ class TransactionAdmin(admin.ModelAdmin):
     list_display = ('ref', 'user', 'amount', 'currency', 'status', 'created_at')
     list_filter = ('status', 'currency', 'created_at')
     search_fields = ('ref', 'user__username', 'user__email')
+    list_select_related = ('user',)
     readonly_fields = ('ref', 'cart', 'amount', 'currency', 'created_at', 'modified_at')
     date_hierarchy = 'created_at'
 
+    def get_urls(self):
+        urls = [
+            path('sales/', self.admin_site.admin_view(self.sales_dashboard), name='shop_app_sales_dashboard'),
+        ]
+        return urls + super().get_urls()
+
+    def sales_dashboard(self, request):
+        # Lee solo los rollups (services.analytics), nunca Transaction ni CartItem
+        try:
+            start, end = analytics.get_period(request.GET)
+        except ValueError as e:
+            self.message_user(request, f"Invalid period: {e}", level=messages.ERROR)
+            start, end = analytics.get_period({})
+        currency = request.GET.get('currency') or None
+        report = analytics.sales_report(start, end, currency=currency)
+        peak = max((row['revenue'] for row in report['daily']), default=0) or 1
+        for row in report['daily']:
+            row['width'] = int(row['revenue'] * 100 / peak)
+        context = {
+            **self.admin_site.each_context(request),
+            'title': 'Sales dashboard',
+            'opts': self.model._meta,
+            'report': report,
+            'currencies': SalesDaily.objects.order_by('currency').values_list('currency', flat=True).distinct(),
+        }
+        return TemplateResponse(request, 'admin/shop_app/sales_dashboard.html', context)
+
     def has_add_permission(self, request):
         # Transactions should only be created programmatically
         return False
@@ -94,4 +129,30 @@ class TransactionAdmin(admin.ModelAdmin):
             return False
         return super().has_delete_permission(request, obj)
 
+class OrderLineInline(admin.TabularInline):
+    model = OrderLine
+    extra = 0
+    fields = ('name', 'unit_price', 'quantity', 'line_total', 'product')
+    readonly_fields = fields
+    can_delete = False
+
+
+@admin.register(Order)
+class OrderAdmin(admin.ModelAdmin):
+    list_display = ('cart_code', 'user', 'item_count', 'total', 'currency', 'paid', 'created_at')
+    list_filter = ('paid', 'currency', 'created_at')
+    search_fields = ('cart_code', 'transaction__ref', 'user__username', 'user__email')
+    list_select_related = ('user',)
+    readonly_fields = ('transaction', 'user', 'cart_code', 'item_count', 'subtotal', 'tax', 'total', 'currency',
+                       'paid', 'created_at', 'paid_at')
+    inlines = [OrderLineInline]
+    date_hierarchy = 'created_at'
+
+    def has_add_permission(self, request):
+        # Los pedidos se crean al iniciar el pago y no se modifican
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
 # Register additional inlines or customizations as needed
\ No newline at end of file
@@ -0,0 +1,32 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop_app.services.catalog_io import export_catalog
+
+
+class Command(BaseCommand):
+    help = "Exporta el catálogo a CSV o JSONL en streaming"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Archivo de salida ('-' para stdout)")
+        parser.add_argument("--format", choices=["csv", "jsonl"], help="Por defecto se deduce de la extensión")
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        fmt = options["format"] or ("jsonl" if path.endswith((".jsonl", ".ndjson")) else "csv")
+        start = time.time()
+
+        stream = sys.stdout if path == "-" else open(path, "w", newline="", encoding="utf-8")
+        try:
+            total = export_catalog(stream, fmt, batch_size=options["batch_size"])
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
+
+        elapsed = time.time() - start
+        self.stderr.write(self.style.SUCCESS(
+            f"{total} productos exportados en {elapsed:.2f}s ({total / elapsed if elapsed else 0:.0f} filas/s)"
+        ))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from shop_app.services.fake_gateway import FakeGatewayServer
+
+
+class Command(BaseCommand):
+    help = "Arranca una pasarela Flutterwave/PayPal falsa para pruebas de carga del checkout"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8001)
+        parser.add_argument("--latency", type=float, default=0.2, help="Segundos de espera por respuesta")
+        parser.add_argument("--jitter", type=float, default=0.05, help="Variación aleatoria de la latencia (±segundos)")
+        parser.add_argument("--failure-rate", type=float, default=0.0,
+                            help="Fracción de peticiones que responden 500 (0-1)")
+        parser.add_argument("--verbose", action="store_true", help="Registrar cada petición")
+
+    def handle(self, *args, **options):
+        server = FakeGatewayServer(
+            (options["host"], options["port"]),
+            latency=options["latency"],
+            jitter=options["jitter"],
+            failure_rate=options["failure_rate"],
+            verbose=options["verbose"],
+        )
+        base_url = f"http://{options['host']}:{server.server_address[1]}"
+        self.stdout.write(self.style.SUCCESS(
+            f"Pasarela falsa en {base_url} (latencia {options['latency']}s ±{options['jitter']}s, "
+            f"fallos {options['failure_rate']:.0%})\n"
+            f"  FLUTTERWAVE_BASE_URL={base_url}/v3 PAYPAL_BASE_URL={base_url}"
+        ))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop_app.models import Product
+from shop_app.services import catalog, response_cache
+from shop_app.services.images import build_variants
+
+
+class Command(BaseCommand):
+    help = "Genera las derivadas (anchos y WebP/AVIF) de las imágenes de productos existentes"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--force", action="store_true", help="Regenerar aunque el producto ya tenga derivadas")
+        parser.add_argument("--batch-size", type=int, default=100)
+
+    def handle(self, *args, **options):
+        start = time.time()
+        products = Product.objects.exclude(image="").only("id", "name", "image", "image_variants").order_by("id")
+        processed, failed, batch = 0, 0, []
+
+        for product in products.iterator(chunk_size=options["batch_size"]):
+            if product.image_variants and not options["force"]:
+                continue
+            try:
+                variants = build_variants(product.image)
+            except Exception as e:
+                failed += 1
+                self.stderr.write(f"{product.name}: {str(e)}")
+                continue
+            # update() no dispara señales: se invalidan versiones y caché por lotes
+            Product.objects.filter(id=product.id).update(image_variants=variants)
+            batch.append(product.id)
+            processed += 1
+            if len(batch) >= options["batch_size"]:
+                self.invalidate(batch)
+                batch = []
+
+        self.invalidate(batch)
+        self.stdout.write(self.style.SUCCESS(
+            f"Derivadas generadas para {processed} productos ({failed} con error) en {time.time() - start:.2f}s"
+        ))
+
+    def invalidate(self, product_ids):
+        if product_ids:
+            catalog.bump_product_versions(product_ids)
+            catalog.bump_catalog_version()
+            response_cache.invalidate()
@@ -0,0 +1,49 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop_app.services.catalog_io import CatalogImportError, import_catalog, refresh_derived_data
+
+
+class Command(BaseCommand):
+    help = "Importa productos desde CSV o JSONL en lotes (bulk_create/bulk_update)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Archivo a importar ('-' para stdin)")
+        parser.add_argument("--format", choices=["csv", "jsonl"], help="Por defecto se deduce de la extensión")
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--no-update", action="store_true",
+                            help="No actualizar productos existentes con el mismo slug; siempre crear")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        fmt = options["format"] or ("jsonl" if path.endswith((".jsonl", ".ndjson")) else "csv")
+        start = time.time()
+
+        def report(rows):
+            elapsed = time.time() - start
+            self.stdout.write(f"{rows} filas ({rows / elapsed if elapsed else 0:.0f} filas/s)")
+
+        stream = sys.stdin if path == "-" else open(path, newline="", encoding="utf-8")
+        try:
+            created, updated = import_catalog(
+                stream, fmt,
+                batch_size=options["batch_size"],
+                update_existing=not options["no_update"],
+                on_batch=report if options["verbosity"] > 1 else None,
+            )
+        except CatalogImportError as e:
+            raise CommandError(str(e))
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        write_elapsed = time.time() - start
+        refresh_derived_data()
+        total = created + updated
+        self.stdout.write(self.style.SUCCESS(
+            f"{created} creados, {updated} actualizados en {write_elapsed:.2f}s "
+            f"({total / write_elapsed if write_elapsed else 0:.0f} filas/s); "
+            f"índices regenerados en {time.time() - start - write_elapsed:.2f}s"
+        ))
@@ -0,0 +1,132 @@
+import itertools
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlparse
+
+import requests
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from core.authentication import ClaimsRefreshToken
+from shop_app.models import Product
+from shop_app.services.gateways import LatencyStats
+
+
+class Command(BaseCommand):
+    help = ("Prueba de carga del checkout completo (add_item → initiate → callback → estado) contra un "
+            "servidor en marcha, normalmente con las pasarelas apuntando a manage.py fake_gateway")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", default="http://127.0.0.1:8000", help="URL base de la API")
+        parser.add_argument("--users", type=int, default=10, help="Usuarios virtuales simultáneos")
+        parser.add_argument("--checkouts", type=int, default=10, help="Checkouts por usuario virtual")
+        parser.add_argument("--provider", choices=("flutterwave", "paypal", "both"), default="both",
+                            help="Pasarela del checkout ('both' alterna)")
+        parser.add_argument("--poll-interval", type=float, default=0.2)
+        parser.add_argument("--poll-timeout", type=float, default=30,
+                            help="Segundos máximos esperando a que un pago deje de estar 'pending'")
+
+    def handle(self, *args, **options):
+        product_ids = list(Product.objects.values_list("id", flat=True)[:50])
+        if not product_ids:
+            raise CommandError("No hay productos: la prueba necesita al menos uno en el catálogo")
+
+        tokens = self.get_tokens(options["users"])
+        providers = ("flutterwave", "paypal") if options["provider"] == "both" else (options["provider"],)
+        self.base_url = options["url"].rstrip("/")
+        self.options = options
+        self.stats = LatencyStats(samples=options["users"] * options["checkouts"])
+        self.results = {"completed": 0, "failed": 0, "pending": 0, "error": 0}
+        self.lock = threading.Lock()
+
+        self.stdout.write(f"{options['users']} usuarios x {options['checkouts']} checkouts contra {self.base_url}")
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=options["users"]) as executor:
+            for number, token in enumerate(tokens):
+                executor.submit(self.virtual_user, token, product_ids, itertools.islice(
+                    itertools.cycle(providers), number, number + options["checkouts"]))
+        elapsed = time.monotonic() - start
+
+        total = sum(self.results.values())
+        self.stdout.write(self.style.SUCCESS(
+            f"{total} checkouts en {elapsed:.2f}s ({total / elapsed:.1f}/s): " +
+            ", ".join(f"{count} {result}" for result, count in self.results.items())
+        ))
+        self.stdout.write(f"{'operación':<28}{'llamadas':>9}{'errores':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+        for operation, stats in sorted(self.stats.snapshot().items()):
+            self.stdout.write(f"{operation:<28}{stats['calls']:>9}{stats['errors']:>9}{stats['p50_ms']:>9}"
+                              f"{stats['p95_ms']:>9}{stats['p99_ms']:>9}{stats['max_ms']:>9}")
+
+    def get_tokens(self, count):
+        User = get_user_model()
+        tokens = []
+        for number in range(count):
+            user, created = User.objects.get_or_create(
+                username=f"loadtest{number}", defaults={"email": f"loadtest{number}@example.com"})
+            tokens.append(str(ClaimsRefreshToken.for_user(user).access_token))
+        return tokens
+
+    def call(self, session, operation, method, path, **kwargs):
+        start = time.monotonic()
+        try:
+            response = session.request(method, f"{self.base_url}/{path}", timeout=60, **kwargs)
+        except requests.RequestException:
+            self.stats.record(operation, time.monotonic() - start, ok=False)
+            raise
+        self.stats.record(operation, time.monotonic() - start, ok=response.status_code < 400)
+        return response
+
+    def virtual_user(self, token, product_ids, providers):
+        session = requests.Session()
+        session.headers["Authorization"] = f"Bearer {token}"
+        for number, provider in enumerate(providers):
+            start = time.monotonic()
+            try:
+                cart_code = uuid.uuid4().hex[:11]
+                product_id = product_ids[number % len(product_ids)]
+                response = self.call(session, "add_item", "POST", "add_item/",
+                                     json={"cart_code": cart_code, "product_id": product_id})
+                response.raise_for_status()
+                if provider == "flutterwave":
+                    result = self.flutterwave_checkout(session, cart_code)
+                else:
+                    result = self.paypal_checkout(session, cart_code)
+            except (requests.RequestException, KeyError, ValueError) as e:
+                self.stderr.write(f"{provider}: {e}")
+                result = "error"
+            self.stats.record(f"checkout.{provider}", time.monotonic() - start, ok=result == "completed")
+            with self.lock:
+                self.results[result] += 1
+
+    def flutterwave_checkout(self, session, cart_code):
+        response = self.call(session, "initiate_payment", "POST", "initiate_payment/", json={"cart_code": cart_code})
+        response.raise_for_status()
+        # La pasarela falsa devuelve como enlace la URL de retorno con los parámetros del pago
+        params = parse_qs(urlparse(response.json()["data"]["link"]).query)
+        query = {key: params[key][0] for key in ("status", "tx_ref", "transaction_id")}
+        response = self.call(session, "payment_callback", "POST", "payment_callback/", params=query)
+        response.raise_for_status()
+        return self.wait_for_status(session, query["tx_ref"], response.json()["status"])
+
+    def paypal_checkout(self, session, cart_code):
+        response = self.call(session, "initiate_paypal_payment", "POST", "initiate_paypal_payment/",
+                             json={"cart_code": cart_code})
+        response.raise_for_status()
+        params = parse_qs(urlparse(response.json()["approval_url"]).query)
+        query = {key: params[key][0] for key in ("paymentId", "PayerID", "ref")}
+        response = self.call(session, "paypal_payment_callback", "GET", "paypal_payment_callback", params=query)
+        if response.status_code == 202:
+            # PAYPAL_EXECUTE_ASYNC: la ejecución está en cola
+            return self.wait_for_status(session, query["ref"], "pending")
+        return "completed" if response.status_code == 200 else "failed"
+
+    def wait_for_status(self, session, tx_ref, status):
+        deadline = time.monotonic() + self.options["poll_timeout"]
+        while status == "pending" and time.monotonic() < deadline:
+            time.sleep(self.options["poll_interval"])
+            response = self.call(session, "payment_status", "GET", "payment_status", params={"tx_ref": tx_ref})
+            response.raise_for_status()
+            status = response.json()["status"]
+        return status
@@ -0,0 +1,57 @@
+import gzip
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from shop_app.services.cart_cleanup import get_abandoned_days, purge_abandoned_carts
+
+
+class Command(BaseCommand):
+    help = "Archiva en JSONL comprimido y borra por tramos los carritos sin pagar abandonados"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=None,
+                            help="Antigüedad mínima en días (por defecto ABANDONED_CART_DAYS)")
+        parser.add_argument("--chunk-size", type=int, default=500)
+        parser.add_argument("--pause", type=float, default=0,
+                            help="Segundos de espera entre tramos para no saturar la base de datos")
+        parser.add_argument("--archive-dir", default=None,
+                            help="Directorio del archivo .jsonl.gz (por defecto CART_ARCHIVE_DIR)")
+        parser.add_argument("--dry-run", action="store_true", help="Solo contar, sin archivar ni borrar")
+
+    def handle(self, *args, **options):
+        days = options["days"] if options["days"] is not None else get_abandoned_days()
+        start = time.time()
+
+        def report(carts, items):
+            elapsed = time.time() - start
+            self.stdout.write(f"{carts} carritos, {items} líneas ({(carts + items) / elapsed if elapsed else 0:.0f} filas/s)")
+
+        on_chunk = report if options["verbosity"] > 1 else None
+        if options["dry_run"]:
+            carts, items = purge_abandoned_carts(days=days, chunk_size=options["chunk_size"], dry_run=True,
+                                                 on_chunk=on_chunk)
+            self.stdout.write(self.style.WARNING(
+                f"[dry-run] {carts} carritos y {items} líneas sin pagar con más de {days} días"
+            ))
+            return
+
+        archive_dir = options["archive_dir"] or getattr(settings, "CART_ARCHIVE_DIR",
+                                                        os.path.join(settings.BASE_DIR, "archive"))
+        os.makedirs(archive_dir, exist_ok=True)
+        path = os.path.join(archive_dir, f"abandoned-carts-{timezone.now():%Y%m%d-%H%M%S}.jsonl.gz")
+        with gzip.open(path, "wt", encoding="utf-8") as stream:
+            carts, items = purge_abandoned_carts(stream, days=days, chunk_size=options["chunk_size"],
+                                                 pause=options["pause"], on_chunk=on_chunk)
+        if not carts:
+            os.remove(path)
+
+        elapsed = time.time() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"{carts} carritos y {items} líneas archivados y borrados en {elapsed:.2f}s "
+            f"({(carts + items) / elapsed if elapsed else 0:.0f} filas/s)"
+            + (f" -> {path}" if carts else "")
+        ))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from shop_app.services import catalog, facets, response_cache
+
+
+class Command(BaseCommand):
+    help = "Recalcula los conteos de facetas del catálogo (categorías y rangos de precio)"
+
+    def handle(self, *args, **options):
+        total = facets.rebuild_facets()
+        catalog.bump_catalog_version()
+        response_cache.invalidate()
+        self.stdout.write(self.style.SUCCESS(f"{total} facetas recalculadas"))
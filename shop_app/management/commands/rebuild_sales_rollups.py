@@ -0,0 +1,25 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop_app.services.analytics import rebuild
+
+
+class Command(BaseCommand):
+    help = "Recalcula las tablas de estadísticas de ventas desde los pedidos pagados (Order/OrderLine)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--since", default=None,
+                            help="Recalcular solo desde este día (AAAA-MM-DD); por defecto todo el histórico")
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        try:
+            since = date.fromisoformat(options["since"]) if options["since"] else None
+        except ValueError:
+            raise CommandError(f"Invalid --since '{options['since']}'")
+        start = time.time()
+        written = rebuild(since=since, batch_size=options["batch_size"])
+        summary = ", ".join(f"{count} {name}" for name, count in written.items())
+        self.stdout.write(self.style.SUCCESS(f"Rollups recalculados en {time.time() - start:.2f}s: {summary}"))
@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop_app.services import search
+
+
+class Command(BaseCommand):
+    help = "Reconstruye el índice de búsqueda de productos (FTS5 o índice en memoria)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        start = time.time()
+        total = search.rebuild_index(batch_size=options["batch_size"])
+        engine = "FTS5" if search.fts_available() else "memoria"
+        self.stdout.write(self.style.SUCCESS(
+            f"Índice de búsqueda ({engine}) reconstruido para {total} productos en {time.time() - start:.2f}s"
+        ))
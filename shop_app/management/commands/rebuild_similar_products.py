@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop_app.services import similar_products
+
+
+class Command(BaseCommand):
+    help = "Reconstruye el índice de productos similares (SimilarProduct) para todo el catálogo"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        start = time.time()
+        total = similar_products.rebuild_all(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(
+            f"Índice de similares reconstruido para {total} productos con categoría en {time.time() - start:.2f}s"
+        ))
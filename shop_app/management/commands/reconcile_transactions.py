@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from shop_app.services.reconcile import reconcile
+
+
+class Command(BaseCommand):
+    help = "Verifica con la pasarela las transacciones pendientes y actualiza Transaction/Cart"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--older-than", type=int, default=15, help="Minutos desde la creación (por defecto 15)")
+        parser.add_argument("--expire-after", type=int, default=24 * 60,
+                            help="Minutos tras los que una transacción que la pasarela no da por pagada se marca "
+                                 "fallida (0 = nunca; si la pasarela no responde, nunca)")
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument("--workers", type=int, default=8, help="Consultas simultáneas a la pasarela")
+        parser.add_argument("--loop", type=float, default=0,
+                            help="Repetir cada N segundos en lugar de ejecutarse una sola vez")
+
+    def handle(self, *args, **options):
+        while True:
+            start = time.time()
+            totals = reconcile(
+                older_than=options["older_than"],
+                batch_size=options["batch_size"],
+                workers=options["workers"],
+                expire_after=options["expire_after"],
+            )
+            elapsed = time.time() - start
+            self.stdout.write(self.style.SUCCESS(
+                f"{totals['checked']} revisadas en {elapsed:.2f}s: {totals['completed']} completadas, "
+                f"{totals['failed']} fallidas, {totals['pending']} siguen pendientes"
+            ))
+            if not options["loop"]:
+                return
+            close_old_connections()
+            time.sleep(options["loop"])
@@ -0,0 +1,36 @@
+import logging
+
+from django.db import migrations
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = 'shop_app_product_search'
+
+
+def create_search_index(apps, schema_editor):
+    # Solo SQLite con FTS5; en otro caso shop_app.services.search usa el índice en memoria
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    try:
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+            f"USING fts5(name, description, category, tokenize = 'unicode61 remove_diacritics 2')"
+        )
+    except Exception as e:
+        logger.warning(f"FTS5 no disponible, se usará el índice en memoria: {str(e)}")
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop_app', '0008_catalogstate_product_updated_at_product_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
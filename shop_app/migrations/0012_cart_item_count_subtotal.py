@@ -0,0 +1,43 @@
+# Generated by Django 5.1.7 on 2026-10-17 03:38
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import DecimalField, ExpressionWrapper, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def backfill_cart_totals(apps, schema_editor):
+    Cart = apps.get_model('shop_app', 'Cart')
+    CartItem = apps.get_model('shop_app', 'CartItem')
+    items = CartItem.objects.filter(cart=OuterRef('pk')).order_by().values('cart')
+    quantity = items.annotate(total=Sum('quantity')).values('total')
+    amount = items.annotate(
+        total=Sum(ExpressionWrapper(F('quantity') * F('product__price'),
+                                    output_field=DecimalField(max_digits=10, decimal_places=2)))
+    ).values('total')
+    Cart.objects.update(
+        item_count=Coalesce(Subquery(quantity), 0),
+        subtotal=Coalesce(Subquery(amount), Decimal('0.00'),
+                          output_field=DecimalField(max_digits=10, decimal_places=2)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop_app', '0011_catalogfacet_product_product_category_price_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='subtotal',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=10),
+        ),
+        migrations.RunPython(backfill_cart_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.7 on 2026-10-17 03:44
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop_app', '0012_cart_item_count_subtotal'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(fields=['paid', 'modified_at'], name='cart_paid_modified_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.7 on 2026-10-17 03:46
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_lines(apps, schema_editor):
+    # Antes de la restricción: las líneas repetidas se funden en la más antigua sumando cantidades
+    CartItem = apps.get_model('shop_app', 'CartItem')
+    duplicates = (CartItem.objects.order_by().values('cart_id', 'product_id')
+                  .annotate(lines=Count('id'), total=Sum('quantity'), keep=Min('id'))
+                  .filter(lines__gt=1))
+    for duplicate in duplicates:
+        CartItem.objects.filter(id=duplicate['keep']).update(quantity=duplicate['total'])
+        (CartItem.objects.filter(cart_id=duplicate['cart_id'], product_id=duplicate['product_id'])
+         .exclude(id=duplicate['keep']).delete())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop_app', '0013_cart_paid_modified_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_lines, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(fields=('cart', 'product'), name='unique_cart_product'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.7 on 2026-10-17 03:51
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop_app', '0016_paymentevent'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='provider',
+            field=models.CharField(default='flutterwave', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='provider_ref',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['status', 'created_at', 'id'], name='transaction_status_created_idx'),
+        ),
+    ]
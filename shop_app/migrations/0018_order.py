@@ -0,0 +1,89 @@
+# Generated by Django 5.1.7 on 2026-10-17 03:59
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_orders(apps, schema_editor):
+    # Transacciones anteriores: se copian con los precios actuales (los de la compra ya no existen)
+    Transaction = apps.get_model('shop_app', 'Transaction')
+    CartItem = apps.get_model('shop_app', 'CartItem')
+    Order = apps.get_model('shop_app', 'Order')
+    OrderLine = apps.get_model('shop_app', 'OrderLine')
+
+    transactions = list(Transaction.objects.select_related('cart').order_by('id'))
+    for start in range(0, len(transactions), 500):
+        chunk = transactions[start:start + 500]
+        items = {}
+        for item in CartItem.objects.filter(cart_id__in={tx.cart_id for tx in chunk}).select_related('product'):
+            items.setdefault(item.cart_id, []).append(item)
+
+        orders = []
+        for tx in chunk:
+            subtotal = sum((item.quantity * item.product.price for item in items.get(tx.cart_id, [])), Decimal('0.00'))
+            orders.append(Order(
+                transaction=tx, user_id=tx.user_id or tx.cart.user_id, cart_code=tx.cart.cart_code,
+                item_count=sum(item.quantity for item in items.get(tx.cart_id, [])),
+                subtotal=subtotal, tax=max(tx.amount - subtotal, Decimal('0.00')), total=tx.amount,
+                currency=tx.currency, paid=tx.status == 'completed',
+                paid_at=tx.modified_at if tx.status == 'completed' else None,
+            ))
+        Order.objects.bulk_create(orders)
+        OrderLine.objects.bulk_create([
+            OrderLine(order=order, product=item.product, name=item.product.name, image=item.product.image.name,
+                      unit_price=item.product.price, quantity=item.quantity,
+                      line_total=item.quantity * item.product.price)
+            for order, tx in zip(orders, chunk) for item in items.get(tx.cart_id, [])
+        ])
+    created_at = Transaction.objects.filter(pk=OuterRef('transaction_id')).values('created_at')[:1]
+    Order.objects.update(created_at=Subquery(created_at))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop_app', '0017_transaction_provider'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='transaction',
+            name='user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.CreateModel(
+            name='Order',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cart_code', models.CharField(max_length=11)),
+                ('item_count', models.PositiveIntegerField(default=0)),
+                ('subtotal', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('tax', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=10)),
+                ('total', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('currency', models.CharField(max_length=10)),
+                ('paid', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('paid_at', models.DateTimeField(blank=True, null=True)),
+                ('transaction', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='order', to='shop_app.transaction')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='orders', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='OrderLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('image', models.ImageField(blank=True, upload_to='img')),
+                ('unit_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('quantity', models.PositiveIntegerField()),
+                ('line_total', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='shop_app.order')),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='shop_app.product')),
+            ],
+        ),
+        migrations.RunPython(backfill_orders, migrations.RunPython.noop),
+    ]
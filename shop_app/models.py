@@ -1,8 +1,14 @@
+import logging
+from decimal import Decimal
+
 from django.db import models
+from django.db.models import DecimalField, ExpressionWrapper, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.utils.text import slugify
 
 from django.conf import settings
 
+logger = logging.getLogger(__name__)
 
 # Create your models here.
 class Product(models.Model):
@@ -13,9 +19,19 @@ class Product(models.Model):
     name = models.CharField(max_length=100)
     slug = models.SlugField(blank=True, null=True)
     image = models.ImageField(upload_to="img")
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     description = models.TextField(blank=True, null=True)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     category = models.CharField(max_length=15, choices=CATEGORY, blank=True, null=True)
+    version = models.PositiveIntegerField(default=1, editable=False)
+    updated_at = models.DateTimeField(auto_now=True, blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            # Filtros del catálogo: categoría + rango de precio, y orden por precio con keyset
+            models.Index(fields=['category', 'price', 'id'], name='product_category_price_idx'),
+            models.Index(fields=['price', 'id'], name='product_price_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -23,31 +39,111 @@ class Product(models.Model):
     def save(self, *args, **kwargs):
 
         if not self.slug:
-            self.slug = slugify(self.name)
-            unique_slug = self.slug
-            counter = 1
-            if Products.objects.filter(slug=unique_slug).exists():
-                unique_slug = f"{self.slug}-{counter}"
-                counter += 1
-            self.slug = unique_slug
-            
+            # Misma asignación que la importación masiva: una consulta para todos los sufijos
+            from .services.catalog_io import allocate_slugs
+            self.slug = allocate_slugs([slugify(self.name)], exclude_pk=self.pk)[0]
+
+        # Imagen recién subida: generar las derivadas (anchos y formatos) antes de guardar
+        if self.image and not self.image._committed:
+            from .services.images import build_variants
+            try:
+                self.image_variants = build_variants(self.image)
+            except Exception:
+                # Las derivadas de la imagen anterior ya no corresponden: mejor sin srcset
+                self.image_variants = {}
+                logger.exception("Error al generar derivadas de imagen para %s", self.name)
+
         super().save(*args, **kwargs)
 
+class CatalogState(models.Model):
+    """Fila única con la versión global del catálogo; sube con cada cambio en Product"""
+    version = models.PositiveBigIntegerField(default=1)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Catalog v{self.version}"
+
+class CatalogFacet(models.Model):
+    """Conteos precalculados para los filtros del catálogo (por categoría y por rango de precio)"""
+    KIND_CATEGORY = 'category'
+    KIND_PRICE = 'price'
+    KIND_CHOICES = ((KIND_CATEGORY, 'Category'), (KIND_PRICE, 'Price bucket'))
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    key = models.CharField(max_length=30)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'key'], name='unique_catalog_facet'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind}:{self.key} = {self.count}"
+
 class Cart(models.Model):
     cart_code = models.CharField(max_length=11, unique=True)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, blank=True, null=True)
     paid = models.BooleanField(default=False)
+    # Totales desnormalizados; se recalculan con refresh_totals() cada vez que cambian los CartItem
+    item_count = models.PositiveIntegerField(default=0)
+    subtotal = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal("0.00"))
     created_at = models.DateTimeField(auto_now_add=True, blank=True, null=True)
     modified_at = models.DateTimeField(auto_now=True, blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            # Búsqueda de carritos abandonados (purge_abandoned_carts)
+            models.Index(fields=['paid', 'modified_at'], name='cart_paid_modified_idx'),
+            # Carrito abierto actual de un usuario (services.cart.get_open_cart)
+            models.Index(fields=['user', 'paid', 'modified_at'], name='cart_user_open_idx'),
+        ]
+
     def __str__(self):
         return self.cart_code
 
+    @staticmethod
+    def refresh_totals_for(cart_ids):
+        """Recalcula item_count y subtotal con un único UPDATE (atómico) por lote de carritos"""
+        items = CartItem.objects.filter(cart=OuterRef("pk")).order_by().values("cart")
+        quantity = items.annotate(total=Sum("quantity")).values("total")
+        amount = items.annotate(
+            total=Sum(ExpressionWrapper(F("quantity") * F("product__price"),
+                                        output_field=DecimalField(max_digits=10, decimal_places=2)))
+        ).values("total")
+        Cart.objects.filter(pk__in=cart_ids).update(
+            item_count=Coalesce(Subquery(quantity), 0),
+            subtotal=Coalesce(Subquery(amount), Decimal("0.00"),
+                              output_field=DecimalField(max_digits=10, decimal_places=2)),
+        )
+
+    def refresh_totals(self):
+        Cart.refresh_totals_for([self.pk])
+        self.refresh_from_db(fields=["item_count", "subtotal"])
+
+class RetiredCartCode(models.Model):
+    """
+    Código de un carrito anónimo que se fusionó con el del usuario al iniciar sesión
+    (services.cart.merge_carts). Las peticiones que aún lo usan siguen con `cart`.
+    """
+    cart_code = models.CharField(max_length=11, unique=True)
+    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='retired_codes')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.cart_code} -> {self.cart_id}"
+
 class CartItem(models.Model):
     cart = models.ForeignKey(Cart, related_name='items', on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.IntegerField(default=1)
 
+    class Meta:
+        constraints = [
+            # Una línea por producto: las sumas concurrentes se hacen con UPDATE quantity = quantity + n
+            models.UniqueConstraint(fields=['cart', 'product'], name='unique_cart_product'),
+        ]
+
     def __str__(self):
         return f"{self.quantity} x {self.product.name} in cart {self.cart.id}"
 
@@ -57,9 +153,157 @@ class Transaction(models.Model):
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     currency = models.CharField(max_length=10, default="NGN")
     status = models.CharField(max_length=20, default='pending')
-    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, blank=True, null=True)
+    # Pasarela y su identificador del pago (id de pago de PayPal), para reconcile_transactions
+    provider = models.CharField(max_length=20, default='flutterwave')
+    provider_ref = models.CharField(max_length=255, blank=True, default='')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     modified_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Transacciones pendientes más antiguas que N minutos (reconcile_transactions)
+            models.Index(fields=['status', 'created_at', 'id'], name='transaction_status_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"Transaction {self.ref} - {self.status}"
+
+class Order(models.Model):
+    """
+    Copia inmutable del carrito al crear la Transaction: precios, nombres e imágenes del
+    momento de la compra. El historial y los recibos leen de aquí, no de Cart/Product.
+    Sobrevive al borrado de la transacción, del carrito o del usuario.
+    """
+    transaction = models.OneToOneField(Transaction, on_delete=models.SET_NULL, blank=True, null=True,
+                                       related_name='order')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, blank=True, null=True,
+                             related_name='orders')
+    cart_code = models.CharField(max_length=11)
+    item_count = models.PositiveIntegerField(default=0)
+    subtotal = models.DecimalField(max_digits=10, decimal_places=2)
+    tax = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal("0.00"))
+    total = models.DecimalField(max_digits=10, decimal_places=2)
+    currency = models.CharField(max_length=10)
+    paid = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    paid_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            # Historial de pedidos pagados de un usuario, del más reciente al más antiguo (GET /orders)
+            models.Index(fields=['user', 'paid', 'created_at', 'id'], name='order_user_paid_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"Order {self.cart_code} ({self.transaction_id})"
+
+class OrderLine(models.Model):
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='lines')
+    # Solo como referencia: si el producto se borra la línea se conserva
+    product = models.ForeignKey(Product, on_delete=models.SET_NULL, blank=True, null=True, related_name='+')
+    name = models.CharField(max_length=100)
+    image = models.ImageField(upload_to="img", blank=True)
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+    quantity = models.PositiveIntegerField()
+    line_total = models.DecimalField(max_digits=10, decimal_places=2)
+
+    def __str__(self):
+        return f"{self.quantity} x {self.name} in order {self.order_id}"
+
+class SalesHourly(models.Model):
+    """Ventas pagadas por hora y moneda; se suman al completar cada transacción (services.analytics)"""
+    hour = models.DateTimeField()
+    currency = models.CharField(max_length=10)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal("0.00"))
+    orders = models.PositiveIntegerField(default=0)
+    units = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['hour', 'currency'], name='unique_sales_hourly'),
+        ]
+
+    def __str__(self):
+        return f"{self.hour:%Y-%m-%d %H}h {self.currency}: {self.revenue}"
+
+class SalesDaily(models.Model):
+    day = models.DateField()
+    currency = models.CharField(max_length=10)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal("0.00"))
+    orders = models.PositiveIntegerField(default=0)
+    units = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'currency'], name='unique_sales_daily'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.currency}: {self.revenue}"
+
+class ProductSalesDaily(models.Model):
+    day = models.DateField()
+    # Sin restricción de clave foránea: el histórico se conserva si el producto se borra
+    product = models.ForeignKey(Product, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    name = models.CharField(max_length=100)
+    currency = models.CharField(max_length=10)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal("0.00"))
+    units = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'product', 'currency'], name='unique_product_sales_daily'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.name} {self.currency}: {self.units}"
+
+class CategorySalesDaily(models.Model):
+    day = models.DateField()
+    category = models.CharField(max_length=15, blank=True)
+    currency = models.CharField(max_length=10)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal("0.00"))
+    units = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'category', 'currency'], name='unique_category_sales_daily'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.category or '-'} {self.currency}: {self.units}"
+
+class PaymentEvent(models.Model):
+    """Webhooks recibidos de las pasarelas; la restricción única evita procesar dos veces el mismo evento"""
+    provider = models.CharField(max_length=20)
+    event_id = models.CharField(max_length=100)
+    event_type = models.CharField(max_length=50, blank=True)
+    tx_ref = models.CharField(max_length=255, db_index=True)
+    payload = models.JSONField(default=dict)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['provider', 'event_id'], name='unique_payment_event'),
+        ]
+
+    def __str__(self):
+        return f"{self.provider} {self.event_type} {self.tx_ref}"
+
+class SimilarProduct(models.Model):
+    """Índice precalculado de productos similares (misma categoría, ordenados por cercanía de precio)"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='similar_links')
+    similar = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='similar_to_links')
+    rank = models.PositiveSmallIntegerField()
+    distance = models.DecimalField(max_digits=10, decimal_places=2)
+
+    class Meta:
+        ordering = ['product', 'rank']
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'similar'], name='unique_similar_product'),
+        ]
+
     def __str__(self):
-        return f"Transaction {self.ref} - {self.status}"
\ No newline at end of file
+        return f"{self.product_id} -> {self.similar_id} (#{self.rank})"
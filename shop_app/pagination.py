@@ -0,0 +1,99 @@
+import base64
+import json
+
+from django.conf import settings
+from django.db.models import Q
+
+
+class InvalidPage(Exception):
+    pass
+
+
+class KeysetPagination:
+    """
+    Paginación por cursor (keyset) sobre un orden estable.
+    Cada orden es una tupla de campos que termina siempre en un campo único ("id"),
+    así el cursor apunta a una fila exacta y no depende de OFFSET.
+    """
+    cursor_query_param = "cursor"
+    page_size_query_param = "limit"
+    ordering_query_param = "ordering"
+
+    def __init__(self, orderings, default_ordering, page_size=None, max_page_size=None):
+        self.orderings = orderings
+        self.default_ordering = default_ordering
+        self.page_size = page_size or getattr(settings, "PRODUCTS_PAGE_SIZE", 24)
+        self.max_page_size = max_page_size or getattr(settings, "PRODUCTS_MAX_PAGE_SIZE", 100)
+
+    def is_requested(self, request):
+        params = request.query_params
+        return self.cursor_query_param in params or self.page_size_query_param in params
+
+    def get_ordering(self, request):
+        ordering = request.query_params.get(self.ordering_query_param) or self.default_ordering
+        if ordering not in self.orderings:
+            raise InvalidPage(f"Invalid ordering '{ordering}'. Options: {', '.join(self.orderings)}")
+        return ordering
+
+    def get_page_size(self, request):
+        raw = request.query_params.get(self.page_size_query_param)
+        if not raw:
+            return self.page_size
+        try:
+            size = int(raw)
+        except ValueError:
+            raise InvalidPage(f"Invalid {self.page_size_query_param} '{raw}'")
+        if size < 1:
+            raise InvalidPage(f"{self.page_size_query_param} must be positive")
+        return min(size, self.max_page_size)
+
+    def paginate_queryset(self, queryset, request):
+        """Devuelve (lista de objetos de la página, cursor siguiente o None)"""
+        ordering = self.get_ordering(request)
+        fields = self.orderings[ordering]
+        page_size = self.get_page_size(request)
+
+        queryset = queryset.order_by(*fields)
+        raw_cursor = request.query_params.get(self.cursor_query_param)
+        if raw_cursor:
+            position = self.decode_cursor(raw_cursor, ordering, queryset.model)
+            queryset = queryset.filter(self.build_filter(fields, position))
+
+        page = list(queryset[:page_size + 1])
+        if len(page) <= page_size:
+            return page, None
+
+        page = page[:page_size]
+        return page, self.encode_cursor(page[-1], ordering, fields)
+
+    def build_filter(self, fields, position):
+        # (a > x) OR (a = x AND b > y) OR ... respetando la dirección de cada campo
+        condition = Q()
+        for i, field in enumerate(fields):
+            name = field.lstrip("-")
+            lookup = "lt" if field.startswith("-") else "gt"
+            clause = Q(**{f"{name}__{lookup}": position[i]})
+            for j, previous in enumerate(fields[:i]):
+                clause &= Q(**{previous.lstrip("-"): position[j]})
+            condition |= clause
+        return condition
+
+    def encode_cursor(self, obj, ordering, fields):
+        values = [str(getattr(obj, field.lstrip("-"))) for field in fields]
+        payload = json.dumps({"o": ordering, "v": values}, separators=(",", ":"))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+    def decode_cursor(self, raw_cursor, ordering, model):
+        try:
+            padded = raw_cursor + "=" * (-len(raw_cursor) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            values = payload["v"]
+            fields = self.orderings[ordering]
+            if payload["o"] != ordering or len(values) != len(fields):
+                raise ValueError
+            return [
+                model._meta.get_field(field.lstrip("-")).to_python(value)
+                for field, value in zip(fields, values)
+            ]
+        except Exception:
+            raise InvalidPage("Invalid cursor")
@@ -1,20 +1,44 @@
 from rest_framework import serializers
-from .models import Product, Cart, CartItem
+from .models import Product, Cart, CartItem, Order, OrderLine
+from .services.similar_products import get_similar_limit
+from .services.images import get_srcset
 from django.contrib.auth import get_user_model
 
 class ProductSerializer(serializers.ModelSerializer):
+    image_srcset = serializers.SerializerMethodField()
     class Meta:
         model = Product
-        fields = ["id", "name", "slug", "image", "description", "category", "price"]
+        fields = ["id", "name", "slug", "image", "image_srcset", "description", "category", "price"]
+
+    # Columnas que hay que cargar para cada campo que no es directamente un campo del modelo
+    source_columns = {"image_srcset": "image_variants"}
+
+    def __init__(self, *args, **kwargs):
+        # Permite proyectar solo algunos campos: ProductSerializer(qs, many=True, fields=["id", "name"])
+        fields = kwargs.pop("fields", None)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for field_name in set(self.fields) - set(fields):
+                self.fields.pop(field_name)
+
+    def get_image_srcset(self, product):
+        return get_srcset(product.image_variants)
 
 class DetailedProductSerializer(serializers.ModelSerializer):
     similar_products = serializers.SerializerMethodField()
+    image_srcset = serializers.SerializerMethodField()
     class Meta:
         model = Product
-        fields = ["id", "name", "price", "slug", "image", "description", "similar_products"]
+        fields = ["id", "name", "price", "slug", "image", "image_srcset", "description", "similar_products"]
+
+    def get_image_srcset(self, product):
+        return get_srcset(product.image_variants)
 
     def get_similar_products(self, product):
-        products = Product.objects.filter(category=product.category).exclude(id=product.id)
+        # Lee el índice precalculado (SimilarProduct) en lugar de recorrer toda la categoría
+        limit = self.context.get("similar_limit", get_similar_limit())
+        products = (Product.objects.filter(similar_to_links__product=product)
+                    .order_by("similar_to_links__rank")[:limit])
         serializer = ProductSerializer(products, many=True)
         return serializer.data
 
@@ -38,14 +62,10 @@ class CartSerializer(serializers.ModelSerializer):
         fields = ["id", "cart_code", "items", "sum_total", "num_of_items", "created_at", "modified_at"]
 
     def get_sum_total(self, cart):
-        items = cart.items.all()
-        total = sum([item.product.price * item.quantity for item in items])
-        return total
+        return cart.subtotal
 
     def get_num_of_items(self, cart):
-        items = cart.items.all()
-        total = sum([item.quantity for item in items])
-        return total
+        return cart.item_count
 
 class SimpleCartSerializer(serializers.ModelSerializer):
     num_of_items = serializers.SerializerMethodField()
@@ -54,32 +74,32 @@ class SimpleCartSerializer(serializers.ModelSerializer):
         fields = ["id", "cart_code", "num_of_items"]
 
     def get_num_of_items(self, cart):
-        num_of_items = sum([item.quantity for item in cart.items.all()])
-        return num_of_items
+        return cart.item_count
 
-class NewCartItemSerializer(serializers.ModelSerializer):
-    product = ProductSerializer(read_only=True)
-    order_id = serializers.SerializerMethodField()
-    order_date = serializers.SerializerMethodField()
+class OrderLineSerializer(serializers.ModelSerializer):
+    """Línea compacta de un pedido: el producto tal como era al comprarlo"""
+    image = serializers.SerializerMethodField()
     class Meta:
-        model = CartItem
-        fields = ["id", "product", "quantity", "order_id", "order_date"]
+        model = OrderLine
+        fields = ["product_id", "name", "image", "unit_price", "quantity", "line_total"]
 
-    def get_order_id(self, cartitem):
-        order_id = cartitem.cart.cart_code
-        return order_id
+    def get_image(self, line):
+        return line.image.url if line.image else None
 
-    def get_order_date(self, cartitem):
-        order_date = cartitem.cart.modified_at
-        return order_date
+class OrderSerializer(serializers.ModelSerializer):
+    order_id = serializers.CharField(source="cart_code")
+    lines = OrderLineSerializer(many=True, read_only=True)
+    class Meta:
+        model = Order
+        fields = ["id", "order_id", "created_at", "paid_at", "item_count", "subtotal", "tax", "total", "currency", "lines"]
 
 class UserSerializer(serializers.ModelSerializer):
-    items = serializers.SerializerMethodField()
+    order_count = serializers.SerializerMethodField()
     class Meta:
         model = get_user_model()
-        fields = ["id", "username", "first_name", "last_name", "email", "city", "state", "address", "phone", "items"]
+        fields = ["id", "username", "first_name", "last_name", "email", "city", "state", "address", "phone",
+                  "order_count"]
 
-    def get_items(self, user):
-        cartitems = CartItem.objects.filter(cart__user=user, cart__paid=True)[:10]
-        serializer = NewCartItemSerializer(cartitems, many=True)
-        return serializer.data
\ No newline at end of file
+    def get_order_count(self, user):
+        # El historial completo está en GET /orders (paginado)
+        return Order.objects.filter(user=user, paid=True).count()
@@ -0,0 +1 @@
+# Servicios del catálogo y del carrito usados por las vistas, señales y comandos
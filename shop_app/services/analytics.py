@@ -0,0 +1,170 @@
+"""
+Estadísticas de ventas sobre tablas resumen (rollups).
+
+Al completarse una transacción, complete_transactions suma su pedido a SalesHourly,
+SalesDaily, ProductSalesDaily y CategorySalesDaily (en la misma transacción de BD, así que
+un pago se cuenta una sola vez). Los informes solo leen esas tablas: su coste depende del
+número de días del periodo, no del número de pedidos. rebuild() (comando
+rebuild_sales_rollups) los recalcula desde Order/OrderLine.
+"""
+from datetime import date, datetime, time, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Max, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate, TruncHour
+from django.utils import timezone
+
+from shop_app.models import CategorySalesDaily, Order, OrderLine, ProductSalesDaily, SalesDaily, SalesHourly
+
+ROLLUPS = (
+    (SalesHourly, ('hour', 'currency')),
+    (SalesDaily, ('day', 'currency')),
+    (ProductSalesDaily, ('day', 'product_id', 'currency')),
+    (CategorySalesDaily, ('day', 'category', 'currency')),
+)
+
+
+def _add(rows, key, **values):
+    # Los textos (nombre del producto) se sustituyen; los números se suman
+    row = rows.setdefault(key, {})
+    for field, value in values.items():
+        row[field] = value if isinstance(value, str) else row.get(field, 0) + value
+
+
+def _increment(model, key_fields, rows):
+    """Suma `rows` ({clave: {campo: incremento}}) a las filas del rollup, creándolas si faltan"""
+    if not rows:
+        return
+    # Primero se asegura que existen todas las filas y después se bloquean, para que dos pagos
+    # simultáneos del mismo día no se pisen
+    model.objects.bulk_create([model(**dict(zip(key_fields, key))) for key in rows], ignore_conflicts=True)
+    filters = {f"{field}__in": {key[i] for key in rows} for i, field in enumerate(key_fields)}
+    existing = {tuple(getattr(obj, field) for field in key_fields): obj
+                for obj in model.objects.select_for_update().filter(**filters)}
+
+    changed = set()
+    for key, values in rows.items():
+        obj = existing[key]
+        for field, value in values.items():
+            setattr(obj, field, value if isinstance(value, str) else getattr(obj, field) + value)
+            changed.add(field)
+    model.objects.bulk_update([existing[key] for key in rows], sorted(changed))
+
+
+def record_paid_orders(refs):
+    """Suma a los rollups los pedidos de las transacciones `refs`, recién completadas"""
+    orders = list(Order.objects.filter(transaction__ref__in=refs, paid=True, paid_at__isnull=False)
+                  .values_list('id', 'paid_at', 'currency', 'total', 'item_count'))
+    if not orders:
+        return
+
+    hourly, daily, products, categories = {}, {}, {}, {}
+    order_days = {}
+    for order_id, paid_at, currency, total, item_count in orders:
+        moment = timezone.localtime(paid_at)
+        day, hour = moment.date(), moment.replace(minute=0, second=0, microsecond=0)
+        order_days[order_id] = (day, currency)
+        _add(hourly, (hour, currency), revenue=total, orders=1, units=item_count)
+        _add(daily, (day, currency), revenue=total, orders=1, units=item_count)
+
+    lines = (OrderLine.objects.filter(order_id__in=order_days)
+             .values_list('order_id', 'product_id', 'name', 'product__category', 'quantity', 'line_total'))
+    for order_id, product_id, name, category, quantity, line_total in lines:
+        day, currency = order_days[order_id]
+        if product_id is not None:
+            _add(products, (day, product_id, currency), name=name, revenue=line_total, units=quantity)
+        _add(categories, (day, category or '', currency), revenue=line_total, units=quantity)
+
+    with transaction.atomic():
+        for (model, key_fields), rows in zip(ROLLUPS, (hourly, daily, products, categories)):
+            _increment(model, key_fields, rows)
+
+
+def rebuild(since=None, batch_size=1000):
+    """
+    Recalcula los rollups desde los pedidos pagados (todos o desde el día `since`) con
+    agregaciones en la base de datos. Devuelve {modelo: filas escritas}.
+    """
+    orders = Order.objects.filter(paid=True, paid_at__isnull=False)
+    lines = OrderLine.objects.filter(order__paid=True, order__paid_at__isnull=False)
+    if since is not None:
+        start = timezone.make_aware(datetime.combine(since, time.min))
+        orders = orders.filter(paid_at__gte=start)
+        lines = lines.filter(order__paid_at__gte=start)
+
+    totals = dict(revenue=Sum('total'), orders=Count('id'), units=Sum('item_count'))
+    querysets = (
+        orders.annotate(hour=TruncHour('paid_at')).values('hour', 'currency').annotate(**totals),
+        orders.annotate(day=TruncDate('paid_at')).values('day', 'currency').annotate(**totals),
+        (lines.filter(product_id__isnull=False).annotate(day=TruncDate('order__paid_at'))
+         .values('day', 'product_id', currency=F('order__currency'))
+         .annotate(name=Max('name'), revenue=Sum('line_total'), units=Sum('quantity'))),
+        (lines.annotate(day=TruncDate('order__paid_at'))
+         .values('day', category=Coalesce('product__category', Value('')), currency=F('order__currency'))
+         .annotate(revenue=Sum('line_total'), units=Sum('quantity'))),
+    )
+
+    written = {}
+    with transaction.atomic():
+        for (model, key_fields), queryset in zip(ROLLUPS, querysets):
+            existing = model.objects.all()
+            if since is not None:
+                existing = existing.filter(**({'hour__gte': start} if model is SalesHourly else {'day__gte': since}))
+            existing.delete()
+            rows = [model(**row) for row in queryset.order_by()]
+            model.objects.bulk_create(rows, batch_size=batch_size)
+            written[model.__name__] = len(rows)
+    return written
+
+
+# --- Informes ----------------------------------------------------------------
+
+def get_period(params, today=None):
+    """
+    (start, end) a partir de ?start=AAAA-MM-DD&end=AAAA-MM-DD o ?days=N (por defecto
+    SALES_REPORT_DAYS, hasta hoy). ValueError si los parámetros no son válidos.
+    """
+    today = today or timezone.localdate()
+    if params.get('start'):
+        start = date.fromisoformat(params['start'])
+        end = date.fromisoformat(params['end']) if params.get('end') else today
+    else:
+        days = int(params.get('days') or getattr(settings, 'SALES_REPORT_DAYS', 30))
+        if days < 1:
+            raise ValueError("days must be positive")
+        start, end = today - timedelta(days=days - 1), today
+    if start > end:
+        raise ValueError("start must not be after end")
+    if (end - start).days >= getattr(settings, 'SALES_REPORT_MAX_DAYS', 366):
+        raise ValueError("period too long")
+    return start, end
+
+
+def sales_report(start, end, currency=None, top=10, hours=24):
+    """Serie diaria, totales, productos y categorías más vendidos y últimas `hours` horas"""
+    def period(queryset):
+        queryset = queryset.filter(day__range=(start, end))
+        return queryset.filter(currency=currency) if currency else queryset
+
+    daily = period(SalesDaily.objects.all())
+    since = timezone.localtime().replace(minute=0, second=0, microsecond=0) - timedelta(hours=hours - 1)
+    hourly = SalesHourly.objects.filter(hour__gte=since)
+    if currency:
+        hourly = hourly.filter(currency=currency)
+
+    return {
+        'start': start,
+        'end': end,
+        'currency': currency,
+        'totals': list(daily.values('currency').order_by('currency')
+                       .annotate(revenue=Sum('revenue'), orders=Sum('orders'), units=Sum('units'))),
+        'daily': list(daily.order_by('day', 'currency').values('day', 'currency', 'revenue', 'orders', 'units')),
+        'hourly': list(hourly.order_by('hour', 'currency').values('hour', 'currency', 'revenue', 'orders', 'units')),
+        'top_products': list(period(ProductSalesDaily.objects.all()).values('product_id', 'currency')
+                             .annotate(name=Max('name'), units=Sum('units'), revenue=Sum('revenue'))
+                             .order_by('-units', 'product_id')[:top]),
+        'categories': list(period(CategorySalesDaily.objects.all()).values('category', 'currency')
+                           .annotate(units=Sum('units'), revenue=Sum('revenue'))
+                           .order_by('currency', '-revenue', 'category')),
+    }
@@ -0,0 +1,215 @@
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from shop_app.models import Cart, CartItem, Product, RetiredCartCode
+from shop_app.services import cart_store
+
+CART_OPERATIONS = ("add", "set", "remove")
+
+
+class CartOperationError(Exception):
+    pass
+
+
+def get_cart_by_code(cart_code, **filters):
+    """
+    Carrito con ese código o, si el código se retiró al fusionar carritos, el carrito en el
+    que se fusionó. Solo consulta RetiredCartCode cuando el código no existe.
+    """
+    try:
+        return Cart.objects.get(cart_code=cart_code, **filters)
+    except Cart.DoesNotExist:
+        return Cart.objects.get(retired_codes__cart_code=cart_code, **filters)
+
+
+def get_or_create_cart(cart_code):
+    try:
+        return get_cart_by_code(cart_code)
+    except Cart.DoesNotExist:
+        cart, created = Cart.objects.get_or_create(cart_code=cart_code)
+        return cart
+
+
+def _lines_changed(cart):
+    """Lo que hacen las señales de CartItem, para las escrituras hechas con update()"""
+    Cart.refresh_totals_for([cart.id])
+    cart_store.invalidate(cart.cart_code)
+
+
+def add_to_cart(cart, product, quantity=1):
+    """
+    Suma `quantity` unidades a la línea (cart, product) sin leerla antes: INSERT y, si la
+    restricción unique_cart_product indica que ya existe, UPDATE quantity = quantity + n.
+    Dos clics simultáneos suman los dos, sin bloqueos ni reintentos.
+    """
+    try:
+        with transaction.atomic():
+            item = CartItem.objects.create(cart=cart, product=product, quantity=quantity)
+    except IntegrityError:
+        CartItem.objects.filter(cart=cart, product=product).update(quantity=F("quantity") + quantity)
+        item = CartItem.objects.get(cart=cart, product=product)
+        _lines_changed(cart)
+    item.cart = cart
+    item.product = product
+    return item
+
+
+def update_item_quantity(item_id, quantity=None, delta=None):
+    """
+    Fija la cantidad (quantity) o la suma/resta de forma atómica (delta) con un solo UPDATE.
+    Si queda en 0 o menos se borra la línea. Devuelve el CartItem con su producto.
+    """
+    items = CartItem.objects.filter(id=item_id)
+    updated = items.update(quantity=F("quantity") + delta if delta is not None else quantity)
+    if not updated:
+        raise CartItem.DoesNotExist(f"Cart item {item_id} does not exist")
+    try:
+        item = CartItem.objects.select_related("cart", "product").get(id=item_id)
+    except CartItem.DoesNotExist:
+        # Otra petición la dejó en 0 y la borró entre medias: para esta también queda borrada
+        return CartItem(id=item_id, quantity=0)
+    if item.quantity <= 0:
+        # Condicional por si otra petición volvió a sumar entre medias
+        items.filter(quantity__lte=0).delete()
+    else:
+        _lines_changed(item.cart)
+    return item
+
+
+def _parse_quantity(operation, default=None):
+    raw = operation.get("quantity", default)
+    try:
+        return int(raw)
+    except (TypeError, ValueError):
+        raise CartOperationError(f"Invalid quantity in operation {operation}")
+
+
+def apply_cart_operations(cart_code, operations):
+    """
+    Aplica una lista de operaciones sobre un carrito en una sola transacción:
+      {"op": "add", "product_id": 1, "quantity": 2}     suma unidades (crea la línea si no existe)
+      {"op": "set", "product_id": 1, "quantity": 5}     fija la cantidad (<= 0 elimina la línea)
+      {"op": "remove", "product_id": 1}                 elimina la línea
+    En "set" y "remove" también se acepta "item_id" en lugar de "product_id".
+    Las escrituras se hacen con bulk_create/bulk_update y un único DELETE.
+    """
+    if not isinstance(operations, list) or not operations:
+        raise CartOperationError("'operations' must be a non-empty list")
+
+    with transaction.atomic():
+        cart = get_or_create_cart(cart_code)
+        if cart.paid:
+            raise CartOperationError("Cart is already paid")
+        if cart.cart_code != cart_code:
+            # Código retirado: el llamante solo escribió los cambios pendientes del código viejo
+            cart_store.invalidate(cart.cart_code)
+
+        items = {item.product_id: item for item in CartItem.objects.select_for_update().filter(cart=cart)}
+        product_by_item = {str(item.id): product_id for product_id, item in items.items()}
+        quantities = {product_id: item.quantity for product_id, item in items.items()}
+
+        requested_products = set()
+        parsed = []
+        for operation in operations:
+            op = operation.get("op") if isinstance(operation, dict) else None
+            if op not in CART_OPERATIONS:
+                raise CartOperationError(f"Unknown operation {operation}. Options: {', '.join(CART_OPERATIONS)}")
+            product_id = operation.get("product_id")
+            if product_id is None and op != "add" and operation.get("item_id") is not None:
+                product_id = product_by_item.get(str(operation["item_id"]))
+                if product_id is None:
+                    raise CartOperationError(f"Item {operation['item_id']} is not in cart {cart_code}")
+            try:
+                product_id = int(product_id)
+            except (TypeError, ValueError):
+                raise CartOperationError(f"Missing or invalid product_id in operation {operation}")
+            requested_products.add(product_id)
+            parsed.append((op, product_id, operation))
+
+        # Solo se consultan los productos que aún no están en el carrito
+        unknown = requested_products - set(quantities)
+        missing = unknown - set(Product.objects.filter(id__in=unknown).values_list("id", flat=True)) if unknown else set()
+        if missing:
+            raise CartOperationError(f"Products not found: {', '.join(str(p) for p in sorted(missing))}")
+
+        for op, product_id, operation in parsed:
+            if op == "add":
+                quantities[product_id] = quantities.get(product_id, 0) + _parse_quantity(operation, 1)
+            elif op == "set":
+                quantities[product_id] = _parse_quantity(operation)
+            else:
+                quantities[product_id] = 0
+
+        to_create, to_update, to_delete = [], [], []
+        for product_id, quantity in quantities.items():
+            item = items.get(product_id)
+            if quantity <= 0:
+                if item:
+                    to_delete.append(item.id)
+            elif item is None:
+                to_create.append(CartItem(cart=cart, product_id=product_id, quantity=quantity))
+            elif item.quantity != quantity:
+                item.quantity = quantity
+                to_update.append(item)
+
+        # Si otra petición creó la misma línea entre medias, gana la cantidad calculada aquí
+        CartItem.objects.bulk_create(to_create, update_conflicts=True, unique_fields=["cart", "product"],
+                                     update_fields=["quantity"])
+        CartItem.objects.bulk_update(to_update, ["quantity"])
+        if to_delete:
+            CartItem.objects.filter(id__in=to_delete).delete()
+        cart.refresh_totals()
+        cart.save(update_fields=["modified_at"])
+
+    return cart
+
+
+def get_open_cart(user):
+    """Carrito abierto más reciente del usuario (índice cart_user_open_idx)"""
+    return Cart.objects.filter(user=user, paid=False).order_by("-modified_at").first()
+
+
+def merge_carts(user, cart_code):
+    """
+    Fusiona el carrito anónimo `cart_code` con el carrito abierto del usuario y devuelve el
+    carrito con el que debe seguir el cliente (su cart_code puede ser otro).
+    - Sin carrito abierto propio, el anónimo pasa a ser del usuario.
+    - Si ya tiene uno, las líneas se suman con un único upsert y el código anónimo se retira
+      (RetiredCartCode): las peticiones que aún lo usan siguen con el carrito del usuario.
+    - Los carritos de otro usuario o con transacciones (pago en curso) no se tocan.
+    """
+    anonymous = Cart.objects.filter(cart_code=cart_code, paid=False).first() if cart_code else None
+    if anonymous is None or anonymous.user_id not in (None, user.id):
+        return get_open_cart(user)
+    if anonymous.user_id == user.id:
+        return anonymous
+
+    # El store puede tener cambios del carrito anónimo aún sin escribir
+    cart_store.invalidate(anonymous.cart_code)
+    with transaction.atomic():
+        target = (Cart.objects.select_for_update().filter(user=user, paid=False)
+                  .exclude(pk=anonymous.pk).order_by("-modified_at").first())
+        if target is None:
+            anonymous.user = user
+            anonymous.save(update_fields=["user", "modified_at"])
+            return anonymous
+        if anonymous.transactions.exists():
+            return target
+
+        incoming = dict(CartItem.objects.filter(cart=anonymous).values_list("product_id", "quantity"))
+        if incoming:
+            current = dict(CartItem.objects.filter(cart=target, product_id__in=incoming)
+                           .values_list("product_id", "quantity"))
+            CartItem.objects.bulk_create(
+                [CartItem(cart=target, product_id=product_id, quantity=current.get(product_id, 0) + quantity)
+                 for product_id, quantity in incoming.items()],
+                update_conflicts=True, unique_fields=["cart", "product"], update_fields=["quantity"],
+            )
+        with cart_store.syncing():
+            anonymous.delete()
+        RetiredCartCode.objects.update_or_create(cart_code=anonymous.cart_code, defaults={"cart": target})
+        target.refresh_totals()
+        target.save(update_fields=["modified_at"])
+    cart_store.invalidate(anonymous.cart_code)
+    return target
+
@@ -0,0 +1,95 @@
+"""
+Archivado y borrado de carritos abandonados.
+
+Un carrito abandonado no está pagado, no se ha modificado en `days` días y no tiene
+transacciones (esas se conservan siempre). Se recorren por id en tramos de `chunk_size`,
+cada uno en su propia transacción corta, así la tabla nunca queda bloqueada mucho tiempo:
+se borran los que siguen abandonados y solo esos se escriben en el archivo JSONL comprimido
+antes de confirmar.
+"""
+import json
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from shop_app.models import Cart, CartItem
+from shop_app.services import cart_store
+
+
+def get_abandoned_days():
+    return getattr(settings, 'ABANDONED_CART_DAYS', 30)
+
+
+def abandoned_carts(days=None, now=None):
+    cutoff = (now or timezone.now()) - timedelta(days=get_abandoned_days() if days is None else days)
+    return (Cart.objects
+            .filter(paid=False)
+            .filter(Q(modified_at__lt=cutoff) | Q(modified_at__isnull=True, created_at__lt=cutoff))
+            .exclude(transactions__isnull=False))
+
+
+def serialize_cart(cart, items):
+    return {
+        "id": cart["id"],
+        "cart_code": cart["cart_code"],
+        "user_id": cart["user_id"],
+        "item_count": cart["item_count"],
+        "subtotal": str(cart["subtotal"]),
+        "created_at": cart["created_at"].isoformat() if cart["created_at"] else None,
+        "modified_at": cart["modified_at"].isoformat() if cart["modified_at"] else None,
+        "items": items,
+    }
+
+
+def purge_abandoned_carts(stream=None, days=None, chunk_size=500, dry_run=False, pause=0, on_chunk=None):
+    """
+    Archiva en `stream` (texto, una línea JSON por carrito) y borra los carritos abandonados.
+    Con dry_run solo cuenta. Devuelve (carritos, líneas).
+    """
+    queryset = abandoned_carts(days)
+    carts_total = items_total = 0
+    last_id = 0
+    while True:
+        ids = list(queryset.filter(id__gt=last_id).order_by("id").values_list("id", flat=True)[:chunk_size])
+        if not ids:
+            break
+        last_id = ids[-1]
+
+        if dry_run:
+            carts_total += len(ids)
+            items_total += CartItem.objects.filter(cart_id__in=ids).count()
+        else:
+            # Los cambios pendientes en el store actualizan modified_at: esos carritos dejan de estar abandonados
+            cart_store.flush(Cart.objects.filter(id__in=ids).values_list("cart_code", flat=True))
+
+            with cart_store.syncing(), transaction.atomic():
+                # Se vuelve a filtrar por si algún carrito se modificó o se pagó mientras tanto
+                carts = list(queryset.filter(id__in=ids).select_for_update(of=("self",)).order_by("id").values(
+                    "id", "cart_code", "user_id", "item_count", "subtotal", "created_at", "modified_at"))
+                deleted_ids = [cart["id"] for cart in carts]
+                items = {}
+                for cart_id, product_id, quantity in (CartItem.objects.filter(cart_id__in=deleted_ids)
+                                                      .order_by("id").values_list("cart_id", "product_id", "quantity")):
+                    items.setdefault(cart_id, []).append({"product_id": product_id, "quantity": quantity})
+                deleted_items, _ = CartItem.objects.filter(cart_id__in=deleted_ids).delete()
+                _, deleted = Cart.objects.filter(id__in=deleted_ids).delete()
+                if stream is not None:
+                    for cart in carts:
+                        stream.write(json.dumps(serialize_cart(cart, items.get(cart["id"], []))) + "\n")
+                    # El tramo queda escrito antes de confirmar el borrado; si falla, no se borra nada
+                    stream.flush()
+            # syncing() evita la invalidación fila a fila de las señales: se hace aquí, una vez por carrito
+            for cart in carts:
+                cart_store.invalidate(cart["cart_code"])
+            carts_total += deleted.get(Cart._meta.label, 0)
+            items_total += deleted_items
+
+        if on_chunk:
+            on_chunk(carts_total, items_total)
+        if pause:
+            time.sleep(pause)
+    return carts_total, items_total
@@ -0,0 +1,398 @@
+"""
+Capa opcional de carritos activos en caché con escritura diferida (write-behind).
+
+Cada carrito abierto se guarda como una instantánea {"id", "cart_code", "items": {item_id:
+(product_id, quantity)}, "removed": [...], "rev", ...} en un backend de caché (los mismos de
+response_cache: LRU del proceso o un alias de CACHES compartido). get_cart_stat,
+product_in_cart y get_cart se sirven desde ahí (get_cart solo consulta los productos).
+
+Los cambios de cantidad y los borrados solo tocan la instantánea; un hilo los escribe en
+Cart/CartItem por lotes cada FLUSH_INTERVAL segundos. Las líneas nuevas se insertan al
+momento porque el cliente necesita su id. Antes de iniciar un pago se llama a flush() para
+que el total se calcule sobre lo que ve el usuario.
+
+Con un backend compartido entre workers gana la última instantánea escrita (rev más alto) y
+flush([cart_code]) escribe la del backend aunque la haya modificado otro worker: junto a cada
+carrito se guarda el último rev escrito en la base de datos. Las entradas caducan a los TIMEOUT
+segundos. Si el proceso muere, se pierden los cambios aún no escritos (como mucho
+FLUSH_INTERVAL segundos, o hasta el siguiente flush de ese carrito desde otro worker).
+"""
+import atexit
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from shop_app.models import Cart, CartItem, Product
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'cartstore'
+FLUSH_BATCH_SIZE = 100
+
+_backend = None
+_lock = threading.RLock()
+# Instantáneas con cambios sin escribir en la base de datos (una copia por si el backend las expulsa)
+_pending = {}
+_flusher = None
+_local = threading.local()
+
+
+def get_config():
+    return getattr(settings, 'CART_STORE', {})
+
+
+def get_backend():
+    """Backend configurado en CART_STORE (None = desactivado)"""
+    global _backend
+    if _backend is None:
+        with _lock:
+            if _backend is None:
+                config = get_config()
+                backend_path = config.get('BACKEND')
+                _backend = import_string(backend_path)(**config.get('OPTIONS', {})) if backend_path else False
+    return _backend or None
+
+
+def enabled():
+    return get_backend() is not None
+
+
+def _cart_key(cart_code):
+    return f"{KEY_PREFIX}:cart:{cart_code}"
+
+
+def _item_key(item_id):
+    return f"{KEY_PREFIX}:item:{item_id}"
+
+
+def _flushed_key(cart_code):
+    return f"{KEY_PREFIX}:flushed:{cart_code}"
+
+
+def _set(key, value):
+    get_backend().set(key, value, get_config().get('TIMEOUT', 3600))
+
+
+@contextmanager
+def syncing():
+    """
+    Marca escrituras que ya se ocupan de los totales y de la caché (las del propio store o
+    las borradas masivas) para que las señales de Cart/CartItem no repitan el trabajo fila a fila
+    """
+    previous = getattr(_local, 'syncing', False)
+    _local.syncing = True
+    try:
+        yield
+    finally:
+        _local.syncing = previous
+
+
+def is_syncing():
+    return getattr(_local, 'syncing', False)
+
+
+# --- Instantáneas ------------------------------------------------------------
+
+def _flushed_rev(cart_code):
+    return get_backend().get(_flushed_key(cart_code)) or 0
+
+
+def _load_snapshot(cart_code):
+    cart = (Cart.objects.filter(cart_code=cart_code, paid=False)
+            .values('id', 'cart_code', 'user_id', 'created_at', 'modified_at').first())
+    if cart is None:
+        return None
+    items = CartItem.objects.filter(cart_id=cart['id']).order_by('id').values_list('id', 'product_id', 'quantity')
+    return {
+        **cart,
+        'items': {item_id: (product_id, quantity) for item_id, product_id, quantity in items},
+        'removed': [],
+        # Se sigue contando desde lo ya escrito, para que flush() no tome los cambios nuevos por viejos
+        'rev': _flushed_rev(cart_code),
+    }
+
+
+def get_snapshot(cart_code):
+    """Instantánea del carrito abierto (la carga de la base de datos si no está) o None"""
+    backend = get_backend()
+    if backend is None or not cart_code:
+        return None
+    snapshot = backend.get(_cart_key(cart_code))
+    if snapshot is None:
+        with _lock:
+            snapshot = _pending.get(cart_code)
+        if snapshot is None:
+            snapshot = _load_snapshot(cart_code)
+            if snapshot is None:
+                return None
+        _set(_cart_key(cart_code), snapshot)
+        for item_id in snapshot['items']:
+            _set(_item_key(item_id), cart_code)
+    return snapshot
+
+
+def _save(snapshot, dirty=True):
+    """Guarda una copia nueva de la instantánea (nunca se modifican en sitio)"""
+    snapshot = {**snapshot, 'rev': snapshot['rev'] + 1, 'modified_at': timezone.now()}
+    _set(_cart_key(snapshot['cart_code']), snapshot)
+    if dirty:
+        with _lock:
+            _pending[snapshot['cart_code']] = snapshot
+        _start_flusher()
+    return snapshot
+
+
+def build_cart(snapshot, with_items=False):
+    """
+    Cart en memoria para los serializers. Con with_items carga los productos (una consulta)
+    y deja las líneas como si vinieran de prefetch_related('items').
+    """
+    cart = Cart(id=snapshot['id'], cart_code=snapshot['cart_code'], user_id=snapshot['user_id'], paid=False,
+                created_at=snapshot['created_at'], modified_at=snapshot['modified_at'],
+                item_count=sum(quantity for product_id, quantity in snapshot['items'].values()))
+    if with_items:
+        lines = sorted(snapshot['items'].items())
+        products = Product.objects.in_bulk({product_id for item_id, (product_id, quantity) in lines})
+        items = [CartItem(id=item_id, cart=cart, product=products[product_id], quantity=quantity)
+                 for item_id, (product_id, quantity) in lines if product_id in products]
+        if len(items) != len(lines):
+            # Se borró algún producto (y su línea en cascada): la instantánea ya no sirve
+            invalidate(snapshot['cart_code'])
+        cart.item_count = sum(item.quantity for item in items)
+        cart.subtotal = sum((item.product.price * item.quantity for item in items), Decimal("0.00"))
+        cart._prefetched_objects_cache = {'items': items}
+    return cart
+
+
+def get_cart(cart_code, with_items=False):
+    """Cart en memoria para un carrito abierto, o None si el store está desactivado o no existe"""
+    snapshot = get_snapshot(cart_code)
+    if snapshot is None:
+        return None
+    return build_cart(snapshot, with_items=with_items)
+
+
+def product_quantities(cart_code):
+    """{product_id: cantidad} del carrito, o None si hay que preguntar a la base de datos"""
+    snapshot = get_snapshot(cart_code)
+    if snapshot is None:
+        return None
+    quantities = {}
+    for product_id, quantity in snapshot['items'].values():
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    return quantities
+
+
+def product_in_cart(cart_code, product_id):
+    """True/False, o None si hay que preguntar a la base de datos"""
+    snapshot = get_snapshot(cart_code)
+    if snapshot is None:
+        return None
+    try:
+        product_id = int(product_id)
+    except (TypeError, ValueError):
+        return False
+    return any(line[0] == product_id for line in snapshot['items'].values())
+
+
+# --- Escrituras --------------------------------------------------------------
+
+def add_item(cart_code, product, quantity=1):
+    """
+    Equivalente de services.cart.add_to_cart: suma `quantity` unidades a la línea del producto.
+    Devuelve el CartItem o None si el carrito no está en el store.
+    """
+    snapshot = get_snapshot(cart_code)
+    if snapshot is None:
+        return None
+    with _lock:
+        snapshot = get_snapshot(cart_code)
+        for item_id, (product_id, current) in snapshot['items'].items():
+            if product_id == product.id:
+                _save({**snapshot, 'items': {**snapshot['items'], item_id: (product_id, current + quantity)}})
+                return CartItem(id=item_id, cart_id=snapshot['id'], product=product, quantity=current + quantity)
+
+    # Línea nueva: se inserta ya para tener su id; los totales los recalcula el próximo flush
+    try:
+        with syncing(), transaction.atomic():
+            item = CartItem.objects.create(cart_id=snapshot['id'], product=product, quantity=quantity)
+    except IntegrityError:
+        # La línea sigue en la base de datos con un borrado pendiente: escribirlo y reintentar
+        flush([cart_code])
+        with syncing():
+            item = CartItem.objects.create(cart_id=snapshot['id'], product=product, quantity=quantity)
+    with _lock:
+        snapshot = get_snapshot(cart_code) or snapshot
+        _save({**snapshot, 'items': {**snapshot['items'], item.id: (product.id, quantity)}})
+        _set(_item_key(item.id), cart_code)
+    return item
+
+
+def _get_item_snapshot(item_id):
+    backend = get_backend()
+    if backend is None:
+        return None
+    try:
+        item_id = int(item_id)
+    except (TypeError, ValueError):
+        return None
+    cart_code = backend.get(_item_key(item_id))
+    snapshot = get_snapshot(cart_code) if cart_code else None
+    if snapshot is None or item_id not in snapshot['items']:
+        return None
+    return snapshot, item_id
+
+
+def update_item(item_id, quantity=None, delta=None):
+    """
+    Fija (quantity) o suma (delta) la cantidad solo en la instantánea; si queda en 0 o menos
+    la línea se quita. Devuelve el CartItem o None si la línea no está en el store.
+    """
+    found = _get_item_snapshot(item_id)
+    if found is None:
+        return None
+    snapshot, item_id = found
+    product_id, current = snapshot['items'][item_id]
+    # El producto se carga antes de tocar la instantánea (si ya no existe, no se cambia nada)
+    # y solo si la línea se queda: al quitarla no hace falta
+    product = None
+    if (current + delta if delta is not None else quantity) > 0:
+        product = Product.objects.get(id=product_id)
+
+    with _lock:
+        found = _get_item_snapshot(item_id)
+        if found is None:
+            return None
+        snapshot, item_id = found
+        product_id, current = snapshot['items'][item_id]
+        quantity = current + delta if delta is not None else quantity
+        if quantity <= 0:
+            remove_item(item_id)
+            return CartItem(id=item_id, cart_id=snapshot['id'], product_id=product_id, quantity=quantity)
+        _save({**snapshot, 'items': {**snapshot['items'], item_id: (product_id, quantity)}})
+    if product is None:
+        # Otra petición subió la cantidad mientras tanto
+        product = Product.objects.get(id=product_id)
+    return CartItem(id=item_id, cart_id=snapshot['id'], product=product, quantity=quantity)
+
+
+def remove_item(item_id):
+    """Quita la línea de la instantánea; el DELETE se hace en el próximo flush"""
+    with _lock:
+        found = _get_item_snapshot(item_id)
+        if found is None:
+            return False
+        snapshot, item_id = found
+        items = {key: value for key, value in snapshot['items'].items() if key != item_id}
+        _save({**snapshot, 'items': items, 'removed': snapshot['removed'] + [item_id]})
+        get_backend().delete(_item_key(item_id))
+    return True
+
+
+# --- Escritura diferida ------------------------------------------------------
+
+def _write_snapshots(snapshots):
+    quantities = {}
+    removed = []
+    for snapshot in snapshots:
+        quantities.update({item_id: quantity for item_id, (product_id, quantity) in snapshot['items'].items()})
+        removed.extend(snapshot['removed'])
+
+    current = CartItem.objects.filter(id__in=list(quantities)).values_list('id', 'quantity')
+    changed = [CartItem(id=item_id, quantity=quantities[item_id])
+               for item_id, quantity in current if quantity != quantities[item_id]]
+    CartItem.objects.bulk_update(changed, ['quantity'], batch_size=500)
+    if removed:
+        CartItem.objects.filter(id__in=removed).delete()
+
+    cart_ids = [snapshot['id'] for snapshot in snapshots]
+    Cart.refresh_totals_for(cart_ids)
+    Cart.objects.filter(id__in=cart_ids).update(modified_at=timezone.now())
+
+
+def flush(cart_codes=None):
+    """
+    Escribe en la base de datos los cambios pendientes: los de este proceso (sin argumentos) o
+    los de los carritos indicados, hechos en este worker o en otro que comparta el backend.
+    Devuelve el número de carritos escritos.
+    """
+    backend = get_backend()
+    if backend is None:
+        return 0
+    with _lock:
+        codes = list(_pending) if cart_codes is None else [code for code in cart_codes if code]
+        entries = {code: _pending.pop(code) for code in codes if code in _pending}
+
+    snapshots = []
+    for code in codes:
+        # Otro worker puede haber dejado una versión más reciente en un backend compartido
+        snapshot = backend.get(_cart_key(code))
+        pinned = entries.get(code)
+        if pinned is not None and (snapshot is None or snapshot['rev'] < pinned['rev']):
+            snapshot = pinned
+        if snapshot is not None and snapshot['rev'] > _flushed_rev(code):
+            snapshots.append(snapshot)
+    if not snapshots:
+        return 0
+
+    try:
+        with syncing():
+            for start in range(0, len(snapshots), FLUSH_BATCH_SIZE):
+                with transaction.atomic():
+                    _write_snapshots(snapshots[start:start + FLUSH_BATCH_SIZE])
+    except Exception:
+        with _lock:
+            for code, pinned in entries.items():
+                _pending.setdefault(code, pinned)
+        raise
+
+    with _lock:
+        for snapshot in snapshots:
+            _set(_flushed_key(snapshot['cart_code']), snapshot['rev'])
+            current = backend.get(_cart_key(snapshot['cart_code']))
+            if current is not None and current['rev'] == snapshot['rev'] and current['removed']:
+                _set(_cart_key(snapshot['cart_code']), {**current, 'removed': []})
+    return len(snapshots)
+
+
+def invalidate(cart_code):
+    """El carrito cambió fuera del store: escribir lo pendiente y olvidar la instantánea"""
+    backend = get_backend()
+    if backend is None or not cart_code:
+        return
+    flush([cart_code])
+    snapshot = backend.get(_cart_key(cart_code))
+    backend.delete(_cart_key(cart_code))
+    for item_id in (snapshot or {}).get('items', ()):
+        backend.delete(_item_key(item_id))
+
+
+def _run_flusher(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            flush()
+        except Exception:
+            logger.exception("Error writing pending carts")
+        finally:
+            close_old_connections()
+
+
+def _start_flusher():
+    global _flusher
+    interval = get_config().get('FLUSH_INTERVAL', 2)
+    if _flusher is not None or not interval:
+        return
+    with _lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_run_flusher, args=(interval,), name='cart-store-flusher',
+                                        daemon=True)
+            _flusher.start()
+            atexit.register(flush)
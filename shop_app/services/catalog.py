@@ -0,0 +1,63 @@
+from django.db.models import F
+from django.utils import timezone
+
+from shop_app.models import CatalogState, Product
+
+CATALOG_STATE_ID = 1
+
+
+def get_catalog_state():
+    """Devuelve (version, updated_at) del catálogo con una sola consulta por clave primaria"""
+    state = CatalogState.objects.filter(pk=CATALOG_STATE_ID).values_list('version', 'updated_at').first()
+    return state or (0, None)
+
+
+def get_catalog_version():
+    return get_catalog_state()[0]
+
+
+def bump_catalog_version():
+    now = timezone.now()
+    updated = CatalogState.objects.filter(pk=CATALOG_STATE_ID).update(version=F('version') + 1, updated_at=now)
+    if not updated:
+        CatalogState.objects.get_or_create(pk=CATALOG_STATE_ID)
+
+
+def bump_product_versions(product_ids):
+    """Sube la versión de los productos cuyo detalle cambió (incluye sus similares)"""
+    if product_ids:
+        Product.objects.filter(id__in=product_ids).update(version=F('version') + 1, updated_at=timezone.now())
+
+
+def get_request_catalog_state(request):
+    # condition() llama a etag_func y last_modified_func: se consulta una sola vez por request
+    if not hasattr(request, '_catalog_state'):
+        request._catalog_state = get_catalog_state()
+    return request._catalog_state
+
+
+def get_request_product_state(request, slug):
+    if not hasattr(request, '_product_state'):
+        request._product_state = (
+            Product.objects.filter(slug=slug).values('id', 'version', 'updated_at').first()
+        )
+    return request._product_state
+
+
+def catalog_etag(request, *args, **kwargs):
+    version, updated_at = get_request_catalog_state(request)
+    return f'catalog-{version}' if updated_at else None
+
+
+def catalog_last_modified(request, *args, **kwargs):
+    return get_request_catalog_state(request)[1]
+
+
+def product_etag(request, slug, *args, **kwargs):
+    state = get_request_product_state(request, slug)
+    return f'product-{state["id"]}-{state["version"]}' if state else None
+
+
+def product_last_modified(request, slug, *args, **kwargs):
+    state = get_request_product_state(request, slug)
+    return state['updated_at'] if state else None
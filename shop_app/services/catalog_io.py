@@ -0,0 +1,193 @@
+"""
+Importación y exportación masiva del catálogo en CSV o JSONL.
+
+Los archivos se procesan en streaming por lotes: cada lote resuelve sus slugs con una sola
+consulta y se escribe con bulk_create (inserciones nuevas y upserts por id). Como las
+operaciones masivas no disparan las señales de Product, al terminar se regeneran los datos
+derivados (similares, búsqueda, facetas, versiones del catálogo y caché de respuestas).
+"""
+import csv
+import json
+import re
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.text import slugify
+
+from shop_app.models import Product
+from shop_app.services import catalog, facets, response_cache, search, similar_products
+
+EXPORT_FIELDS = ["id", "name", "slug", "description", "category", "price", "image"]
+IMPORT_FIELDS = ["name", "slug", "description", "category", "price", "image"]
+
+
+class CatalogImportError(Exception):
+    pass
+
+
+def allocate_slugs(base_slugs, exclude_pk=None):
+    """
+    Asigna slugs únicos para una lista de bases con una sola consulta:
+    'jbl-flip' -> 'jbl-flip', 'jbl-flip-1', 'jbl-flip-2'... igual que Product.save.
+    """
+    bases = [base or "product" for base in base_slugs]
+    if not bases:
+        return []
+    pattern = r'^(%s)(-[0-9]+)?$' % '|'.join(re.escape(base) for base in set(bases))
+    existing = Product.objects.filter(slug__regex=pattern)
+    if exclude_pk is not None:
+        existing = existing.exclude(pk=exclude_pk)
+    taken = set(existing.values_list('slug', flat=True))
+
+    next_suffix = {}
+    allocated = []
+    for base in bases:
+        slug = base
+        counter = next_suffix.get(base, 1)
+        while slug in taken:
+            slug = f"{base}-{counter}"
+            counter += 1
+        next_suffix[base] = counter
+        taken.add(slug)
+        allocated.append(slug)
+    return allocated
+
+
+def read_rows(stream, fmt):
+    """Itera las filas del archivo sin cargarlo entero en memoria"""
+    if fmt == "csv":
+        yield from csv.DictReader(stream)
+    elif fmt == "jsonl":
+        for line_number, line in enumerate(stream, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                raise CatalogImportError(f"Línea {line_number}: JSON inválido ({e})")
+    else:
+        raise CatalogImportError(f"Formato no soportado: {fmt}")
+
+
+def clean_row(row):
+    valid_categories = {choice[0] for choice in Product.CATEGORY}
+    name = (row.get("name") or "").strip()
+    if not name:
+        raise CatalogImportError(f"Fila sin nombre: {row}")
+    try:
+        price = Decimal(str(row.get("price")))
+    except (InvalidOperation, TypeError):
+        raise CatalogImportError(f"Precio inválido para '{name}': {row.get('price')}")
+    category = (row.get("category") or "").strip() or None
+    if category and category not in valid_categories:
+        raise CatalogImportError(f"Categoría inválida para '{name}': {category}")
+    return {
+        "name": name,
+        "slug": slugify(row.get("slug") or "") or None,
+        "description": row.get("description") or None,
+        "category": category,
+        "price": price,
+        "image": row.get("image") or "",
+    }
+
+
+def import_batch(rows, update_existing=True):
+    """Escribe un lote; devuelve (creados, actualizados)"""
+    cleaned = [clean_row(row) for row in rows]
+    requested_slugs = [row["slug"] for row in cleaned if row["slug"]]
+    existing = {}
+    if update_existing and requested_slugs:
+        for product in Product.objects.filter(slug__in=requested_slugs):
+            existing.setdefault(product.slug, product)
+
+    # Una fila sin imagen no borra la del producto: esos se actualizan sin tocar 'image'
+    update_fields = [field for field in IMPORT_FIELDS if field != "slug"]
+    to_update = {tuple(update_fields): [], tuple(field for field in update_fields if field != "image"): []}
+    to_create = []
+    for row in cleaned:
+        product = existing.get(row["slug"]) if row["slug"] else None
+        if product is not None:
+            fields = update_fields if row["image"] else [field for field in update_fields if field != "image"]
+            for field in fields:
+                setattr(product, field, row[field])
+            to_update[tuple(fields)].append(product)
+        else:
+            to_create.append(row)
+
+    new_slugs = allocate_slugs([row["slug"] or slugify(row["name"]) for row in to_create])
+    now = timezone.now()
+    new_products = [
+        Product(**{**row, "slug": slug}, updated_at=now) for row, slug in zip(to_create, new_slugs)
+    ]
+
+    with transaction.atomic():
+        Product.objects.bulk_create(new_products)
+        for fields, products in to_update.items():
+            if not products:
+                continue
+            for product in products:
+                product.updated_at = now
+            # Upsert por id: un INSERT ... ON CONFLICT por lote, mucho más barato que el
+            # UPDATE ... CASE que genera bulk_update para lotes grandes
+            Product.objects.bulk_create(
+                products,
+                update_conflicts=True,
+                unique_fields=["id"],
+                update_fields=list(fields) + ["updated_at"],
+            )
+    return len(new_products), sum(len(products) for products in to_update.values())
+
+
+def import_catalog(stream, fmt, batch_size=1000, update_existing=True, on_batch=None):
+    created = updated = 0
+    batch = []
+    for row in read_rows(stream, fmt):
+        batch.append(row)
+        if len(batch) >= batch_size:
+            batch_created, batch_updated = import_batch(batch, update_existing)
+            created, updated = created + batch_created, updated + batch_updated
+            batch = []
+            if on_batch:
+                on_batch(created + updated)
+    if batch:
+        batch_created, batch_updated = import_batch(batch, update_existing)
+        created, updated = created + batch_created, updated + batch_updated
+        if on_batch:
+            on_batch(created + updated)
+    return created, updated
+
+
+def export_catalog(stream, fmt, batch_size=1000):
+    """Escribe el catálogo ordenado por id; devuelve el número de filas"""
+    queryset = Product.objects.order_by("id").values_list(*EXPORT_FIELDS)
+    total = 0
+    writer = None
+    if fmt == "csv":
+        writer = csv.writer(stream)
+        writer.writerow(EXPORT_FIELDS)
+    elif fmt != "jsonl":
+        raise CatalogImportError(f"Formato no soportado: {fmt}")
+
+    for values in queryset.iterator(chunk_size=batch_size):
+        values = ["" if value is None else value for value in values]
+        if writer:
+            writer.writerow(values)
+        else:
+            row = dict(zip(EXPORT_FIELDS, values))
+            row["price"] = str(row["price"])
+            stream.write(json.dumps(row, ensure_ascii=False) + "\n")
+        total += 1
+    return total
+
+
+def refresh_derived_data():
+    """Regenera lo que normalmente mantienen las señales de Product tras una carga masiva"""
+    similar_products.rebuild_all()
+    search.rebuild_index()
+    facets.rebuild_facets()
+    Product.objects.update(version=F("version") + 1)
+    catalog.bump_catalog_version()
+    response_cache.invalidate()
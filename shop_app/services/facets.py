@@ -0,0 +1,112 @@
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Q
+
+from shop_app.models import CatalogFacet, Product
+
+
+def get_price_buckets():
+    """Límites de los rangos de precio: (0, 50, 100) -> '0-50', '50-100', '100+'"""
+    return [Decimal(str(limit)) for limit in getattr(settings, 'CATALOG_PRICE_BUCKETS', (0, 50, 100, 200, 500))]
+
+
+def get_bucket_ranges():
+    """[(clave, mínimo o None, máximo o None), ...] con mínimo inclusivo y máximo exclusivo"""
+    limits = get_price_buckets()
+    ranges = [(f"<{limits[0]:g}", None, limits[0])]
+    ranges += [(f"{lower:g}-{upper:g}", lower, upper) for lower, upper in zip(limits, limits[1:])]
+    ranges.append((f"{limits[-1]:g}+", limits[-1], None))
+    return ranges
+
+
+def price_bucket(price):
+    price = Decimal(str(price))
+    for key, lower, upper in get_bucket_ranges():
+        if (lower is None or price >= lower) and (upper is None or price < upper):
+            return key
+
+
+def facet_keys(category, price):
+    """Entradas de CatalogFacet a las que suma un producto"""
+    keys = [(CatalogFacet.KIND_PRICE, price_bucket(price))]
+    if category:
+        keys.append((CatalogFacet.KIND_CATEGORY, category))
+    return keys
+
+
+def apply_delta(keys, delta):
+    for kind, key in keys:
+        facet = CatalogFacet.objects.filter(kind=kind, key=key)
+        if not facet.update(count=F('count') + delta):
+            CatalogFacet.objects.get_or_create(kind=kind, key=key)
+            facet.update(count=F('count') + delta)
+
+
+def on_product_saved(product, previous, created):
+    """previous: (category, price) antes del guardado o None si es nuevo"""
+    new_keys = facet_keys(product.category, product.price)
+    old_keys = [] if created or previous is None else facet_keys(*previous)
+    removed = [key for key in old_keys if key not in new_keys]
+    added = [key for key in new_keys if key not in old_keys]
+    with transaction.atomic():
+        apply_delta(removed, -1)
+        apply_delta(added, 1)
+
+
+def on_product_deleted(product):
+    apply_delta(facet_keys(product.category, product.price), -1)
+
+
+def get_facets(queryset=None):
+    """
+    {"category": {...}, "price": {...}}. Sin queryset, del catálogo completo leído de la tabla
+    precalculada (una consulta); con un queryset filtrado, contados sobre él (dos consultas).
+    """
+    if queryset is None:
+        rows = {(kind, key): count for kind, key, count in
+                CatalogFacet.objects.filter(count__gt=0).values_list('kind', 'key', 'count')}
+    else:
+        rows = count_facets(queryset)
+    categories = {key: count for (kind, key), count in sorted(rows.items())
+                  if kind == CatalogFacet.KIND_CATEGORY}
+    # Rangos de precio en orden ascendente, no alfabético
+    prices = {key: rows[(CatalogFacet.KIND_PRICE, key)] for key, lower, upper in get_bucket_ranges()
+              if (CatalogFacet.KIND_PRICE, key) in rows}
+    return {CatalogFacet.KIND_CATEGORY: categories, CatalogFacet.KIND_PRICE: prices}
+
+
+def count_facets(queryset):
+    """{(tipo, clave): número de productos} del queryset, sin entradas a cero"""
+    queryset = queryset.order_by()
+    counts = {}
+    for category, total in (queryset.exclude(category__isnull=True).exclude(category='')
+                            .values_list('category').annotate(total=Count('id')).order_by()):
+        counts[(CatalogFacet.KIND_CATEGORY, category)] = total
+    # Todos los rangos de precio en una sola consulta con agregación condicional
+    ranges = get_bucket_ranges()
+    aggregates = {}
+    for index, (key, lower, upper) in enumerate(ranges):
+        condition = Q()
+        if lower is not None:
+            condition &= Q(price__gte=lower)
+        if upper is not None:
+            condition &= Q(price__lt=upper)
+        aggregates[f"bucket_{index}"] = Count('id', filter=condition)
+    totals = queryset.aggregate(**aggregates)
+    for index, (key, lower, upper) in enumerate(ranges):
+        if totals[f"bucket_{index}"]:
+            counts[(CatalogFacet.KIND_PRICE, key)] = totals[f"bucket_{index}"]
+    return counts
+
+
+def rebuild_facets():
+    """Recalcula la tabla completa (backfill o cambio de CATALOG_PRICE_BUCKETS)"""
+    counts = count_facets(Product.objects.all())
+    with transaction.atomic():
+        CatalogFacet.objects.all().delete()
+        CatalogFacet.objects.bulk_create(
+            CatalogFacet(kind=kind, key=key, count=count) for (kind, key), count in counts.items()
+        )
+    return len(counts)
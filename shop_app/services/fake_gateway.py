@@ -0,0 +1,226 @@
+"""
+Pasarela de pago falsa (Flutterwave v3 y PayPal v1) para pruebas de carga sin red.
+
+Implementa solo las llamadas que hace la tienda: crear el pago, verificarlo y, en PayPal,
+el token OAuth y la ejecución. Todos los pagos salen bien salvo los fallos inyectados
+(respuestas 500 con probabilidad `failure_rate`), y cada respuesta espera `latency` ±
+`jitter` segundos para simular la pasarela real. Se arranca con `manage.py fake_gateway`
+y se usa apuntando FLUTTERWAVE_BASE_URL y PAYPAL_BASE_URL a ella.
+
+Como no hay página de pago, el enlace de Flutterwave (data.link) y la approval_url de
+PayPal llevan directamente a la URL de retorno de la tienda con los parámetros que pondría
+la pasarela tras pagar.
+
+Los tests la arrancan en un puerto libre y preparan los casos a través de `server.state`:
+pagos ya existentes, referencias caídas, tokens revocados, rechazos de execute o respuestas
+HTML en lugar de JSON.
+"""
+import itertools
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+
+class FakeGatewayState:
+    """Pagos creados en memoria, compartidos por los hilos del servidor, y fallos inyectados"""
+
+    def __init__(self):
+        self.flutterwave = {}
+        self.flutterwave_refs = {}
+        self.paypal = {}
+        self.paypal_requests = {}
+        self.paypal_tokens = []
+        self.paypal_valid_tokens = set()
+        self.paypal_token_ttl = 32400
+        # name del error 400 con el que responde execute (p. ej. INSTRUMENT_DECLINED), o None
+        self.paypal_execute_error = None
+        # tx_ref cuya verificación en Flutterwave responde 500
+        self.failing_refs = set()
+        # Rutas que responden una página HTML (como la de un proxy delante de la pasarela)
+        self.html_paths = set()
+        # (método, ruta con query) de cada petición recibida
+        self.requests = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def next_id(self):
+        with self._lock:
+            return next(self._ids)
+
+    def add_flutterwave(self, payment):
+        with self._lock:
+            self.flutterwave[payment['id']] = payment
+            self.flutterwave_refs[payment['tx_ref']] = payment
+
+    def issue_paypal_token(self):
+        with self._lock:
+            token = f"fake-token-{len(self.paypal_tokens) + 1}"
+            self.paypal_tokens.append(token)
+            self.paypal_valid_tokens.add(token)
+            return token
+
+
+def with_params(url, **params):
+    return f"{url}{'&' if '?' in url else '?'}{urlencode(params)}"
+
+
+class FakeGatewayHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, status, body):
+        self.send_content(status, json.dumps(body).encode(), 'application/json')
+
+    def send_content(self, status, content, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        if 'json' in (self.headers.get('Content-Type') or ''):
+            return json.loads(raw or b'{}')
+        return raw.decode()
+
+    def handle_request(self, method):
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        parts = [part for part in url.path.split('/') if part]
+        body = self.read_body() if method == 'POST' else None
+
+        server = self.server
+        server.state.requests.append((method, self.path))
+        delay = server.latency + random.uniform(-server.jitter, server.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        if random.random() < server.failure_rate:
+            return self.send_json(500, {"status": "error", "message": "Injected failure"})
+        if url.path in server.state.html_paths:
+            return self.send_content(200, b"<html><body><h1>502 Bad Gateway</h1></body></html>", 'text/html')
+
+        route = {
+            ('POST', 'v3', 'payments'): self.flutterwave_create,
+            ('GET', 'v3', 'transactions'): self.flutterwave_verify,
+            ('POST', 'v1', 'oauth2'): self.paypal_token,
+            ('POST', 'v1', 'payments'): self.paypal_payment,
+            ('GET', 'v1', 'payments'): self.paypal_payment,
+        }.get((method, *parts[:2]))
+        if route is None:
+            return self.send_json(404, {"status": "error", "message": f"No route for {method} {url.path}"})
+        return route(parts, query, body)
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    # --- Flutterwave ---------------------------------------------------------
+
+    def flutterwave_data(self, payment):
+        return {"status": "success", "message": "Transaction fetched successfully", "data": payment}
+
+    def flutterwave_create(self, parts, query, body):
+        payment = {
+            "id": self.server.state.next_id(),
+            "tx_ref": body.get("tx_ref"),
+            "amount": float(body.get("amount") or 0),
+            "currency": body.get("currency"),
+            "status": "successful",
+            "customer": body.get("customer") or {},
+        }
+        self.server.state.add_flutterwave(payment)
+        link = with_params(body.get("redirect_url") or "", status="successful", tx_ref=payment["tx_ref"],
+                           transaction_id=payment["id"])
+        return self.send_json(200, {"status": "success", "message": "Hosted Link", "data": {"link": link}})
+
+    def flutterwave_verify(self, parts, query, body):
+        # /v3/transactions/verify_by_reference?tx_ref=... o /v3/transactions/<id>/verify
+        if parts[2:] == ['verify_by_reference']:
+            if query.get('tx_ref') in self.server.state.failing_refs:
+                return self.send_json(500, {"status": "error", "message": "Internal error"})
+            payment = self.server.state.flutterwave_refs.get(query.get('tx_ref'))
+        elif len(parts) == 4 and parts[3] == 'verify' and parts[2].isdigit():
+            payment = self.server.state.flutterwave.get(int(parts[2]))
+        else:
+            return self.send_json(404, {"status": "error", "message": "Not found"})
+        if payment is None:
+            return self.send_json(400, {"status": "error", "message": "No transaction was found for this id", "data": None})
+        return self.send_json(200, self.flutterwave_data(payment))
+
+    # --- PayPal --------------------------------------------------------------
+
+    def paypal_token(self, parts, query, body):
+        state = self.server.state
+        return self.send_json(200, {"scope": "https://api.paypal.com/v1/payments/.*",
+                                    "access_token": state.issue_paypal_token(), "token_type": "Bearer",
+                                    "app_id": "fake", "expires_in": state.paypal_token_ttl})
+
+    def paypal_payment(self, parts, query, body):
+        # /v1/payments/payment, /v1/payments/payment/<id> y /v1/payments/payment/<id>/execute
+        if parts[2:3] != ['payment']:
+            return self.send_json(404, {"name": "NOT_FOUND"})
+        state = self.server.state
+        token = (self.headers.get('Authorization') or '').removeprefix('Bearer ')
+        if token not in state.paypal_valid_tokens:
+            return self.send_json(401, {"error": "invalid_token", "error_description": "Token signature verification failed"})
+        request_id = self.headers.get('PayPal-Request-Id')
+        if len(parts) == 3 and isinstance(body, dict):
+            # Mismo PayPal-Request-Id = mismo pago, como en PayPal
+            if request_id in state.paypal_requests:
+                return self.send_json(201, state.paypal[state.paypal_requests[request_id]])
+            payment_id = f"PAYID-FAKE{state.next_id()}"
+            return_url = body["redirect_urls"]["return_url"]
+            payment = {
+                **body,
+                "id": payment_id,
+                "state": "created",
+                "links": [
+                    {"href": f"/v1/payments/payment/{payment_id}", "rel": "self", "method": "GET"},
+                    {"href": with_params(return_url, paymentId=payment_id, token=f"EC-{payment_id}",
+                                         PayerID="FAKEPAYER"),
+                     "rel": "approval_url", "method": "REDIRECT"},
+                    {"href": f"/v1/payments/payment/{payment_id}/execute", "rel": "execute", "method": "POST"},
+                ],
+            }
+            state.paypal[payment_id] = payment
+            if request_id:
+                state.paypal_requests[request_id] = payment_id
+            return self.send_json(201, payment)
+
+        payment = state.paypal.get(parts[3]) if len(parts) >= 4 else None
+        if payment is None:
+            return self.send_json(404, {"name": "INVALID_RESOURCE_ID", "message": "Requested resource ID was not found."})
+        if len(parts) == 5 and parts[4] == 'execute' and isinstance(body, dict):
+            error = state.paypal_execute_error
+            if error is None and payment["state"] == "approved":
+                error = "PAYMENT_ALREADY_DONE"
+            if error:
+                return self.send_json(400, {"name": error, "message": f"{error} (fake gateway)"})
+            payment["state"] = "approved"
+            payment["payer"] = {**payment.get("payer", {}), "payer_info": {"payer_id": body.get("payer_id")}}
+            return self.send_json(200, payment)
+        if len(parts) == 4 and body is None:
+            return self.send_json(200, payment)
+        return self.send_json(404, {"name": "NOT_FOUND"})
+
+
+class FakeGatewayServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0, jitter=0.0, failure_rate=0.0, verbose=False):
+        super().__init__(address, FakeGatewayHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.verbose = verbose
+        self.state = FakeGatewayState()
@@ -0,0 +1,330 @@
+"""
+Cliente HTTP de las pasarelas de pago.
+
+Todas las llamadas comparten una requests.Session con pool de conexiones keep-alive (sin un
+handshake TLS por petición) y llevan timeouts de conexión y de lectura, para que una pasarela
+lenta no bloquee un worker indefinidamente. Solo las llamadas idempotentes (GET de
+verificación, o las que la pasarela deduplica, como PayPal con PayPal-Request-Id) se
+reintentan, con backoff exponencial y jitter. Un circuit breaker corta las
+llamadas durante un tiempo cuando la pasarela acumula fallos seguidos, y cada operación
+guarda sus métricas de latencia en memoria (ver get_gateway_metrics).
+
+PayPal usa su API REST directamente (sin paypalrestsdk): el token OAuth se guarda en el
+cliente y se renueva antes de caducar, en lugar de pedir uno en cada proceso o llamada.
+"""
+import logging
+import random
+import threading
+import time
+from collections import deque
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'CONNECT_TIMEOUT': 3.05,
+    'READ_TIMEOUT': 15,
+    'RETRIES': 2,
+    'BACKOFF': 0.3,
+    'POOL_SIZE': 10,
+    'BREAKER_THRESHOLD': 5,
+    'BREAKER_RESET': 30,
+    'TOKEN_REFRESH_MARGIN': 300,
+}
+
+PAYPAL_BASE_URLS = {
+    'sandbox': 'https://api-m.sandbox.paypal.com',
+    'live': 'https://api-m.paypal.com',
+}
+
+
+class GatewayError(Exception):
+    pass
+
+
+class GatewayUnavailable(GatewayError):
+    """El circuit breaker está abierto: no se llama a la pasarela"""
+
+
+def get_gateway_config():
+    return {**DEFAULTS, **getattr(settings, 'PAYMENT_GATEWAY', {})}
+
+
+class CircuitBreaker:
+    """
+    Cerrado: las llamadas pasan. Tras `threshold` fallos seguidos se abre durante
+    `reset_timeout` segundos; después deja pasar una llamada de prueba (semiabierto) y se
+    cierra si sale bien o vuelve a abrirse si falla.
+    """
+
+    def __init__(self, threshold=5, reset_timeout=30):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        return 'half-open' if time.monotonic() - self.opened_at >= self.reset_timeout else 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.failures >= self.threshold or self.opened_at is not None:
+                self.opened_at = time.monotonic()
+
+
+class LatencyStats:
+    """Contadores y muestras recientes de latencia por operación"""
+
+    def __init__(self, samples=512):
+        self._samples = samples
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def record(self, operation, elapsed, ok):
+        with self._lock:
+            stats = self._data.setdefault(operation, {
+                'calls': 0, 'errors': 0, 'total': 0.0, 'max': 0.0, 'recent': deque(maxlen=self._samples),
+            })
+            stats['calls'] += 1
+            stats['errors'] += 0 if ok else 1
+            stats['total'] += elapsed
+            stats['max'] = max(stats['max'], elapsed)
+            stats['recent'].append(elapsed)
+
+    def snapshot(self):
+        """{operación: {calls, errors, avg_ms, p50_ms, p95_ms, p99_ms, max_ms}}"""
+        with self._lock:
+            data = {operation: {**stats, 'recent': sorted(stats['recent'])} for operation, stats in self._data.items()}
+        result = {}
+        for operation, stats in data.items():
+            recent = stats['recent']
+
+            def percentile(fraction):
+                return round(recent[min(len(recent) - 1, int(fraction * len(recent)))] * 1000, 1) if recent else None
+
+            result[operation] = {
+                'calls': stats['calls'],
+                'errors': stats['errors'],
+                'avg_ms': round(stats['total'] / stats['calls'] * 1000, 1) if stats['calls'] else None,
+                'p50_ms': percentile(0.50),
+                'p95_ms': percentile(0.95),
+                'p99_ms': percentile(0.99),
+                'max_ms': round(stats['max'] * 1000, 1),
+            }
+        return result
+
+
+class GatewayClient:
+    """Base para los clientes de pasarela: pool de conexiones, timeouts, reintentos, breaker y métricas"""
+    name = 'gateway'
+
+    def __init__(self, base_url, config=None, metrics=None):
+        config = {**DEFAULTS, **(config or {})}
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (config['CONNECT_TIMEOUT'], config['READ_TIMEOUT'])
+        self.retries = config['RETRIES']
+        self.backoff = config['BACKOFF']
+        self.breaker = CircuitBreaker(config['BREAKER_THRESHOLD'], config['BREAKER_RESET'])
+        self.metrics = metrics or LatencyStats()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=config['POOL_SIZE'], max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def get_headers(self):
+        return {}
+
+    def request(self, operation, method, path, idempotent=False, **kwargs):
+        """
+        Hace la llamada y devuelve el requests.Response (también para 4xx/5xx). Los errores de
+        red, timeouts y 5xx se reintentan solo si la llamada es idempotente.
+        """
+        attempts = 1 + self.retries if idempotent else 1
+        url = f"{self.base_url}/{path.lstrip('/')}"
+        headers = {**self.get_headers(), **kwargs.pop('headers', {})}
+        for attempt in range(attempts):
+            if not self.breaker.allow():
+                raise GatewayUnavailable(f"{self.name} unavailable (circuit open)")
+            start = time.monotonic()
+            try:
+                response = self.session.request(method, url, headers=headers, timeout=self.timeout, **kwargs)
+            except requests.RequestException as e:
+                self.metrics.record(f"{self.name}.{operation}", time.monotonic() - start, ok=False)
+                self.breaker.record_failure()
+                if attempt + 1 >= attempts:
+                    raise GatewayError(f"{self.name} {operation} failed: {e}") from e
+            else:
+                ok = response.status_code < 500
+                self.metrics.record(f"{self.name}.{operation}", time.monotonic() - start, ok=ok)
+                if ok:
+                    self.breaker.record_success()
+                    return response
+                self.breaker.record_failure()
+                if attempt + 1 >= attempts:
+                    return response
+            # Backoff exponencial con jitter completo
+            delay = random.uniform(0, self.backoff * 2 ** attempt)
+            logger.warning("%s %s: retrying in %.2fs (attempt %s/%s)", self.name, operation, delay, attempt + 2, attempts)
+            time.sleep(delay)
+
+
+class FlutterwaveClient(GatewayClient):
+    name = 'flutterwave'
+
+    def __init__(self, base_url=None, secret_key=None, **kwargs):
+        super().__init__(base_url or settings.FLUTTERWAVE_BASE_URL, **kwargs)
+        self.secret_key = secret_key or settings.FLUTTERWAVE_SECRET_KEY
+
+    def get_headers(self):
+        return {"Authorization": f"Bearer {self.secret_key}"}
+
+    def create_payment(self, payload):
+        # No idempotente: reintentar podría crear dos cobros
+        return self.request("create_payment", "POST", "/payments", json=payload)
+
+    def verify_transaction(self, transaction_id):
+        return self.request("verify", "GET", f"/transactions/{transaction_id}/verify", idempotent=True)
+
+    def verify_by_reference(self, tx_ref):
+        return self.request("verify_by_reference", "GET", "/transactions/verify_by_reference",
+                            idempotent=True, params={"tx_ref": tx_ref})
+
+
+class PayPalClient(GatewayClient):
+    """
+    API REST v1 de PayPal. El token de acceso se comparte entre hilos: cuando le quedan menos
+    de TOKEN_REFRESH_MARGIN segundos, un solo hilo lo renueva mientras los demás siguen con
+    el actual, así que ninguna petición espera al OAuth salvo la primera.
+    """
+    name = 'paypal'
+
+    def __init__(self, base_url=None, client_id=None, client_secret=None, config=None, **kwargs):
+        config = {**DEFAULTS, **(config or {})}
+        base_url = base_url or getattr(settings, 'PAYPAL_BASE_URL', None) or PAYPAL_BASE_URLS[settings.PAYPAL_MODE]
+        super().__init__(base_url, config=config, **kwargs)
+        self.client_id = client_id or settings.PAYPAL_CLIENT_ID
+        self.client_secret = client_secret or settings.PAYPAL_CLIENT_SECRET
+        self.token_margin = config['TOKEN_REFRESH_MARGIN']
+        self._token = (None, 0)
+        self._token_lock = threading.Lock()
+
+    def fetch_token(self):
+        response = super().request("oauth_token", "POST", "/v1/oauth2/token", idempotent=True,
+                                   auth=(self.client_id, self.client_secret),
+                                   data={"grant_type": "client_credentials"}, headers={"Accept": "application/json"})
+        if response.status_code != 200:
+            raise GatewayError(f"PayPal token request failed ({response.status_code})")
+        try:
+            body = response.json()
+            self._token = (body["access_token"], time.monotonic() + float(body.get("expires_in", 0)))
+        except (ValueError, KeyError, TypeError):
+            # p. ej. una página HTML de un proxy intermedio
+            raise GatewayError("PayPal token response is not valid JSON")
+        return body["access_token"]
+
+    def get_access_token(self):
+        token, expires_at = self._token
+        remaining = expires_at - time.monotonic()
+        if token and remaining > self.token_margin:
+            return token
+        if token and remaining > 0:
+            # Caduca pronto: lo renueva el primer hilo que llegue, el resto no espera
+            if self._token_lock.acquire(blocking=False):
+                try:
+                    return self.fetch_token()
+                except GatewayError as e:
+                    logger.warning("PayPal token refresh failed, using current token: %s", e)
+                    return token
+                finally:
+                    self._token_lock.release()
+            return token
+        with self._token_lock:
+            token, expires_at = self._token
+            if token and expires_at > time.monotonic():
+                return token
+            return self.fetch_token()
+
+    def request(self, operation, method, path, idempotent=False, **kwargs):
+        headers = kwargs.pop('headers', {})
+        token = self.get_access_token()
+        response = super().request(operation, method, path, idempotent,
+                                   headers={**headers, "Authorization": f"Bearer {token}"}, **kwargs)
+        if response.status_code == 401:
+            # Token revocado antes de tiempo: se descarta y se repite una vez con uno nuevo
+            with self._token_lock:
+                if self._token[0] == token:
+                    self._token = (None, 0)
+            token = self.get_access_token()
+            response = super().request(operation, method, path, idempotent,
+                                       headers={**headers, "Authorization": f"Bearer {token}"}, **kwargs)
+        return response
+
+    def create_payment(self, payload, request_id):
+        # PayPal-Request-Id hace que PayPal devuelva el mismo pago si se repite: se puede reintentar
+        return self.request("create_payment", "POST", "/v1/payments/payment", idempotent=True, json=payload,
+                            headers={"PayPal-Request-Id": request_id})
+
+    def get_payment(self, payment_id):
+        return self.request("get_payment", "GET", f"/v1/payments/payment/{payment_id}", idempotent=True)
+
+    def execute_payment(self, payment_id, payer_id):
+        return self.request("execute_payment", "POST", f"/v1/payments/payment/{payment_id}/execute", idempotent=True,
+                            json={"payer_id": payer_id}, headers={"PayPal-Request-Id": f"{payment_id}-execute"})
+
+
+_metrics = LatencyStats()
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _get_client(name, factory):
+    """Cliente compartido por el proceso (un solo pool de conexiones por pasarela)"""
+    client = _clients.get(name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(name)
+            if client is None:
+                client = _clients[name] = factory(config=get_gateway_config(), metrics=_metrics)
+    return client
+
+
+def get_flutterwave_client():
+    return _get_client('flutterwave', FlutterwaveClient)
+
+
+def get_paypal_client():
+    return _get_client('paypal', PayPalClient)
+
+
+def get_gateway_metrics():
+    return {
+        'latency': _metrics.snapshot(),
+        'circuits': {name: client.breaker.state for name, client in _clients.items()},
+    }
@@ -0,0 +1,99 @@
+import hashlib
+import io
+import logging
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+VARIANTS_DIR = 'img/variants'
+
+# Formato de respaldo según el original (PNG conserva la transparencia)
+FALLBACK_FORMATS = {'PNG': 'png', 'GIF': 'png'}
+
+SAVE_OPTIONS = {
+    'jpeg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+    'png': {'format': 'PNG', 'optimize': True},
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 6},
+    'avif': {'format': 'AVIF', 'quality': 60},
+}
+
+
+def get_widths():
+    return sorted(getattr(settings, 'PRODUCT_IMAGE_WIDTHS', (160, 320, 640, 1024)))
+
+
+def get_modern_formats():
+    """Formatos modernos configurados que el Pillow instalado puede escribir"""
+    Image.init()
+    wanted = getattr(settings, 'PRODUCT_IMAGE_FORMATS', ('avif', 'webp'))
+    return [fmt for fmt in wanted if fmt in SAVE_OPTIONS and SAVE_OPTIONS[fmt]['format'] in Image.SAVE]
+
+
+def _encode(image, fmt):
+    if fmt == 'jpeg' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, **SAVE_OPTIONS[fmt])
+    return buffer.getvalue()
+
+
+def build_variants(image_field, storage=None):
+    """
+    Genera las derivadas de una imagen (varios anchos x formatos) con nombres basados en el
+    hash del contenido, de modo que la misma imagen nunca se sube dos veces.
+    Devuelve {"hash": ..., "formats": {"webp": {"160": "img/variants/<hash>-160.webp", ...}, ...}}
+    """
+    storage = storage or default_storage
+    image_field.open('rb')
+    image_field.seek(0)
+    content = image_field.read()
+    if image_field._committed:
+        image_field.close()
+    else:
+        # Archivo recién subido: se deja al inicio para que Django lo guarde completo
+        image_field.seek(0)
+
+    digest = hashlib.sha256(content).hexdigest()[:16]
+    with Image.open(io.BytesIO(content)) as source:
+        fallback = FALLBACK_FORMATS.get(source.format, 'jpeg')
+        source = ImageOps.exif_transpose(source)
+        if source.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+            source = source.convert('RGBA' if 'transparency' in source.info else 'RGB')
+
+        widths = sorted({min(width, source.width) for width in get_widths()})
+        formats = {}
+        for width in widths:
+            height = max(1, round(source.height * width / source.width))
+            resized = source if width == source.width else source.resize((width, height), Image.LANCZOS)
+            for fmt in get_modern_formats() + [fallback]:
+                name = f"{VARIANTS_DIR}/{digest}-{width}.{fmt}"
+                if not storage.exists(name):
+                    storage.save(name, ContentFile(_encode(resized, fmt)))
+                formats.setdefault(fmt, {})[str(width)] = name
+
+    return {"hash": digest, "formats": formats}
+
+
+def get_srcset(variants, storage=None):
+    """{"webp": "url 160w, url 320w", ...} listo para <source srcset=...>"""
+    storage = storage or default_storage
+    srcset = {}
+    for fmt, sizes in (variants or {}).get('formats', {}).items():
+        ordered = sorted(sizes.items(), key=lambda item: int(item[0]))
+        srcset[fmt] = ", ".join(f"{storage.url(name)} {width}w" for width, name in ordered)
+    return srcset
+
+
+def get_smallest_url(variants, storage=None):
+    """URL de la derivada más pequeña (preferentemente en formato moderno) o None"""
+    storage = storage or default_storage
+    formats = (variants or {}).get('formats', {})
+    for fmt in get_modern_formats() + list(formats):
+        sizes = formats.get(fmt)
+        if sizes:
+            return storage.url(sizes[min(sizes, key=int)])
+    return None
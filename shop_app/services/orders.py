@@ -0,0 +1,53 @@
+"""
+Pedidos: copia inmutable del carrito en el momento del checkout.
+
+create_checkout_transaction crea la Transaction, su Order y todas las OrderLine de una vez
+(un INSERT por tabla) con los precios, nombres e imágenes del momento. Después el historial,
+los recibos y las estadísticas leen Order/OrderLine sin volver a Cart, CartItem ni Product,
+y un cambio de precio ya no altera pedidos pasados.
+"""
+import uuid
+from decimal import Decimal
+
+from django.db import transaction
+
+from shop_app.models import CartItem, Order, OrderLine, Transaction
+
+TAX = Decimal("4.00")
+
+
+def create_checkout_transaction(cart, user, provider, tax=TAX):
+    """Transaction 'pending' del carrito con su Order; el importe sale de las líneas copiadas"""
+    items = list(CartItem.objects.filter(cart=cart).order_by('id')
+                 .values_list('product_id', 'product__name', 'product__image', 'product__price', 'quantity'))
+    lines = [
+        OrderLine(product_id=product_id, name=name, image=image, unit_price=price, quantity=quantity,
+                  line_total=price * quantity)
+        for product_id, name, image, price, quantity in items
+    ]
+    subtotal = sum((line.line_total for line in lines), Decimal("0.00"))
+
+    with transaction.atomic():
+        transaction_obj = Transaction.objects.create(
+            ref=str(uuid.uuid4()),
+            cart=cart,
+            amount=subtotal + tax,
+            currency=provider.currency,
+            user=user,
+            status='pending',
+            provider=provider.name,
+        )
+        order = Order.objects.create(
+            transaction=transaction_obj,
+            user=user,
+            cart_code=cart.cart_code,
+            item_count=sum(line.quantity for line in lines),
+            subtotal=subtotal,
+            tax=tax,
+            total=subtotal + tax,
+            currency=provider.currency,
+        )
+        for line in lines:
+            line.order = order
+        OrderLine.objects.bulk_create(lines)
+    return transaction_obj
@@ -0,0 +1,224 @@
+"""
+Confirmación de pagos.
+
+Todas las vías (webhook, redirección del usuario, callback de PayPal y reconciliación)
+terminan en complete_transactions/fail_transactions, que solo cambian transacciones que
+siguen 'pending' con un UPDATE condicional. Así, procesar dos veces el mismo pago (webhook
+repetido, usuario que recarga la página, dos workers a la vez) no tiene ningún efecto.
+"""
+import hmac
+import logging
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from shop_app.models import Cart, Order, PaymentEvent, Transaction
+from shop_app.services import analytics, cart_store, tasks
+from shop_app.services.gateways import GatewayError, get_flutterwave_client
+
+logger = logging.getLogger(__name__)
+
+STATUS_PENDING = 'pending'
+STATUS_COMPLETED = 'completed'
+STATUS_FAILED = 'failed'
+
+
+def complete_transactions(refs):
+    """
+    Marca como completadas las transacciones pendientes de `refs`, sus pedidos y sus carritos
+    como pagados (asignando el usuario de la transacción si el carrito no tenía) y suma los
+    pedidos a las estadísticas de ventas. Devuelve las refs que
+    han cambiado ahora; las que ya estaban completadas se ignoran.
+    """
+    refs = list(refs)
+    if not refs:
+        return []
+    with transaction.atomic():
+        pending = Transaction.objects.select_for_update().filter(ref__in=refs, status=STATUS_PENDING)
+        changed = list(pending.values_list('ref', 'cart_id'))
+        if not changed:
+            return []
+        changed_refs = [ref for ref, cart_id in changed]
+        Transaction.objects.filter(ref__in=changed_refs, status=STATUS_PENDING).update(
+            status=STATUS_COMPLETED, modified_at=timezone.now())
+        Order.objects.filter(transaction__ref__in=changed_refs).update(paid=True, paid_at=timezone.now())
+        analytics.record_paid_orders(changed_refs)
+
+        cart_ids = {cart_id for ref, cart_id in changed}
+        buyer = (Transaction.objects.filter(cart=OuterRef('pk'), ref__in=refs, user__isnull=False)
+                 .order_by().values('user')[:1])
+        carts = Cart.objects.filter(id__in=cart_ids)
+        cart_codes = list(carts.values_list('cart_code', flat=True))
+        carts.update(paid=True, user=Coalesce('user', Subquery(buyer)), modified_at=timezone.now())
+
+    for cart_code in cart_codes:
+        cart_store.invalidate(cart_code)
+    return changed_refs
+
+
+def fail_transactions(refs):
+    refs = list(refs)
+    if not refs:
+        return 0
+    return Transaction.objects.filter(ref__in=refs, status=STATUS_PENDING).update(
+        status=STATUS_FAILED, modified_at=timezone.now())
+
+
+def get_status(tx_ref):
+    return Transaction.objects.filter(ref=tx_ref).values_list('status', flat=True).first()
+
+
+# --- Flutterwave -------------------------------------------------------------
+
+def check_flutterwave_payment(transaction_obj, data):
+    """'completed', 'failed' o None (todavía sin resultado) según los datos verificados"""
+    provider_status = (data or {}).get('status')
+    if provider_status == 'successful':
+        try:
+            amount = Decimal(str(data.get('amount')))
+        except (InvalidOperation, TypeError):
+            return STATUS_FAILED
+        if amount >= transaction_obj.amount and data.get('currency') == transaction_obj.currency:
+            return STATUS_COMPLETED
+        logger.warning("Flutterwave payment %s does not match: %s %s", transaction_obj.ref,
+                       data.get('amount'), data.get('currency'))
+        return STATUS_FAILED
+    if provider_status in ('failed', 'cancelled'):
+        return STATUS_FAILED
+    return None
+
+
+def verify_flutterwave_transaction(tx_ref, transaction_id=None):
+    """
+    Pregunta a Flutterwave por el pago (nunca se confía en los datos del webhook o de la
+    redirección) y aplica el resultado. Devuelve el estado final de la transacción.
+    """
+    transaction_obj = Transaction.objects.filter(ref=tx_ref).first()
+    if transaction_obj is None:
+        logger.warning("Flutterwave verification for unknown tx_ref %s", tx_ref)
+        return None
+    if transaction_obj.status != STATUS_PENDING:
+        return transaction_obj.status
+
+    client = get_flutterwave_client()
+    try:
+        if transaction_id:
+            response = client.verify_transaction(transaction_id)
+        else:
+            response = client.verify_by_reference(tx_ref)
+        body = response.json()
+    except (GatewayError, ValueError) as e:
+        logger.warning("Flutterwave verification of %s failed: %s", tx_ref, e)
+        return transaction_obj.status
+
+    data = body.get('data') if body.get('status') == 'success' else None
+    if data and data.get('tx_ref') != tx_ref:
+        logger.warning("Flutterwave transaction %s belongs to %s, not %s", transaction_id, data.get('tx_ref'), tx_ref)
+        return transaction_obj.status
+
+    result = check_flutterwave_payment(transaction_obj, data)
+    if result == STATUS_COMPLETED:
+        complete_transactions([tx_ref])
+    elif result == STATUS_FAILED:
+        fail_transactions([tx_ref])
+    return get_status(tx_ref)
+
+
+def valid_flutterwave_signature(request):
+    """Flutterwave envía en 'verif-hash' el secreto configurado en su panel"""
+    expected = getattr(settings, 'FLUTTERWAVE_WEBHOOK_HASH', '')
+    received = request.headers.get('verif-hash', '')
+    return bool(expected) and hmac.compare_digest(received, expected)
+
+
+def record_flutterwave_event(payload):
+    """
+    Guarda el evento del webhook y devuelve el PaymentEvent que hay que procesar. Si ya se
+    había recibido (mismo evento y mismo id de transacción de Flutterwave) devuelve None, salvo
+    que siga sin procesar (la verificación no llegó a resultado o la tarea se perdió al
+    reiniciar): entonces devuelve el existente para volver a encolarlo.
+    """
+    data = payload.get('data') or {}
+    event_type = payload.get('event') or payload.get('event.type') or ''
+    try:
+        with transaction.atomic():
+            return PaymentEvent.objects.create(
+                provider='flutterwave',
+                event_id=f"{event_type}:{data.get('id')}",
+                event_type=event_type,
+                tx_ref=data.get('tx_ref') or '',
+                payload=payload,
+            )
+    except IntegrityError:
+        return PaymentEvent.objects.filter(provider='flutterwave', event_id=f"{event_type}:{data.get('id')}",
+                                           processed_at__isnull=True).first()
+
+
+def process_flutterwave_event(event_id):
+    event = PaymentEvent.objects.get(pk=event_id)
+    if event.processed_at is not None:
+        return
+    transaction_id = (event.payload.get('data') or {}).get('id')
+    status = verify_flutterwave_transaction(event.tx_ref, transaction_id)
+    # Mientras la transacción siga pendiente (pasarela caída, pago sin terminar) el evento queda
+    # sin procesar y el reenvío de Flutterwave lo vuelve a intentar
+    if status in (STATUS_COMPLETED, STATUS_FAILED):
+        PaymentEvent.objects.filter(pk=event.pk, processed_at__isnull=True).update(processed_at=timezone.now())
+
+
+def enqueue_flutterwave_verification(tx_ref, transaction_id=None):
+    return tasks.submit(verify_flutterwave_transaction, tx_ref, transaction_id)
+
+
+# --- PayPal ------------------------------------------------------------------
+
+def execute_paypal_payment(tx_ref, payment_id, payer_id):
+    """
+    Ejecuta el pago que el usuario aprobó en PayPal y aplica el resultado. Devuelve el estado
+    final de la transacción. Si PayPal rechaza la ejecución se relanza el ProviderError: la
+    transacción solo queda fallida si el error es definitivo o el pago ya está fallido en
+    PayPal; un rechazo recuperable (INSTRUMENT_DECLINED) la deja pendiente para que el comprador
+    lo reintente. Los GatewayError (PayPal no responde) también la dejan pendiente para
+    reconcile_transactions.
+    """
+    from shop_app.services.providers import ProviderError, get_provider
+
+    transaction_obj = Transaction.objects.filter(ref=tx_ref).first()
+    if transaction_obj is None:
+        logger.warning("PayPal execution for unknown tx_ref %s", tx_ref)
+        return None
+    if transaction_obj.status != STATUS_PENDING:
+        # Recarga de la página de retorno o tarea repetida: el pago ya se ejecutó
+        return transaction_obj.status
+    if not payment_id or transaction_obj.provider_ref != payment_id:
+        # Sin provider_ref no se puede comprobar que el pago aprobado sea el de esta transacción
+        raise ProviderError(f"Payment {payment_id} does not belong to transaction {tx_ref}")
+
+    provider = get_provider('paypal')
+    try:
+        provider.execute(payment_id, payer_id)
+    except ProviderError as e:
+        if e.code in provider.terminal_errors:
+            fail_transactions([tx_ref])
+            raise
+        # Se aplica el estado del pago en PayPal (puede que ya se ejecutara, p. ej. PAYMENT_ALREADY_DONE)
+        try:
+            result = provider.check(transaction_obj)
+        except (GatewayError, ProviderError, ValueError):
+            result = STATUS_PENDING
+        if result == STATUS_COMPLETED:
+            complete_transactions([tx_ref])
+            return get_status(tx_ref)
+        if result == STATUS_FAILED:
+            fail_transactions([tx_ref])
+        raise
+    complete_transactions([tx_ref])
+    return get_status(tx_ref)
+
+
+def enqueue_paypal_execution(tx_ref, payment_id, payer_id):
+    return tasks.submit(execute_paypal_payment, tx_ref, payment_id, payer_id)
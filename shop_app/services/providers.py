@@ -0,0 +1,146 @@
+"""
+Pasarelas de pago detrás de una interfaz común.
+
+Cada proveedor sabe crear el pago en su pasarela (create_checkout) y consultar el estado de
+una transacción (check, usado por reconcile_transactions): 'completed', 'failed' o 'pending'
+si la pasarela responde que el pago no existe o aún no terminó. Si no hay respuesta fiable
+(caída, circuit breaker, cuerpo inválido) check lanza GatewayError, ProviderError o ValueError. Las URLs base salen de settings
+(FLUTTERWAVE_BASE_URL, PAYPAL_BASE_URL), así que se pueden apuntar al servidor local de
+fake_gateway para pruebas de carga.
+"""
+import logging
+
+from shop_app.services.gateways import GatewayError, get_flutterwave_client, get_paypal_client
+from shop_app.services.payments import STATUS_COMPLETED, STATUS_FAILED, STATUS_PENDING, check_flutterwave_payment
+
+logger = logging.getLogger(__name__)
+
+
+class ProviderError(Exception):
+    """La pasarela rechazó la operación; `code` es su código de error (p. ej. 'INSTRUMENT_DECLINED')"""
+
+    def __init__(self, message, code=None):
+        super().__init__(message)
+        self.code = code
+
+
+class FlutterwaveProvider:
+    name = 'flutterwave'
+    currency = 'NGN'
+
+    def create_checkout(self, transaction_obj, user, redirect_url):
+        """Crea el pago; devuelve el requests.Response de Flutterwave (con data.link para redirigir)"""
+        payload = {
+            "tx_ref": transaction_obj.ref,
+            "amount": str(transaction_obj.amount),
+            "currency": transaction_obj.currency,
+            "redirect_url": redirect_url,
+            "customer": {
+                "email": user.email,
+                "username": user.username,
+                "phonenumber": user.phone
+            },
+            "customizations": {
+                "title": "PulseBeat Tech Payment"
+            }
+        }
+        # Cliente compartido: pool keep-alive, timeouts y circuit breaker (sin reintentos: crea un cobro)
+        return get_flutterwave_client().create_payment(payload)
+
+    def check(self, transaction_obj):
+        response = get_flutterwave_client().verify_by_reference(transaction_obj.ref)
+        if response.status_code >= 500:
+            raise GatewayError(f"Flutterwave returned {response.status_code}")
+        try:
+            body = response.json()
+        except ValueError:
+            # Sin respuesta legible de Flutterwave (p. ej. HTML de un proxy): el estado es desconocido
+            raise GatewayError(f"Flutterwave returned a non-JSON response ({response.status_code})")
+        if body.get('status') != 'success':
+            if response.status_code == 400:
+                # Flutterwave no conoce la referencia: el usuario nunca llegó a pagar
+                return STATUS_PENDING
+            raise ProviderError(body.get('message') or f"Flutterwave returned {response.status_code}")
+        return check_flutterwave_payment(transaction_obj, body.get('data')) or STATUS_PENDING
+
+
+class PayPalProvider:
+    name = 'paypal'
+    currency = 'USD'
+    failed_states = ('failed', 'canceled', 'expired')
+    # Errores de execute tras los que el pago ya no se puede completar. El resto (p. ej.
+    # INSTRUMENT_DECLINED) el comprador los puede resolver volviendo a PayPal
+    terminal_errors = ('PAYMENT_EXPIRED', 'TRANSACTION_REFUSED', 'INVALID_RESOURCE_ID')
+
+    def create_checkout(self, transaction_obj, return_url, cancel_url):
+        """Crea el pago en PayPal; devuelve (payment_id, approval_url)"""
+        amount = str(transaction_obj.amount)
+        payload = {
+            "intent": "sale",
+            "payer": {
+                "payment_method": "paypal"
+            },
+            "redirect_urls": {
+                "return_url": return_url,
+                "cancel_url": cancel_url
+            },
+            "transactions": [{
+                "item_list": {
+                    "items": [{
+                        "name": "Cart Items",
+                        "sku": "cart",
+                        "price": amount,
+                        "currency": transaction_obj.currency,
+                        "quantity": 1
+                    }]
+                },
+                "amount": {
+                    "total": amount,
+                    "currency": transaction_obj.currency
+                },
+                "description": "Payment for cart items."
+            }]
+        }
+        payment = self._json(get_paypal_client().create_payment(payload, request_id=transaction_obj.ref))
+        approval_url = next((link["href"] for link in payment.get("links", []) if link.get("rel") == "approval_url"), None)
+        return payment["id"], approval_url
+
+    def execute(self, payment_id, payer_id):
+        return self._json(get_paypal_client().execute_payment(payment_id, payer_id))
+
+    def check(self, transaction_obj):
+        if not transaction_obj.provider_ref:
+            # Sin id de pago no se puede ejecutar ni consultar: nunca se completará
+            return STATUS_PENDING
+        response = get_paypal_client().get_payment(transaction_obj.provider_ref)
+        if response.status_code == 404:
+            return STATUS_PENDING
+        payment = self._json(response)
+        if payment.get("state") == 'approved':
+            return STATUS_COMPLETED
+        if payment.get("state") in self.failed_states:
+            return STATUS_FAILED
+        return STATUS_PENDING
+
+    def _json(self, response):
+        """Cuerpo de una respuesta correcta; ProviderError si PayPal rechaza la operación (4xx)"""
+        if response.status_code >= 500:
+            raise GatewayError(f"PayPal returned {response.status_code}")
+        try:
+            body = response.json()
+        except ValueError:
+            body = {}
+        if response.status_code >= 400:
+            raise ProviderError(body.get("message") or body.get("name") or f"PayPal returned {response.status_code}",
+                                code=body.get("name"))
+        return body
+
+
+PROVIDERS = {provider.name: provider for provider in (FlutterwaveProvider(), PayPalProvider())}
+
+
+def get_provider(name):
+    try:
+        return PROVIDERS[name]
+    except KeyError:
+        raise ProviderError(f"Unknown payment provider '{name}'")
@@ -0,0 +1,78 @@
+"""
+Reconciliación de transacciones que se quedaron en 'pending' (el usuario cerró la pestaña
+antes de volver de la pasarela, se perdió el webhook, etc.).
+
+Recorre las pendientes más antiguas que `older_than` minutos por lotes (índice
+transaction_status_created_idx), consulta cada una en su pasarela con un pool de hilos
+acotado y aplica los resultados del lote de golpe con complete_transactions/fail_transactions.
+Los hilos solo hacen HTTP; todas las escrituras van en el hilo principal.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.utils import timezone
+
+from shop_app.models import Transaction
+from shop_app.services.gateways import GatewayError
+from shop_app.services.payments import (STATUS_COMPLETED, STATUS_FAILED, STATUS_PENDING, complete_transactions,
+                                        fail_transactions)
+from shop_app.services.providers import ProviderError, get_provider
+
+logger = logging.getLogger(__name__)
+
+# La pasarela no dio una respuesta fiable: la transacción no se toca, ni siquiera si caducó
+UNKNOWN = 'unknown'
+
+
+def check_transaction(transaction_obj):
+    """'completed', 'failed', 'pending' (según la pasarela) o UNKNOWN si no se pudo consultar"""
+    try:
+        return get_provider(transaction_obj.provider).check(transaction_obj)
+    except (GatewayError, ProviderError, ValueError) as e:
+        logger.warning("Could not check transaction %s: %s", transaction_obj.ref, e)
+        return UNKNOWN
+
+
+def pending_batches(older_than=15, batch_size=100, now=None):
+    """Lotes de transacciones pendientes creadas hace más de `older_than` minutos, por id"""
+    cutoff = (now or timezone.now()) - timedelta(minutes=older_than)
+    queryset = (Transaction.objects.filter(status=STATUS_PENDING, created_at__lt=cutoff)
+                .only('id', 'ref', 'amount', 'currency', 'provider', 'provider_ref', 'created_at'))
+    last_id = 0
+    while True:
+        batch = list(queryset.filter(id__gt=last_id).order_by('id')[:batch_size])
+        if not batch:
+            return
+        last_id = batch[-1].id
+        yield batch
+
+
+def reconcile(older_than=15, batch_size=100, workers=8, expire_after=24 * 60, now=None, on_batch=None):
+    """
+    Devuelve {"checked", "completed", "failed", "pending"}. Las transacciones más antiguas que
+    `expire_after` minutos se dan por fallidas solo si la pasarela responde que el pago no
+    existe o sigue sin terminar; si no se pudo consultar, se quedan pendientes.
+    """
+    now = now or timezone.now()
+    expire_cutoff = now - timedelta(minutes=expire_after) if expire_after else None
+    totals = {'checked': 0, 'completed': 0, 'failed': 0, 'pending': 0}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='reconcile') as executor:
+        for batch in pending_batches(older_than, batch_size, now=now):
+            completed, failed = [], []
+            for transaction_obj, result in zip(batch, executor.map(check_transaction, batch)):
+                if result == STATUS_COMPLETED:
+                    completed.append(transaction_obj.ref)
+                elif result == STATUS_FAILED or (result == STATUS_PENDING and expire_cutoff
+                                                 and transaction_obj.created_at < expire_cutoff):
+                    failed.append(transaction_obj.ref)
+            completed = complete_transactions(completed)
+            failed_count = fail_transactions(failed)
+
+            totals['checked'] += len(batch)
+            totals['completed'] += len(completed)
+            totals['failed'] += failed_count
+            totals['pending'] += len(batch) - len(completed) - failed_count
+            if on_batch:
+                on_batch(totals)
+    return totals
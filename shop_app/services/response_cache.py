@@ -0,0 +1,131 @@
+import logging
+import threading
+from collections import OrderedDict
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+logger = logging.getLogger(__name__)
+
+
+class LRUBackend:
+    """Caché en memoria del proceso con expulsión LRU por número de entradas"""
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        # Sin caducidad: las entradas solo salen por expulsión LRU
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class DjangoCacheBackend:
+    """
+    Usa un alias de CACHES (p. ej. FileBasedCache) compartido entre workers de la misma máquina.
+    El alias debe ser exclusivo para esto porque clear() lo vacía entero.
+    """
+
+    def __init__(self, alias='catalog', timeout=None):
+        self.cache = caches[alias]
+        self.timeout = timeout
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value, timeout=None):
+        self.cache.set(key, value, self.timeout if timeout is None else timeout)
+
+    def delete(self, key):
+        self.cache.delete(key)
+
+    def clear(self):
+        self.cache.clear()
+
+
+class CachedResponse(Response):
+    """
+    Response de DRF con el cuerpo ya renderizado: pasa por finalize_response como cualquier
+    otra (Allow, Vary: Accept, Content-Type del renderer) pero no vuelve a serializar.
+    """
+
+    def __init__(self, content, **kwargs):
+        super().__init__(**kwargs)
+        self.cached_content = content
+
+    @property
+    def rendered_content(self):
+        renderer = self.accepted_renderer
+        content_type = self.content_type
+        if content_type is None:
+            content_type = f"{renderer.media_type}; charset={renderer.charset}" if renderer.charset else renderer.media_type
+        self['Content-Type'] = content_type
+        return self.cached_content
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """Instancia el backend configurado en CATALOG_RESPONSE_CACHE (None = desactivado)"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                config = getattr(settings, 'CATALOG_RESPONSE_CACHE', {})
+                backend_path = config.get('BACKEND', 'shop_app.services.response_cache.LRUBackend')
+                _backend = import_string(backend_path)(**config.get('OPTIONS', {})) if backend_path else False
+    return _backend or None
+
+
+def build_key(kind, version, request):
+    params = sorted(request.query_params.lists())
+    return f"{kind}:v{version}:{request.path}?{urlencode(params, doseq=True)}"
+
+
+def cached_json_response(request, kind, version, build_data):
+    """
+    Devuelve los bytes JSON ya codificados si están en caché; si no, llama a build_data(),
+    serializa una vez y guarda el resultado. Solo aplica cuando el cliente pide JSON.
+    """
+    backend = get_backend()
+    if backend is None or request.accepted_renderer.format != 'json':
+        return Response(build_data())
+
+    key = build_key(kind, version, request)
+    content = backend.get(key)
+    if content is None:
+        content = JSONRenderer().render(build_data())
+        backend.set(key, content)
+    return CachedResponse(content)
+
+
+def invalidate():
+    backend = get_backend()
+    if backend is not None:
+        backend.clear()
@@ -0,0 +1,246 @@
+"""
+Búsqueda de productos con índice invertido y ranking BM25.
+
+Usa una tabla virtual FTS5 de SQLite cuando está disponible y, si no (otra base de datos o
+SQLite sin FTS5), un índice invertido en memoria que se reconstruye cuando cambia la
+versión del catálogo. Ambos indexan el texto ya normalizado (minúsculas y sin acentos),
+así "audífonos" y "AUDIFONOS" encuentran lo mismo.
+"""
+import bisect
+import logging
+import math
+import re
+import threading
+import unicodedata
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from shop_app.models import Product
+from shop_app.services.catalog import get_catalog_version
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = 'shop_app_product_search'
+
+# Pesos por campo: name, description, category
+FIELD_WEIGHTS = (10.0, 2.0, 5.0)
+
+# Las categorías se guardan en inglés; se indexan también sus nombres en español
+CATEGORY_SYNONYMS = {
+    'Headphones': 'headphones auriculares audifonos cascos',
+    'Speakers': 'speakers altavoces parlantes bocinas',
+    'Streaming': 'streaming transmision microfonos camaras',
+}
+
+MIN_PREFIX_LENGTH = 3
+
+_TOKEN_RE = re.compile(r'\w+')
+
+
+def fold(text):
+    """Minúsculas y sin diacríticos: 'Audífonos Inalámbricos' -> 'audifonos inalambricos'"""
+    if not text:
+        return ''
+    decomposed = unicodedata.normalize('NFKD', str(text).lower())
+    return ''.join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(fold(text))
+
+
+def get_document(product):
+    """Textos indexados de un producto (name, description, category)"""
+    category = product.category or ''
+    return (
+        fold(product.name),
+        fold(product.description),
+        fold(f"{category} {CATEGORY_SYNONYMS.get(category, '')}"),
+    )
+
+
+# --- Backend FTS5 ---------------------------------------------------------
+
+_fts_available = None
+
+
+def fts_available():
+    global _fts_available
+    if _fts_available is None:
+        backend = getattr(settings, 'PRODUCT_SEARCH_BACKEND', 'auto')
+        if backend == 'python' or connection.vendor != 'sqlite':
+            _fts_available = False
+        else:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+                _fts_available = cursor.fetchone() is not None
+    return _fts_available
+
+
+def _fts_match_expression(tokens, operator):
+    terms = []
+    for token in tokens:
+        quoted = '"' + token.replace('"', '""') + '"'
+        terms.append(f"{quoted}*" if len(token) >= MIN_PREFIX_LENGTH else quoted)
+    return f" {operator} ".join(terms)
+
+
+def _fts_search(tokens, limit):
+    weights = ', '.join(str(weight) for weight in FIELD_WEIGHTS)
+    sql = (
+        f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s "
+        f"ORDER BY bm25({FTS_TABLE}, {weights}) LIMIT %s"
+    )
+    with connection.cursor() as cursor:
+        for operator in ('AND', 'OR'):
+            cursor.execute(sql, [_fts_match_expression(tokens, operator), limit])
+            ids = [row[0] for row in cursor.fetchall()]
+            if ids or len(tokens) == 1:
+                return ids
+    return []
+
+
+def _fts_index(products, replace=True):
+    with connection.cursor() as cursor:
+        if replace:
+            cursor.executemany(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [[product.id] for product in products])
+        cursor.executemany(
+            f"INSERT INTO {FTS_TABLE} (rowid, name, description, category) VALUES (%s, %s, %s, %s)",
+            [[product.id, *get_document(product)] for product in products]
+        )
+
+
+# --- Backend en memoria ----------------------------------------------------
+
+class InvertedIndex:
+    """Índice invertido con puntuación BM25F sobre name/description/category"""
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self, documents):
+        # documents: iterable de (id, (name, description, category)) ya normalizados
+        self.postings = defaultdict(dict)  # término -> {doc_id: [tf por campo]}
+        self.lengths = {}
+        totals = [0] * len(FIELD_WEIGHTS)
+        for doc_id, fields in documents:
+            lengths = []
+            for position, text in enumerate(fields):
+                tokens = _TOKEN_RE.findall(text)
+                lengths.append(len(tokens))
+                totals[position] += len(tokens)
+                for token in tokens:
+                    frequencies = self.postings[token].setdefault(doc_id, [0] * len(FIELD_WEIGHTS))
+                    frequencies[position] += 1
+            self.lengths[doc_id] = lengths
+        count = max(len(self.lengths), 1)
+        self.average_lengths = [max(total / count, 1) for total in totals]
+        self.vocabulary = sorted(self.postings)
+
+    def expand(self, token):
+        """Términos del vocabulario que empiezan por `token` (búsqueda por prefijo)"""
+        if len(token) < MIN_PREFIX_LENGTH:
+            return [token] if token in self.postings else []
+        start = bisect.bisect_left(self.vocabulary, token)
+        matches = []
+        for term in self.vocabulary[start:]:
+            if not term.startswith(token):
+                break
+            matches.append(term)
+        return matches
+
+    def score_token(self, token):
+        scores = defaultdict(float)
+        total_docs = len(self.lengths)
+        for term in self.expand(token):
+            postings = self.postings[term]
+            idf = math.log(1 + (total_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, frequencies in postings.items():
+                # BM25F: se combinan las frecuencias normalizadas de cada campo con su peso
+                weighted_tf = 0.0
+                for position, tf in enumerate(frequencies):
+                    if tf:
+                        norm = 1 - self.b + self.b * self.lengths[doc_id][position] / self.average_lengths[position]
+                        weighted_tf += FIELD_WEIGHTS[position] * tf / norm
+                scores[doc_id] = max(scores[doc_id], idf * weighted_tf / (self.k1 + weighted_tf))
+        return scores
+
+    def search(self, tokens, limit):
+        per_token = [self.score_token(token) for token in tokens]
+        for require_all in (True, False):
+            candidates = set(per_token[0]) if per_token else set()
+            for scores in per_token[1:]:
+                candidates = candidates & set(scores) if require_all else candidates | set(scores)
+            if candidates or len(tokens) == 1:
+                break
+        ranked = sorted(candidates, key=lambda doc_id: (-sum(s.get(doc_id, 0.0) for s in per_token), doc_id))
+        return ranked[:limit]
+
+
+_memory_index = None
+_memory_version = None
+_memory_lock = threading.Lock()
+
+
+def _get_memory_index():
+    global _memory_index, _memory_version
+    version = get_catalog_version()
+    if _memory_index is None or _memory_version != version:
+        with _memory_lock:
+            if _memory_index is None or _memory_version != version:
+                products = Product.objects.only('id', 'name', 'description', 'category').iterator()
+                _memory_index = InvertedIndex((product.id, get_document(product)) for product in products)
+                _memory_version = version
+    return _memory_index
+
+
+# --- API pública -----------------------------------------------------------
+
+def search_ids(query, limit=10):
+    """Ids de productos ordenados por relevancia"""
+    tokens = tokenize(query)
+    if not tokens:
+        return []
+    if fts_available():
+        return _fts_search(tokens, limit)
+    return _get_memory_index().search(tokens, limit)
+
+
+def search_products(query, limit=10):
+    """Productos ordenados por relevancia (una consulta para cargar los objetos)"""
+    ids = search_ids(query, limit)
+    products = Product.objects.in_bulk(ids)
+    return [products[product_id] for product_id in ids if product_id in products]
+
+
+def index_product(product):
+    if fts_available():
+        _fts_index([product])
+
+
+def remove_product(product_id):
+    if fts_available():
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [product_id])
+
+
+def rebuild_index(batch_size=1000):
+    """Reindexa todo el catálogo; devuelve el número de productos indexados"""
+    global _memory_index
+    if not fts_available():
+        _memory_index = None
+        return Product.objects.count()
+    total = 0
+    batch = []
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE}")
+        for product in Product.objects.only('id', 'name', 'description', 'category').iterator(chunk_size=batch_size):
+            batch.append(product)
+            if len(batch) >= batch_size:
+                _fts_index(batch, replace=False)
+                total += len(batch)
+                batch = []
+        _fts_index(batch, replace=False)
+    return total + len(batch)
@@ -0,0 +1,122 @@
+import bisect
+import logging
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Max, Q
+from django.db.models.functions import Abs
+
+from shop_app.models import Product, SimilarProduct
+
+logger = logging.getLogger(__name__)
+
+
+def get_similar_limit():
+    """Número máximo de productos similares guardados por producto"""
+    return getattr(settings, 'SIMILAR_PRODUCTS_LIMIT', 4)
+
+
+def rank_similar_products(product, limit=None):
+    """Calcula los N productos más parecidos: misma categoría y precio más cercano"""
+    limit = limit or get_similar_limit()
+    if not product.category:
+        return []
+    return list(
+        Product.objects.filter(category=product.category)
+        .exclude(id=product.id)
+        .annotate(distance=Abs(F('price') - Decimal(str(product.price))))
+        .order_by('distance', 'id')
+        .values_list('id', 'distance')[:limit]
+    )
+
+
+def rebuild_for_products(product_ids):
+    """Recalcula el índice solo para los productos indicados"""
+    limit = get_similar_limit()
+    products = Product.objects.filter(id__in=product_ids).only('id', 'category', 'price')
+    with transaction.atomic():
+        SimilarProduct.objects.filter(product_id__in=product_ids).delete()
+        links = []
+        for product in products:
+            for rank, (similar_id, distance) in enumerate(rank_similar_products(product, limit)):
+                links.append(SimilarProduct(product=product, similar_id=similar_id, rank=rank, distance=distance))
+        SimilarProduct.objects.bulk_create(links)
+
+
+def rebuild_all(batch_size=1000):
+    """
+    Reconstruye el índice completo (backfill, importación masiva o cambio de SIMILAR_PRODUCTS_LIMIT).
+    Carga cada categoría ordenada por precio y busca los vecinos con bisect, así el coste es
+    O(n log n) en lugar de una consulta por producto.
+    """
+    limit = get_similar_limit()
+    rows = (Product.objects.exclude(category__isnull=True).exclude(category='')
+            .order_by('category', 'price', 'id').values_list('id', 'category', 'price'))
+    by_category = {}
+    for product_id, category, price in rows.iterator(chunk_size=batch_size):
+        ids, prices = by_category.setdefault(category, ([], []))
+        ids.append(product_id)
+        prices.append(price)
+
+    total = 0
+    with transaction.atomic():
+        SimilarProduct.objects.all().delete()
+        links = []
+        for ids, prices in by_category.values():
+            for i, price in enumerate(prices):
+                nearby = [j for j in range(max(0, i - limit), min(len(ids), i + limit + 1)) if j != i]
+                if not nearby:
+                    continue
+                # Radio que seguro contiene los N más cercanos; dentro se desempata por id
+                radius = sorted(abs(prices[j] - price) for j in nearby)[min(limit, len(nearby)) - 1]
+                start = bisect.bisect_left(prices, price - radius)
+                end = bisect.bisect_right(prices, price + radius)
+                ranked = sorted((abs(prices[j] - price), ids[j]) for j in range(start, end) if j != i)[:limit]
+                for rank, (distance, similar_id) in enumerate(ranked):
+                    links.append(SimilarProduct(product_id=ids[i], similar_id=similar_id,
+                                                rank=rank, distance=distance))
+                if len(links) >= batch_size:
+                    SimilarProduct.objects.bulk_create(links)
+                    links = []
+            total += len(ids)
+        SimilarProduct.objects.bulk_create(links)
+    return total
+
+
+def get_affected_products(product):
+    """
+    Productos cuyo top-N puede cambiar al guardar `product`:
+    los que ya lo incluyen y los de su categoría donde ahora entraría (tienen hueco
+    o su peor vecino está igual o más lejos que él).
+    """
+    limit = get_similar_limit()
+    affected = get_products_linking_to(product.id)
+    affected.add(product.id)
+    if product.category:
+        candidates = (
+            Product.objects.filter(category=product.category)
+            .exclude(id=product.id)
+            .annotate(link_count=Count('similar_links'), worst=Max('similar_links__distance'))
+            .filter(Q(link_count__lt=limit) | Q(worst__gte=Abs(F('price') - Decimal(str(product.price)))))
+            .values_list('id', flat=True)
+        )
+        affected.update(candidates)
+    return affected
+
+
+def get_products_linking_to(product_id):
+    return set(SimilarProduct.objects.filter(similar_id=product_id).values_list('product_id', flat=True))
+
+
+def on_product_saved(product):
+    """Actualiza el índice y devuelve los ids de productos cuyo detalle cambió"""
+    affected = get_affected_products(product)
+    rebuild_for_products(affected)
+    return affected
+
+
+def on_product_deleted(affected_ids):
+    if affected_ids:
+        rebuild_for_products(affected_ids)
+    return affected_ids
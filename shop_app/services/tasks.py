@@ -0,0 +1,56 @@
+"""
+Cola de tareas en segundo plano dentro del proceso (pool de hilos).
+
+Sirve para sacar del ciclo de la petición las llamadas lentas a las pasarelas. Las tareas
+deben ser idempotentes: si el proceso se reinicia con tareas en cola se pierden, y las
+recupera reconcile_transactions. Con BACKGROUND_TASKS['EAGER'] se ejecutan en el momento
+(tests y desarrollo).
+"""
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_config():
+    return {'WORKERS': 4, 'EAGER': False, **getattr(settings, 'BACKGROUND_TASKS', {})}
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=get_config()['WORKERS'], thread_name_prefix='shop-task')
+    return _executor
+
+
+def _run(func, args, kwargs):
+    try:
+        return func(*args, **kwargs)
+    except Exception:
+        logger.exception("Background task %s failed", getattr(func, '__name__', func))
+        raise
+    finally:
+        # Cada hilo del pool tiene su propia conexión: no dejarla abierta entre tareas
+        close_old_connections()
+
+
+def submit(func, *args, **kwargs):
+    """Encola func(*args, **kwargs); devuelve un Future (ya resuelto en modo EAGER)"""
+    if not get_config()['EAGER']:
+        return get_executor().submit(_run, func, args, kwargs)
+    future = Future()
+    try:
+        future.set_result(func(*args, **kwargs))
+    except Exception as e:
+        logger.exception("Task %s failed", getattr(func, '__name__', func))
+        future.set_exception(e)
+    return future
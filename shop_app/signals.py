@@ -0,0 +1,70 @@
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .models import Cart, CartItem, Product
+from .services import cart_store, catalog, facets, response_cache, search, similar_products
+
+
+@receiver(pre_save, sender=Product)
+def product_saving(sender, instance, raw=False, **kwargs):
+    # Valores anteriores para mover los conteos de facetas de un rango a otro
+    instance._facet_previous = None
+    if instance.pk and not raw:
+        instance._facet_previous = (
+            Product.objects.filter(pk=instance.pk).values_list('category', 'price').first()
+        )
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_facet_previous', None)
+    affected = similar_products.on_product_saved(instance)
+    facets.on_product_saved(instance, previous, created)
+    if previous is not None and previous[1] != instance.price:
+        # Los carritos abiertos muestran el precio actual; los pagados conservan su total
+        open_carts = Cart.objects.filter(paid=False, items__product=instance).values_list('id', flat=True)
+        Cart.refresh_totals_for(list(open_carts))
+    search.index_product(instance)
+    catalog.bump_product_versions(affected)
+    catalog.bump_catalog_version()
+    response_cache.invalidate()
+
+
+@receiver(pre_delete, sender=Product)
+def product_deleting(sender, instance, **kwargs):
+    # Guardar quién apuntaba a este producto antes de que el CASCADE borre los enlaces
+    instance._similar_affected = similar_products.get_products_linking_to(instance.id)
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    affected = similar_products.on_product_deleted(getattr(instance, '_similar_affected', set()))
+    search.remove_product(instance.id)
+    facets.on_product_deleted(instance)
+    catalog.bump_product_versions(affected)
+    catalog.bump_catalog_version()
+    response_cache.invalidate()
+
+
+@receiver(post_save, sender=CartItem)
+@receiver(post_delete, sender=CartItem)
+def cart_item_changed(sender, instance, raw=False, **kwargs):
+    if raw or cart_store.is_syncing():
+        # Las escrituras del store recalculan los totales una vez por lote al hacer flush
+        return
+    Cart.refresh_totals_for([instance.cart_id])
+    if cart_store.enabled():
+        cart = instance.cart if CartItem.cart.is_cached(instance) else None
+        cart_code = cart.cart_code if cart else (
+            Cart.objects.filter(pk=instance.cart_id).values_list('cart_code', flat=True).first())
+        cart_store.invalidate(cart_code)
+
+
+@receiver(post_save, sender=Cart)
+@receiver(post_delete, sender=Cart)
+def cart_changed(sender, instance, raw=False, **kwargs):
+    # Un carrito pagado o editado fuera del store no debe seguir sirviéndose desde la caché
+    if not raw and not cart_store.is_syncing():
+        cart_store.invalidate(instance.cart_code)
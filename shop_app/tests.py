@@ -1,3 +1,1255 @@
-from django.test import TestCase
+import io
+import json
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import OperationalError, close_old_connections, connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APITestCase
+
+from chatbot.services import get_product_details
+from core.authentication import ClaimsUser, user_cache
+
+from .models import Cart, CartItem, Order, PaymentEvent, Product, RetiredCartCode, SimilarProduct, Transaction
+from .serializers import ProductSerializer
+from .services import (analytics, cart_cleanup, cart_store, catalog_io, gateways, payments, response_cache,
+                       search, similar_products)
+from .services.cart import add_to_cart, update_item_quantity
+from .services.fake_gateway import FakeGatewayServer, FakeGatewayState
+from .services.orders import create_checkout_transaction
+from .services.payments import complete_transactions
+from .services.providers import ProviderError, get_provider
+from .services.reconcile import reconcile
+from .views import MAX_CART_LOOKUP_IDS
+
+
+class QueryBudgetTests(APITestCase):
+    """
+    Cada endpoint debe ejecutar un número fijo de consultas, sin importar cuántos productos
+    tenga el catálogo o el carrito. Si alguno de estos tests falla, hay un N+1 nuevo.
+    """
+    SIZES = (1, 10, 100)
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username="buyer", email="buyer@example.com",
+                                                         password="secret", phone="123")
+        response_cache.invalidate()
+
+    def make_cart(self, size, paid=False, user=None):
+        products = Product.objects.bulk_create(
+            Product(name=f"Product {i}", slug=f"product-{size}-{i}", image="img/x.jpg", price=10 + i,
+                    category="Speakers")
+            for i in range(size)
+        )
+        cart = Cart.objects.create(cart_code=f"cart{size}{'p' if paid else ''}", paid=paid, user=user)
+        CartItem.objects.bulk_create(CartItem(cart=cart, product=product, quantity=2) for product in products)
+        Cart.refresh_totals_for([cart.id])
+        return cart, products
+
+    def assertBudget(self, budget, method, url, data=None, user=None):
+        if user:
+            self.client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url, data, format="json")
+        if user:
+            self.client.force_authenticate(None)
+        self.assertLess(response.status_code, 400, response.content)
+        self.assertEqual(
+            len(queries), budget,
+            f"{method.upper()} {url}: {len(queries)} queries, budget {budget}\n"
+            + "\n".join(query["sql"] for query in queries.captured_queries)
+        )
+        return response
+
+    def test_catalog_endpoints(self):
+        for size in self.SIZES:
+            with self.subTest(size=size):
+                cart, products = self.make_cart(size)
+                response_cache.invalidate()
+                # Estado del catálogo (ETag) + productos (+ facetas en la respuesta paginada)
+                self.assertBudget(2, "get", "/products")
+                self.assertBudget(3, "get", "/products?limit=5&fields=id,name")
+                # El cursor lee el campo del orden aunque ?fields= no lo pida
+                response = self.assertBudget(3, "get", "/products?limit=1&ordering=price&fields=name")
+                self.assertEqual(json.loads(response.content)["next_cursor"] is not None, Product.objects.count() > 1)
+                # Con filtros las facetas se cuentan sobre el listado filtrado: categorías + rangos de precio
+                response = self.assertBudget(4, "get", "/products?limit=5&category=Speakers&max_price=10")
+                matching = Product.objects.filter(category="Speakers", price__lte=10).count()
+                self.assertEqual(json.loads(response.content)["facets"],
+                                 {"category": {"Speakers": matching}, "price": {"0-50": matching}})
+                # Estado del producto (ETag) + producto + similares
+                self.assertBudget(3, "get", f"/product_detail/{products[0].slug}")
+
+    def test_cart_read_endpoints(self):
+        for size in self.SIZES:
+            with self.subTest(size=size):
+                cart, products = self.make_cart(size)
+                self.assertBudget(1, "get", f"/get_cart_stat?cart_code={cart.cart_code}")
+                self.assertBudget(2, "get", f"/get_cart?cart_code={cart.cart_code}")
+                self.assertBudget(1, "get", f"/product_in_cart?cart_code={cart.cart_code}&product_id={products[0].id}")
+                ids = ",".join(str(product.id) for product in products)
+                response = self.assertBudget(1, "get", f"/products_in_cart?cart_code={cart.cart_code}&product_ids={ids}")
+                self.assertEqual(len(response.data["products"]), size)
+                self.assertBudget(1, "get", f"/products_in_cart?cart_code={cart.cart_code}")
+
+    def test_cart_write_endpoints(self):
+        for size in self.SIZES:
+            with self.subTest(size=size):
+                cart, products = self.make_cart(size)
+                extra, other = (Product.objects.create(name=f"Extra {size} {i}", image="img/x.jpg", price=5)
+                                for i in range(2))
+                item = cart.items.first()
+                self.assertBudget(6, "post", "/add_item/", {"cart_code": cart.cart_code, "product_id": extra.id})
+                # La línea ya existe: INSERT fallido + UPDATE quantity = quantity + 1
+                response = self.assertBudget(9, "post", "/add_item/", {"cart_code": cart.cart_code, "product_id": extra.id})
+                self.assertEqual(response.data["datat"]["quantity"], 2)
+                self.assertBudget(3, "patch", "/update_quantity/", {"item_id": item.id, "quantity": 3})
+                response = self.assertBudget(3, "patch", "/update_quantity/", {"item_id": item.id, "delta": -1})
+                self.assertEqual(response.data["data"]["quantity"], 2)
+                # Suma en las líneas existentes + una línea nueva + un borrado
+                lines = list(cart.items.order_by("id"))
+                operations = [{"op": "add", "product_id": line.product_id} for line in lines[:-1]]
+                operations += [{"op": "add", "product_id": other.id}, {"op": "remove", "item_id": lines[-1].id}]
+                self.assertBudget(15, "post", "/batch_update_cart/",
+                                  {"cart_code": cart.cart_code, "operations": operations})
+                self.assertBudget(3, "post", "/delete_cartitem", {"item_id": item.id})
+
+    def test_user_endpoints(self):
+        for size in self.SIZES:
+            with self.subTest(size=size):
+                cart, products = self.make_cart(size, paid=True, user=self.user)
+                transaction_obj = create_checkout_transaction(cart, self.user, get_provider("flutterwave"))
+                complete_transactions([transaction_obj.ref])
+                self.assertBudget(0, "get", "/get_username", user=self.user)
+                self.assertBudget(1, "get", "/user_info", user=self.user)
+                # Página de pedidos y sus líneas (prefetch)
+                response = self.assertBudget(2, "get", "/orders", user=self.user)
+                self.assertEqual(len(response.data["results"][0]["lines"]), size)
+
+    def test_jwt_claims_authentication(self):
+        user_cache.clear()
+        response = self.client.post("/token/", {"username": "buyer", "password": "secret"}, format="json")
+        refresh = response.data["refresh"]
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+        # El usuario sale de los claims del token
+        response = self.assertBudget(0, "get", "/get_username")
+        self.assertEqual(response.data["username"], "buyer")
+        # Email y teléfono desde la caché (cargada al emitir el token) + número de pedidos
+        response = self.assertBudget(1, "get", "/user_info")
+        self.assertEqual(response.data["phone"], "123")
+        # Sirve donde se espera el CustomUser (FK, filtros) cargando la fila de la caché
+        claims_user = ClaimsUser(str(self.user.pk), {"username": "buyer", "is_staff": False, "is_superuser": False})
+        with self.assertNumQueries(0):
+            self.assertEqual(claims_user.username, "buyer")
+            self.assertIsInstance(claims_user, get_user_model())
+        self.assertEqual(Cart(cart_code="claims0001", user=claims_user).user_id, self.user.pk)
+        # Guardar el usuario invalida la caché: una consulta más para releerlo
+        self.user.phone = "456"
+        self.user.save()
+        response = self.assertBudget(2, "get", "/user_info")
+        self.assertEqual(response.data["phone"], "456")
+        # Un usuario borrado ya no entra, aunque su token siga vigente
+        self.user.delete()
+        for url in ("/get_username", "/user_info", "/orders"):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 401)
+        self.client.credentials()
+        response = self.client.post("/token/refresh/", {"refresh": refresh}, format="json")
+        self.assertEqual(response.status_code, 401)
+        # Borrado en otro worker entre la autenticación y la lectura de sus campos
+        ghost = ClaimsUser("999", {"username": "ghost", "is_staff": False, "is_superuser": False})
+        self.assertEqual(ghost.username, "ghost")
+        with self.assertRaises(AuthenticationFailed):
+            ghost.email
+
+    def test_sales_analytics(self):
+        staff = get_user_model().objects.create_user(username="staff", email="staff@example.com", is_staff=True)
+        for size in self.SIZES:
+            with self.subTest(size=size):
+                cart, products = self.make_cart(size, user=self.user)
+                transaction_obj = create_checkout_transaction(cart, self.user, get_provider("flutterwave"))
+                complete_transactions([transaction_obj.ref])
+                # Totales, serie diaria, serie horaria, productos y categorías: solo rollups
+                response = self.assertBudget(5, "get", "/sales_analytics", {"days": 7}, user=staff)
+                self.assertEqual(response.data["totals"][0]["orders"], len([s for s in self.SIZES if s <= size]))
+
+        def rollups():
+            return [list(model.objects.order_by(*fields).values(*fields, "revenue", "units"))
+                    for model, fields in analytics.ROLLUPS]
+
+        # Lo sumado al completar cada pago coincide con recalcularlo todo desde Order/OrderLine
+        incremental = rollups()
+        analytics.rebuild()
+        self.assertEqual(rollups(), incremental)
+
+    @mock.patch("shop_app.services.gateways.FlutterwaveClient.create_payment")
+    def test_initiate_payment(self, create_payment):
+        create_payment.return_value = mock.Mock(status_code=200, json=lambda: {"status": "success"})
+        for size in self.SIZES:
+            with self.subTest(size=size):
+                cart, products = self.make_cart(size)
+                # Carrito y líneas, y en un savepoint Transaction + Order + OrderLine (un INSERT en bloque)
+                self.assertBudget(7, "post", "/initiate_payment/", {"cart_code": cart.cart_code}, user=self.user)
+
+
+class CartTotalsTests(APITestCase):
+    """item_count y subtotal denormalizados en Cart, al día tras cada cambio en sus líneas"""
+
+    def setUp(self):
+        self.speaker = Product.objects.create(name="Speaker", image="img/x.jpg", price="19.99")
+        self.cable = Product.objects.create(name="Cable", image="img/x.jpg", price="2.50")
+        self.cart = Cart.objects.create(cart_code="totals00001")
+
+    def totals(self, cart=None):
+        return tuple(Cart.objects.filter(pk=(cart or self.cart).pk).values_list("item_count", "subtotal").get())
+
+    def test_totals_follow_item_changes(self):
+        response = self.client.post("/add_item/", {"cart_code": self.cart.cart_code, "product_id": self.speaker.id,
+                                                   "quantity": 2}, format="json")
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(self.totals(), (2, Decimal("39.98")))
+        self.client.post("/add_item/", {"cart_code": self.cart.cart_code, "product_id": self.cable.id}, format="json")
+        self.client.post("/add_item/", {"cart_code": self.cart.cart_code, "product_id": self.cable.id}, format="json")
+        self.assertEqual(self.totals(), (4, Decimal("44.98")))
+
+        speaker_line = CartItem.objects.get(cart=self.cart, product=self.speaker)
+        self.client.patch("/update_quantity/", {"item_id": speaker_line.id, "quantity": 5}, format="json")
+        self.assertEqual(self.totals(), (7, Decimal("104.95")))
+        self.client.patch("/update_quantity/", {"item_id": speaker_line.id, "delta": -1}, format="json")
+        self.assertEqual(self.totals(), (6, Decimal("84.96")))
+
+        self.client.post("/delete_cartitem", {"item_id": speaker_line.id}, format="json")
+        self.assertEqual(self.totals(), (2, Decimal("5.00")))
+        CartItem.objects.filter(cart=self.cart).get().delete()
+        self.assertEqual(self.totals(), (0, Decimal("0.00")))
+
+    def test_price_change_updates_open_carts_only(self):
+        CartItem.objects.create(cart=self.cart, product=self.speaker, quantity=2)
+        paid = Cart.objects.create(cart_code="totals00002")
+        CartItem.objects.create(cart=paid, product=self.speaker, quantity=1)
+        Cart.objects.filter(pk=paid.pk).update(paid=True)
+
+        self.speaker.price = Decimal("25.00")
+        self.speaker.save()
+        self.assertEqual(self.totals(), (2, Decimal("50.00")))
+        # Un carrito pagado conserva el total que se cobró
+        self.assertEqual(self.totals(paid), (1, Decimal("19.99")))
+
+        # Guardar el producto sin cambiar el precio no toca los carritos
+        with mock.patch.object(Cart, "refresh_totals_for", wraps=Cart.refresh_totals_for) as refresh:
+            self.speaker.name = "Speaker v2"
+            self.speaker.save()
+        refresh.assert_not_called()
+
+
+class CartBatchTests(APITestCase):
+    """batch_update_cart: todas las operaciones o ninguna"""
+
+    def setUp(self):
+        self.speaker, self.cable, self.lamp = (Product.objects.create(name=name, image="img/x.jpg", price=10)
+                                               for name in ("Speaker", "Cable", "Lamp"))
+        self.cart = Cart.objects.create(cart_code="batch000001")
+        self.line = CartItem.objects.create(cart=self.cart, product=self.speaker, quantity=2)
+
+    def batch(self, operations, cart_code="batch000001"):
+        return self.client.post("/batch_update_cart/", {"cart_code": cart_code, "operations": operations},
+                                format="json")
+
+    def lines(self, cart_code="batch000001"):
+        return dict(CartItem.objects.filter(cart__cart_code=cart_code).values_list("product_id", "quantity"))
+
+    def test_operations_are_applied_together(self):
+        response = self.batch([
+            {"op": "add", "product_id": self.speaker.id},
+            {"op": "add", "product_id": self.cable.id, "quantity": 3},
+            {"op": "set", "item_id": self.line.id, "quantity": 5},
+            {"op": "add", "product_id": self.lamp.id},
+            {"op": "remove", "product_id": self.lamp.id},
+        ])
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(self.lines(), {self.speaker.id: 5, self.cable.id: 3})
+        self.assertEqual(Cart.objects.filter(pk=self.cart.pk).values_list("item_count", flat=True).get(), 8)
+
+    def test_invalid_operation_rolls_back_the_batch(self):
+        invalid = (
+            ({"op": "double", "product_id": 1}, "Unknown operation"),
+            ("add", "Unknown operation"),
+            ({"op": "add", "product_id": self.cable.id, "quantity": "many"}, "Invalid quantity"),
+            ({"op": "set", "product_id": "x"}, "Missing or invalid product_id"),
+            ({"op": "remove", "item_id": 999999}, "is not in cart"),
+            ({"op": "add", "product_id": 999999}, "Products not found: 999999"),
+        )
+        for operation, message in invalid:
+            with self.subTest(operation=operation):
+                response = self.batch([{"op": "add", "product_id": self.cable.id}, operation,
+                                       {"op": "set", "item_id": self.line.id, "quantity": 9}])
+                self.assertEqual(response.status_code, 400)
+                self.assertIn(message, response.data["error"])
+                self.assertEqual(self.lines(), {self.speaker.id: 2})
+                # El carrito nuevo que habría creado el lote tampoco queda
+                response = self.batch([{"op": "add", "product_id": self.cable.id}, operation], cart_code="batchnew001")
+                self.assertEqual(response.status_code, 400)
+                self.assertFalse(Cart.objects.filter(cart_code="batchnew001").exists())
+
+    def test_rejects_empty_batches_and_paid_carts(self):
+        self.assertIn("non-empty list", self.batch([]).data["error"])
+        self.assertEqual(self.client.post("/batch_update_cart/", {"operations": []}, format="json").status_code, 400)
+        Cart.objects.filter(pk=self.cart.pk).update(paid=True)
+        response = self.batch([{"op": "add", "product_id": self.cable.id}])
+        self.assertEqual((response.status_code, response.data["error"]), (400, "Cart is already paid"))
+        self.assertEqual(self.lines(), {self.speaker.id: 2})
+
+
+class ProductsInCartTests(APITestCase):
+
+    def setUp(self):
+        self.products = [Product.objects.create(name=f"Product {i}", image="img/x.jpg", price=10) for i in range(4)]
+        self.cart = Cart.objects.create(cart_code="lookup00001")
+        CartItem.objects.bulk_create(CartItem(cart=self.cart, product=product, quantity=i + 1)
+                                     for i, product in enumerate(self.products[:3]))
+
+    def lookup(self, query):
+        return self.client.get(f"/products_in_cart?{query}")
+
+    def quantities(self, query):
+        response = self.lookup(query)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.data["products"]
+
+    def test_returns_requested_products_in_cart(self):
+        first, second, third, absent = (product.id for product in self.products)
+        self.assertEqual(self.quantities(f"cart_code=lookup00001&product_ids={first},{third},{absent}"),
+                         {first: 1, third: 3})
+        # Parámetro repetido, espacios y comas sobrantes
+        self.assertEqual(self.quantities(f"cart_code=lookup00001&product_ids={first}&product_ids=%20{second},,"),
+                         {first: 1, second: 2})
+        # Sin product_ids: todo el carrito
+        self.assertEqual(self.quantities("cart_code=lookup00001"), {first: 1, second: 2, third: 3})
+        self.assertEqual(self.quantities("cart_code=unknown0001"), {})
+
+    def test_retired_cart_code(self):
+        merged = Cart.objects.create(cart_code="lookup00002")
+        CartItem.objects.create(cart=merged, product=self.products[3], quantity=4)
+        RetiredCartCode.objects.create(cart_code="anon0000001", cart=merged)
+        self.assertEqual(self.quantities("cart_code=anon0000001"), {self.products[3].id: 4})
+        self.assertEqual(self.quantities(f"cart_code=anon0000001&product_ids={self.products[0].id}"), {})
+
+    def test_rejects_bad_requests(self):
+        self.assertEqual(self.lookup("product_ids=1").status_code, 400)
+        for product_ids in ("1,x", "1.5", "abc"):
+            with self.subTest(product_ids=product_ids):
+                response = self.lookup(f"cart_code=lookup00001&product_ids={product_ids}")
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("Invalid product_ids", response.data["error"])
+
+    def test_limits_ids_per_request(self):
+        allowed = ",".join(str(i) for i in range(1, MAX_CART_LOOKUP_IDS + 1))
+        self.assertEqual(self.lookup(f"cart_code=lookup00001&product_ids={allowed}").status_code, 200)
+        response = self.lookup(f"cart_code=lookup00001&product_ids={allowed},{MAX_CART_LOOKUP_IDS + 1}")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(f"At most {MAX_CART_LOOKUP_IDS}", response.data["error"])
+        # Los repetidos cuentan una vez
+        self.assertEqual(self.lookup(f"cart_code=lookup00001&product_ids={allowed},1,2").status_code, 200)
+
+
+def wait_for_locks(execute, sql, params, many, context):
+    """
+    SQLite en memoria compartida no espera a los bloqueos (no hay busy timeout): se reintenta
+    la sentencia bloqueada, como haría el timeout de un SQLite en disco o la espera de Postgres
+    """
+    deadline = time.monotonic() + 5
+    while True:
+        try:
+            return execute(sql, params, many, context)
+        except OperationalError as e:
+            if "locked" not in str(e) or time.monotonic() > deadline:
+                raise
+            time.sleep(0.001)
+
+
+class CartLineConcurrencyTests(TransactionTestCase):
+    """Ruta de base de datos (sin cart_store): sumas simultáneas sobre la misma línea"""
+    THREADS = 4
+    REPEAT = 5
+
+    def setUp(self):
+        self.product = Product.objects.create(name="Speaker", image="img/x.jpg", price=10)
+        self.cart = Cart.objects.create(cart_code="race0000001")
+
+    def run_concurrently(self, target):
+        barrier = threading.Barrier(self.THREADS)
+        errors = []
+
+        def run():
+            try:
+                barrier.wait()
+                with connection.execute_wrapper(wait_for_locks):
+                    for _ in range(self.REPEAT):
+                        target()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                close_old_connections()
+
+        threads = [threading.Thread(target=run) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_concurrent_adds_end_in_one_line(self):
+        # Todas menos la primera chocan con unique_cart_product y suman con UPDATE quantity = quantity + 1
+        self.run_concurrently(lambda: add_to_cart(self.cart, self.product))
+        line = CartItem.objects.get(cart=self.cart, product=self.product)
+        self.assertEqual(line.quantity, self.THREADS * self.REPEAT)
+        self.assertEqual(Cart.objects.filter(pk=self.cart.pk).values_list("item_count", flat=True).get(),
+                         self.THREADS * self.REPEAT)
+
+    def test_concurrent_deltas_are_not_lost(self):
+        line = CartItem.objects.create(cart=self.cart, product=self.product, quantity=1)
+        self.run_concurrently(lambda: update_item_quantity(line.id, delta=1))
+        self.assertEqual(CartItem.objects.get(pk=line.pk).quantity, 1 + self.THREADS * self.REPEAT)
+
+    def test_decrement_to_zero_removes_line_once(self):
+        line = CartItem.objects.create(cart=self.cart, product=self.product, quantity=self.THREADS * self.REPEAT)
+        self.run_concurrently(lambda: update_item_quantity(line.id, delta=-1))
+        self.assertFalse(CartItem.objects.filter(pk=line.pk).exists())
+        self.assertEqual(Cart.objects.filter(pk=self.cart.pk).values_list("item_count", flat=True).get(), 0)
+
+
+class MergeDuplicateLinesMigrationTests(TransactionTestCase):
+    """0014 funde las líneas repetidas (cart, product) antes de crear unique_cart_product"""
+    before = [("shop_app", "0013_cart_paid_modified_idx")]
+    after = [("shop_app", "0014_cartitem_unique_cart_product")]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        self.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_duplicate_lines_are_merged(self):
+        apps = self.migrate(self.before)
+        Product, Cart, CartItem = (apps.get_model("shop_app", name) for name in ("Product", "Cart", "CartItem"))
+        speaker, cable = (Product.objects.create(name=name, image="img/x.jpg", price=10) for name in ("Speaker", "Cable"))
+        cart, other = (Cart.objects.create(cart_code=code) for code in ("dup00000001", "dup00000002"))
+        first = CartItem.objects.create(cart=cart, product=speaker, quantity=2)
+        CartItem.objects.create(cart=cart, product=speaker, quantity=3)
+        CartItem.objects.create(cart=cart, product=speaker, quantity=1)
+        single = CartItem.objects.create(cart=cart, product=cable, quantity=4)
+        elsewhere = CartItem.objects.create(cart=other, product=speaker, quantity=5)
+
+        apps = self.migrate(self.after)
+        CartItem = apps.get_model("shop_app", "CartItem")
+        self.assertEqual(sorted(CartItem.objects.values_list("id", "quantity")),
+                         sorted([(first.id, 6), (single.id, 4), (elsewhere.id, 5)]))
+
+
+class CartMergeTests(APITestCase):
+    """Login con un carrito anónimo (CartTokenObtainPairView + merge_carts) y uso posterior del código viejo"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username="buyer", password="secret")
+        self.speaker, self.headphones, self.cable = (
+            Product.objects.create(name=name, image="img/x.jpg", price=10) for name in ("Speaker", "Headphones", "Cable"))
+        self.anonymous = self.make_cart("anon0000001", {self.speaker: 2, self.headphones: 1})
+
+    def make_cart(self, cart_code, lines, user=None):
+        cart = Cart.objects.create(cart_code=cart_code, user=user)
+        CartItem.objects.bulk_create(CartItem(cart=cart, product=product, quantity=quantity)
+                                     for product, quantity in lines.items())
+        return cart
+
+    def login(self, cart_code=None):
+        data = {"username": "buyer", "password": "secret"}
+        if cart_code:
+            data["cart_code"] = cart_code
+        response = self.client.post("/token/", data, format="json")
+        self.assertEqual(response.status_code, 200, response.content)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+        return response.data["cart_code"]
+
+    def quantities(self, cart_code):
+        return {product.name: quantity for product, quantity in
+                ((item.product, item.quantity) for item in CartItem.objects.filter(cart__cart_code=cart_code))}
+
+    def test_login_claims_anonymous_cart_without_own_cart(self):
+        self.assertEqual(self.login("anon0000001"), "anon0000001")
+        self.assertEqual(Cart.objects.get(cart_code="anon0000001").user, self.user)
+        self.assertFalse(RetiredCartCode.objects.exists())
+
+    def test_login_without_cart_code_returns_open_cart(self):
+        self.assertIsNone(self.login())
+        own = self.make_cart("mine0000001", {self.cable: 1}, user=self.user)
+        self.assertEqual(self.login(), own.cart_code)
+
+    def test_login_merges_into_own_cart_and_retires_code(self):
+        own = self.make_cart("mine0000001", {self.speaker: 1}, user=self.user)
+        self.assertEqual(self.login("anon0000001"), own.cart_code)
+        self.assertEqual(self.quantities(own.cart_code), {"Speaker": 3, "Headphones": 1})
+        self.assertFalse(Cart.objects.filter(cart_code="anon0000001").exists())
+        self.assertEqual(RetiredCartCode.objects.get(cart_code="anon0000001").cart, own)
+
+    def test_other_users_cart_is_not_merged(self):
+        other = get_user_model().objects.create_user(username="other", password="secret")
+        self.anonymous.user = other
+        self.anonymous.save()
+        self.make_cart("mine0000001", {self.cable: 1}, user=self.user)
+        self.assertEqual(self.login("anon0000001"), "mine0000001")
+        self.assertEqual(self.quantities("anon0000001"), {"Speaker": 2, "Headphones": 1})
+
+    @mock.patch("shop_app.services.gateways.FlutterwaveClient.create_payment")
+    def test_retired_code_keeps_working(self, create_payment):
+        create_payment.return_value = mock.Mock(status_code=200, json=lambda: {"status": "success"})
+        own = self.make_cart("mine0000001", {self.cable: 1}, user=self.user)
+        self.login("anon0000001")
+
+        response = self.client.get(f"/product_in_cart?cart_code=anon0000001&product_id={self.headphones.id}")
+        self.assertTrue(response.data["product_in_cart"])
+        response = self.client.get("/products_in_cart?cart_code=anon0000001")
+        self.assertEqual(response.data["products"], {self.speaker.id: 2, self.headphones.id: 1, self.cable.id: 1})
+        self.assertEqual(self.client.get("/get_cart_stat?cart_code=anon0000001").data["cart_code"], own.cart_code)
+
+        response = self.client.post("/add_item/", {"cart_code": "anon0000001", "product_id": self.cable.id}, format="json")
+        self.assertEqual(response.status_code, 201, response.content)
+        response = self.client.post("/batch_update_cart/", {"cart_code": "anon0000001", "operations": [
+            {"op": "add", "product_id": self.speaker.id}]}, format="json")
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertFalse(Cart.objects.filter(cart_code="anon0000001").exists())
+        self.assertEqual(self.quantities(own.cart_code), {"Speaker": 3, "Headphones": 1, "Cable": 2})
+
+        response = self.client.post("/initiate_payment/", {"cart_code": "anon0000001"}, format="json")
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(Transaction.objects.get().cart, own)
+
+    def test_initiate_payment_unknown_cart_is_404(self):
+        self.login()
+        for url in ("/initiate_payment/", "/initiate_paypal_payment/"):
+            with self.subTest(url=url):
+                response = self.client.post(url, {"cart_code": "missing0001"}, format="json")
+                self.assertEqual(response.status_code, 404, response.content)
+
+
+class CatalogImportTests(TestCase):
+
+    def test_allocate_slugs(self):
+        for _ in range(2):
+            Product.objects.create(name="JBL Flip", image="img/x.jpg", price=10)
+        self.assertEqual(sorted(Product.objects.values_list("slug", flat=True)), ["jbl-flip", "jbl-flip-1"])
+        self.assertEqual(catalog_io.allocate_slugs(["jbl-flip", "jbl-flip", "jbl", "", ""]),
+                         ["jbl-flip-2", "jbl-flip-3", "jbl", "product", "product-1"])
+
+    def test_export_import_round_trip(self):
+        Product.objects.create(name="Speaker", slug="speaker", description="Loud", category="Speakers",
+                               price="19.99", image="img/speaker.jpg")
+        Product.objects.create(name="Cable", slug="cable", price="2.50", image="img/cable.jpg")
+        for fmt in ("csv", "jsonl"):
+            with self.subTest(fmt=fmt):
+                exported = io.StringIO()
+                self.assertEqual(catalog_io.export_catalog(exported, fmt), 2)
+                before = list(Product.objects.order_by("id").values(*catalog_io.IMPORT_FIELDS))
+                created, updated = catalog_io.import_catalog(io.StringIO(exported.getvalue()), fmt, batch_size=1)
+                self.assertEqual((created, updated), (0, 2))
+                self.assertEqual(list(Product.objects.order_by("id").values(*catalog_io.IMPORT_FIELDS)), before)
+
+    def test_blank_image_keeps_existing_image(self):
+        Product.objects.create(name="Speaker", slug="speaker", price="19.99", image="img/speaker.jpg")
+        rows = "name,slug,price,image\nSpeaker v2,speaker,24.99,\nNew,,5,\n"
+        self.assertEqual(catalog_io.import_catalog(io.StringIO(rows), "csv"), (1, 1))
+        speaker = Product.objects.get(slug="speaker")
+        self.assertEqual((speaker.name, speaker.price, speaker.image.name), ("Speaker v2", Decimal("24.99"), "img/speaker.jpg"))
+        self.assertEqual(Product.objects.get(slug="new").image.name, "")
+
+
+class CatalogFilterTests(APITestCase):
+    """Filtros del listado de productos y facetas contadas sobre el listado filtrado"""
+
+    def setUp(self):
+        for name, category, price in (("Speaker", "Speakers", 8), ("Big speaker", "Speakers", 60),
+                                      ("Headphones", "Headphones", 9)):
+            Product.objects.create(name=name, category=category, price=price, image="img/x.jpg")
+
+    def test_facets_count_the_filtered_listing(self):
+        response = self.client.get("/products?limit=5&category=Speakers&max_price=10")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([product["name"] for product in json.loads(response.content)["results"]], ["Speaker"])
+        self.assertEqual(json.loads(response.content)["facets"],
+                         {"category": {"Speakers": 1}, "price": {"0-50": 1}})
+
+    def test_products_rejects_non_finite_prices(self):
+        for value in ("NaN", "Infinity", "-inf", "abc"):
+            with self.subTest(value=value):
+                self.assertEqual(self.client.get(f"/products?min_price={value}").status_code, 400)
+
+
+class CatalogResponseCacheTests(APITestCase):
+    """Una respuesta servida desde la caché de JSON es igual, cabeceras incluidas, a la generada al momento"""
+
+    def test_cached_catalog_responses_match_uncached(self):
+        Product.objects.create(name="Speaker", slug="speaker", image="img/x.jpg", price=20, category="Speakers")
+        responses = []
+        for config in ({"BACKEND": None}, {}, {}):
+            with override_settings(CATALOG_RESPONSE_CACHE=config):
+                response_cache._backend = None
+                responses.append(self.client.get("/products?limit=5"))
+        response_cache._backend = None
+        uncached, miss, hit = ({name: value for name, value in response.headers.items() if name != "Date"}
+                               for response in responses)
+        self.assertEqual(miss, uncached)
+        self.assertEqual(hit, uncached)
+        self.assertIn("Accept", hit["Vary"])
+        self.assertEqual(responses[2].content, responses[0].content)
+
+
+class SimilarProductsTests(TestCase):
+    """Tras cada cambio, el índice actualizado de forma incremental es igual al de rebuild_all()"""
+    LIMITS = (1, 2, 4)
+
+    def make_catalog(self):
+        Product.objects.all().delete()
+        # 45 y 55 quedan a la misma distancia de 50: se desempata por id
+        self.speakers = {price: Product.objects.create(name=f"Speaker {price}", category="Speakers", price=price,
+                                                       image="img/x.jpg")
+                         for price in (10, 20, 30, 45, 50, 55, 80, 100)}
+        self.headphones = {price: Product.objects.create(name=f"Headphones {price}", category="Headphones",
+                                                         price=price, image="img/x.jpg")
+                           for price in (15, 40, 60)}
+        Product.objects.create(name="Cable", price=5, image="img/x.jpg")
+
+    def index(self):
+        return list(SimilarProduct.objects.order_by("product_id", "rank")
+                    .values_list("product_id", "similar_id", "rank", "distance"))
+
+    def check_each_limit(self, change):
+        for limit in self.LIMITS:
+            with self.subTest(limit=limit), override_settings(SIMILAR_PRODUCTS_LIMIT=limit):
+                self.make_catalog()
+                change()
+                incremental = self.index()
+                self.assertEqual(similar_products.rebuild_all(), Product.objects.exclude(category=None).count())
+                self.assertEqual(incremental, self.index())
+                self.assertLessEqual(max(SimilarProduct.objects.values_list("rank", flat=True)), limit - 1)
+
+    def test_creation(self):
+        self.check_each_limit(lambda: None)
+
+    def test_price_move_out_of_neighbours_top_n(self):
+        def change():
+            product = self.speakers[50]
+            product.price = 95
+            product.save()
+        self.check_each_limit(change)
+
+    def test_category_change(self):
+        def change():
+            product = self.speakers[45]
+            product.category = "Headphones"
+            product.save()
+        self.check_each_limit(change)
+
+    def test_delete_rebuilds_products_that_linked_to_it(self):
+        def change():
+            deleted = self.speakers[50]
+            linking = similar_products.get_products_linking_to(deleted.id)
+            self.assertTrue(linking)
+            deleted.delete()
+            # pre_delete guardó quién lo enlazaba: ya no queda ningún enlace y se rellenaron sus huecos
+            self.assertFalse(SimilarProduct.objects.filter(similar_id=deleted.id).exists())
+        self.check_each_limit(change)
+
+
+class SearchTests(APITestCase):
+    """Las mismas consultas contra FTS5 y contra el índice en memoria deben dar los mismos resultados"""
+    BACKENDS = ("auto", "python")
+
+    def setUp(self):
+        self.addCleanup(self.use_backend, "auto")
+        self.sony = Product.objects.create(name="Audífonos Sony WH-1000XM5", category="Headphones", price=300,
+                                           image="img/x.jpg", description="Cancelación de ruido")
+        self.flip = Product.objects.create(name="JBL Flip 6", category="Speakers", price=120, image="img/x.jpg",
+                                           description="Altavoz portátil resistente al agua")
+        self.flip_pro = Product.objects.create(name="JBL Flip 6 Pro Edition", category="Speakers", price=150,
+                                               image="img/x.jpg", description="Versión con más graves")
+        self.bose = Product.objects.create(name="Bose SoundLink", category="Speakers", price=200, image="img/x.jpg",
+                                           description="Sonido envolvente, también para conectar audífonos")
+        self.deck = Product.objects.create(name="Elgato Stream Deck", category="Streaming", price=150,
+                                           image="img/x.jpg")
+
+    def use_backend(self, backend):
+        settings_override = override_settings(PRODUCT_SEARCH_BACKEND=backend)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        search._fts_available = None
+        search._memory_index = None
+        self.assertEqual(search.fts_available(), backend == "auto")
+
+    def results(self, query):
+        """{backend: [productos]}; falla si los dos motores no coinciden"""
+        results = {}
+        for backend in self.BACKENDS:
+            self.use_backend(backend)
+            results[backend] = search.search_products(query)
+        self.assertEqual(results["auto"], results["python"], query)
+        return results["auto"]
+
+    def test_ranking_and_folding(self):
+        expected = {
+            # Nombre y categoría (sinónimo en español) pesan más que la descripción
+            "audifonos": [self.sony, self.bose],
+            "AUDIFONOS": [self.sony, self.bose],
+            "Audífonos": [self.sony, self.bose],
+            "altavoz": [self.flip],
+            "jbl agua": [self.flip],
+            # Ningún producto tiene los dos términos: se buscan por separado (el nombre más corto puntúa más)
+            "sony elgato": [self.deck, self.sony],
+            "strea": [self.deck],
+            "inexistente": [],
+            "": [],
+        }
+        for query, products in expected.items():
+            with self.subTest(query=query):
+                self.assertEqual(self.results(query), products)
+
+    def test_index_follows_renames_and_deletes(self):
+        self.flip.name = "Marshall Emberton"
+        self.flip.save()
+        self.deck.delete()
+        for query, products in (("marshall", [self.flip]), ("flip", [self.flip_pro]), ("elgato", [])):
+            with self.subTest(query=query):
+                self.assertEqual(self.results(query), products)
+
+    def test_search_endpoint(self):
+        for backend in self.BACKENDS:
+            with self.subTest(backend=backend):
+                self.use_backend(backend)
+                response_cache.invalidate()
+                self.assertEqual(self.client.get("/search?q=%20").status_code, 400)
+                response = self.client.get("/search?q=AUDIFONOS&limit=1")
+                self.assertEqual([product["id"] for product in json.loads(response.content)], [self.sony.id])
+
+    def test_chatbot_product_details(self):
+        for backend in self.BACKENDS:
+            with self.subTest(backend=backend):
+                self.use_backend(backend)
+                # El nombre exacto gana aunque otro resultado puntúe más
+                self.assertEqual(get_product_details("jbl flip 6"), self.flip)
+                self.assertEqual(get_product_details("JBL FLIP 6 PRO"), self.flip_pro)
+                self.assertEqual(get_product_details(str(self.deck.id)), self.deck)
+                self.assertIsNone(get_product_details("inexistente"))
+
+
+def image_upload(name="speaker.png", size=(40, 20), color="red"):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, format="PNG")
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type="image/png")
+
+
+@override_settings(PRODUCT_IMAGE_WIDTHS=(16, 32, 64), PRODUCT_IMAGE_FORMATS=("webp",))
+class ProductImageTests(TestCase):
+    """Derivadas generadas al subir una imagen: anchos (sin ampliar), formatos y srcset"""
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_upload_builds_variants_and_srcset(self):
+        product = Product.objects.create(name="Speaker", price=10, image=image_upload())
+        formats = product.image_variants["formats"]
+        # El original mide 40px: no se amplía a 64, se usa su ancho
+        self.assertEqual({fmt: sorted(sizes, key=int) for fmt, sizes in formats.items()},
+                         {"webp": ["16", "32", "40"], "png": ["16", "32", "40"]})
+        for fmt, sizes in formats.items():
+            for width, name in sizes.items():
+                self.assertTrue(default_storage.exists(name))
+                with Image.open(default_storage.path(name)) as variant:
+                    self.assertEqual((variant.format.lower(), variant.width), (fmt, int(width)))
+
+        srcset = ProductSerializer(product).data["image_srcset"]
+        self.assertEqual(srcset["webp"], ", ".join(
+            f"{default_storage.url(formats['webp'][width])} {width}w" for width in ("16", "32", "40")))
+
+    def test_same_image_reuses_variants(self):
+        first = Product.objects.create(name="Speaker", price=10, image=image_upload())
+        second = Product.objects.create(name="Speaker 2", price=10, image=image_upload("copy.png"))
+        self.assertEqual(second.image_variants, first.image_variants)
+
+    def test_failed_upload_drops_previous_variants(self):
+        product = Product.objects.create(name="Speaker", price=10, image=image_upload())
+        self.assertTrue(product.image_variants)
+        product.image = SimpleUploadedFile("broken.png", b"not an image", content_type="image/png")
+        with self.assertLogs("shop_app.models", level="ERROR") as logs:
+            product.save()
+        self.assertIsNotNone(logs.records[0].exc_info)
+        product.refresh_from_db()
+        self.assertEqual(product.image_variants, {})
+        self.assertEqual(ProductSerializer(product).data["image_srcset"], {})
+
+
+class OrderSnapshotTests(TestCase):
+    """Los pedidos son copias inmutables: no cambian con los precios ni desaparecen con la transacción"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username="buyer", password="secret")
+        self.product = Product.objects.create(name="Speaker", image="img/x.jpg", price=10)
+        self.cart = Cart.objects.create(cart_code="ordercart01", user=self.user)
+        CartItem.objects.create(cart=self.cart, product=self.product, quantity=3)
+        transaction_obj = create_checkout_transaction(self.cart, self.user, get_provider("flutterwave"))
+        complete_transactions([transaction_obj.ref])
+
+    def test_order_keeps_prices_from_checkout(self):
+        Product.objects.filter(pk=self.product.pk).update(price=99, name="Renamed")
+        order = Order.objects.get()
+        self.assertEqual((order.subtotal, order.total), (30, 34))
+        self.assertEqual(list(order.lines.values_list("name", "unit_price", "quantity")), [("Speaker", 10, 3)])
+
+    def test_order_survives_cart_and_user_deletion(self):
+        self.cart.delete()
+        order = Order.objects.get()
+        self.assertIsNone(order.transaction_id)
+        self.assertEqual(order.lines.count(), 1)
+        self.user.delete()
+        self.assertEqual(list(Order.objects.values_list("user_id", "paid", "total")), [(None, True, 34)])
+
+
+def gateway_response(body, status_code=200):
+    return mock.Mock(status_code=status_code, json=lambda: body)
+
+
+def html_response(status_code=502):
+    # Lo que devuelve un proxy caído delante de la pasarela
+    return mock.Mock(status_code=status_code, json=mock.Mock(side_effect=ValueError("Expecting value")))
+
+
+class FlutterwaveCheckoutTests(APITestCase):
+
+    def setUp(self):
+        self.cart = Cart.objects.create(cart_code="checkout001")
+        self.client.force_authenticate(get_user_model().objects.create_user(username="buyer", phone="123"))
+
+    @mock.patch("shop_app.services.gateways.FlutterwaveClient.verify_by_reference")
+    @mock.patch("shop_app.services.gateways.FlutterwaveClient.create_payment")
+    def test_non_json_gateway_body_is_a_gateway_error(self, create_payment, verify_by_reference):
+        create_payment.return_value = html_response()
+        response = self.client.post("/initiate_payment/", {"cart_code": self.cart.cart_code}, format="json")
+        self.assertEqual(response.status_code, 502)
+        self.assertIn("non-JSON", response.data["error"])
+
+        verify_by_reference.return_value = html_response(status_code=200)
+        transaction_obj = Transaction.objects.get(cart=self.cart)
+        with self.assertRaises(gateways.GatewayError):
+            get_provider("flutterwave").check(transaction_obj)
+
+
+@override_settings(FLUTTERWAVE_WEBHOOK_HASH="webhook-secret", BACKGROUND_TASKS={"EAGER": True})
+@mock.patch("shop_app.services.gateways.FlutterwaveClient.verify_transaction")
+class FlutterwavePaymentTests(APITestCase):
+    """Webhook (firma, duplicados, reentregas) y redirección del usuario con su consulta de estado"""
+
+    def setUp(self):
+        self.cart = Cart.objects.create(cart_code="paycart0001")
+        self.transaction = Transaction.objects.create(ref="ref-1", cart=self.cart, amount="14.00", currency="NGN")
+
+    def paid(self, tx_ref="ref-1", **data):
+        return gateway_response({"status": "success", "data": {
+            "id": 99, "tx_ref": tx_ref, "status": "successful", "amount": 14, "currency": "NGN", **data}})
+
+    def deliver(self, signature="webhook-secret"):
+        payload = {"event": "charge.completed", "data": {"id": 99, "tx_ref": "ref-1", "status": "successful"}}
+        headers = {"HTTP_VERIF_HASH": signature} if signature else {}
+        return self.client.post("/flutterwave_webhook/", payload, format="json", **headers)
+
+    def status(self):
+        return Transaction.objects.get(pk=self.transaction.pk).status
+
+    def test_webhook_rejects_bad_signature(self, verify):
+        for signature in (None, "wrong"):
+            with self.subTest(signature=signature):
+                self.assertEqual(self.deliver(signature).status_code, 401)
+        self.assertFalse(PaymentEvent.objects.exists())
+        verify.assert_not_called()
+
+    def test_duplicate_delivery_is_processed_once(self, verify):
+        verify.return_value = self.paid()
+        self.assertEqual(self.deliver().data, {"status": "accepted"})
+        self.assertEqual(self.status(), "completed")
+        self.assertEqual(self.deliver().data, {"status": "duplicate"})
+        self.assertEqual(verify.call_count, 1)
+        self.assertIsNotNone(PaymentEvent.objects.get().processed_at)
+
+    def test_redelivery_retries_when_verification_failed(self, verify):
+        verify.side_effect = gateways.GatewayError("Flutterwave timed out")
+        self.assertEqual(self.deliver().data, {"status": "accepted"})
+        self.assertEqual(self.status(), "pending")
+        self.assertIsNone(PaymentEvent.objects.get().processed_at)
+
+        verify.side_effect = None
+        verify.return_value = self.paid()
+        self.assertEqual(self.deliver().data, {"status": "accepted"})
+        self.assertEqual(self.status(), "completed")
+        self.assertIsNotNone(PaymentEvent.objects.get().processed_at)
+
+    def test_lost_task_is_requeued_on_redelivery(self, verify):
+        verify.return_value = self.paid()
+        # Recibido pero nunca procesado (p. ej. el proceso se reinició con la tarea en cola)
+        payments.record_flutterwave_event({"event": "charge.completed", "data": {"id": 99, "tx_ref": "ref-1"}})
+        self.assertEqual(self.deliver().data, {"status": "accepted"})
+        self.assertEqual(self.status(), "completed")
+
+    def test_verified_payment_must_match_tx_ref(self, verify):
+        for data in ({"tx_ref": None}, {"tx_ref": "other-ref"}):
+            with self.subTest(data=data):
+                verify.return_value = self.paid(**data)
+                self.assertEqual(payments.verify_flutterwave_transaction("ref-1", 99), "pending")
+
+    @mock.patch("shop_app.services.tasks.submit")
+    def test_callback_accepts_then_status_is_polled(self, submit, verify):
+        verify.return_value = self.paid()
+        response = self.client.post("/payment_callback/?status=successful&tx_ref=ref-1&transaction_id=99")
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data["status"], "pending")
+        submit.assert_called_once_with(payments.verify_flutterwave_transaction, "ref-1", "99")
+        self.assertEqual(self.client.get("/payment_status?tx_ref=ref-1").data["status"], "pending")
+
+        # La tarea en cola termina; el front lo ve en su siguiente consulta
+        payments.verify_flutterwave_transaction("ref-1", "99")
+        self.assertEqual(self.client.get("/payment_status?tx_ref=ref-1").data["status"], "completed")
+        response = self.client.post("/payment_callback/?status=successful&tx_ref=ref-1&transaction_id=99")
+        self.assertEqual((response.status_code, response.data["status"]), (200, "completed"))
+        self.assertEqual(self.client.get("/payment_status?tx_ref=missing").status_code, 404)
+
+
+@override_settings(CART_STORE={
+    "BACKEND": "shop_app.services.response_cache.DjangoCacheBackend",
+    "OPTIONS": {"alias": "default"},
+    "FLUSH_INTERVAL": 0,
+    "TIMEOUT": 60,
+})
+class CartStoreTests(TransactionTestCase):
+    """
+    cart_store con un backend compartido (locmem hace de caché común entre workers). Vaciar
+    _pending simula que el cambio lo hizo otro worker: este proceso no lo tiene pendiente.
+    """
+
+    def setUp(self):
+        cart_store._backend = None
+        cart_store._pending.clear()
+        caches["default"].clear()
+        self.user = get_user_model().objects.create_user(username="buyer", password="secret")
+        self.products = [Product.objects.create(name=f"Product {i}", image="img/x.jpg", price=10) for i in range(3)]
+        self.cart = Cart.objects.create(cart_code="storecart01")
+        self.items = CartItem.objects.bulk_create(CartItem(cart=self.cart, product=product, quantity=1)
+                                                  for product in self.products)
+        # Como get_cart: la primera lectura carga la instantánea en el store
+        cart_store.get_snapshot(self.cart.cart_code)
+
+    def tearDown(self):
+        cart_store._backend = None
+        cart_store._pending.clear()
+
+    def db_quantities(self):
+        return dict(CartItem.objects.filter(cart=self.cart).values_list("id", "quantity"))
+
+    def test_edits_stay_in_store_until_flush(self):
+        cart_store.update_item(self.items[0].id, quantity=5)
+        self.assertTrue(cart_store.remove_item(self.items[1].id))
+        self.assertEqual(self.db_quantities(), {item.id: 1 for item in self.items})
+        self.assertEqual(cart_store.get_cart(self.cart.cart_code).item_count, 6)
+
+        self.assertEqual(cart_store.flush(), 1)
+        self.assertEqual(self.db_quantities(), {self.items[0].id: 5, self.items[2].id: 1})
+        self.assertEqual(Cart.objects.get(pk=self.cart.pk).item_count, 6)
+        self.assertEqual(cart_store.flush([self.cart.cart_code]), 0)
+
+    def test_update_item_loads_product_before_editing(self):
+        with cart_store.syncing():
+            # Borrado por otro worker: la instantánea todavía tiene la línea
+            Product.objects.filter(pk=self.products[0].pk).delete()
+        with self.assertRaises(Product.DoesNotExist):
+            cart_store.update_item(self.items[0].id, quantity=3)
+        self.assertEqual(cart_store.get_snapshot(self.cart.cart_code)["items"][self.items[0].id], (self.products[0].id, 1))
+
+        # Quitar la línea no necesita el producto
+        with self.assertNumQueries(0):
+            item = cart_store.update_item(self.items[1].id, delta=-1)
+        self.assertEqual((item.id, item.quantity), (self.items[1].id, 0))
+        self.assertNotIn(self.items[1].id, cart_store.get_snapshot(self.cart.cart_code)["items"])
+
+    def test_batch_update_starts_from_store_edits(self):
+        cart_store.update_item(self.items[0].id, quantity=5)
+        cart_store.remove_item(self.items[2].id)
+        # Una de las ediciones la hizo otro worker, la otra este
+        cart_store._pending.pop(self.cart.cart_code)
+        cart_store.update_item(self.items[1].id, delta=1)
+
+        response = self.client.post("/batch_update_cart/", json.dumps({"cart_code": self.cart.cart_code, "operations": [
+            {"op": "add", "product_id": self.products[0].id}, {"op": "add", "product_id": self.products[2].id}]}),
+            content_type="application/json")
+        self.assertEqual(response.status_code, 200, response.content)
+        expected = {self.products[0].id: 6, self.products[1].id: 2, self.products[2].id: 1}
+        self.assertEqual(dict(CartItem.objects.filter(cart=self.cart).values_list("product_id", "quantity")), expected)
+        self.assertEqual(cart_store.flush([self.cart.cart_code]), 0)
+        # La instantánea se vuelve a cargar con lo escrito por el lote
+        snapshot = cart_store.get_snapshot(self.cart.cart_code)
+        self.assertEqual(dict(snapshot["items"].values()), expected)
+        self.assertEqual(cart_store.get_cart(self.cart.cart_code).item_count, 9)
+
+    def test_flush_writes_edits_buffered_by_another_worker(self):
+        cart_store.update_item(self.items[0].id, delta=2)
+        cart_store._pending.clear()
+
+        self.assertEqual(cart_store.flush(), 0)
+        self.assertEqual(cart_store.flush([self.cart.cart_code]), 1)
+        self.assertEqual(self.db_quantities()[self.items[0].id], 3)
+        # El worker que hizo el cambio ya no tiene nada nuevo que escribir
+        self.assertEqual(cart_store.flush([self.cart.cart_code]), 0)
+
+    def test_purge_keeps_carts_edited_in_store_and_drops_purged_snapshots(self):
+        stale = Cart.objects.create(cart_code="storecart02")
+        stale_item = CartItem.objects.create(cart=stale, product=self.products[0], quantity=2)
+        cart_store.get_snapshot(stale.cart_code)
+        long_ago = timezone.now() - timedelta(days=60)
+        Cart.objects.filter(pk__in=[self.cart.pk, stale.pk]).update(created_at=long_ago, modified_at=long_ago)
+        # Editado en el store (de otro worker) pero aún no escrito: modified_at sigue siendo viejo
+        cart_store.update_item(self.items[0].id, quantity=4)
+        cart_store._pending.clear()
+
+        archive = io.StringIO()
+        self.assertEqual(cart_cleanup.purge_abandoned_carts(archive, days=30), (1, 1))
+
+        lines = [json.loads(line) for line in archive.getvalue().splitlines()]
+        self.assertEqual([line["cart_code"] for line in lines], [stale.cart_code])
+        self.assertEqual(self.db_quantities()[self.items[0].id], 4)
+        self.assertFalse(CartItem.objects.filter(pk=stale_item.pk).exists())
+        self.assertIsNone(cart_store.get_snapshot(stale.cart_code))
+
+    @mock.patch("shop_app.services.gateways.FlutterwaveClient.create_payment")
+    def test_checkout_charges_edits_from_another_worker(self, create_payment):
+        create_payment.return_value = mock.Mock(status_code=200, json=lambda: {"status": "success"})
+        cart_store.update_item(self.items[0].id, quantity=4)
+        cart_store.remove_item(self.items[2].id)
+        cart_store._pending.clear()
+
+        token = self.client.post("/token/", {"username": "buyer", "password": "secret"}).json()["access"]
+        self.client.defaults["HTTP_AUTHORIZATION"] = f"Bearer {token}"
+        response = self.client.post("/initiate_payment/", {"cart_code": self.cart.cart_code})
+        self.assertEqual(response.status_code, 200, response.content)
+
+        order = Transaction.objects.get(cart=self.cart).order
+        self.assertEqual(sorted(order.lines.values_list("product_id", "quantity")),
+                         [(self.products[0].id, 4), (self.products[1].id, 1)])
+        self.assertEqual(order.subtotal, 50)
+
+    def test_reloaded_snapshot_keeps_counting_after_flushed_rev(self):
+        cart_store.update_item(self.items[0].id, quantity=2)
+        cart_store.flush()
+        # La instantánea caduca en el backend y se vuelve a cargar de la base de datos
+        caches["default"].delete(cart_store._cart_key(self.cart.cart_code))
+        cart_store.update_item(self.items[0].id, quantity=7)
+        cart_store._pending.clear()
+        self.assertEqual(cart_store.flush([self.cart.cart_code]), 1)
+        self.assertEqual(self.db_quantities()[self.items[0].id], 7)
+
+    def test_concurrent_deltas_are_not_lost(self):
+        def bump():
+            try:
+                for _ in range(10):
+                    cart_store.update_item(self.items[0].id, delta=1)
+            finally:
+                close_old_connections()
+
+        threads = [threading.Thread(target=bump) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        cart_store.flush()
+        self.assertEqual(self.db_quantities()[self.items[0].id], 41)
+
+
+class FakeGatewayMixin:
+    """Arranca services.fake_gateway en un puerto libre y apunta Flutterwave y PayPal a ella"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.gateway = FakeGatewayServer(("127.0.0.1", 0))
+        threading.Thread(target=cls.gateway.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{cls.gateway.server_port}"
+        cls.settings_override = override_settings(
+            FLUTTERWAVE_BASE_URL=f"{base_url}/v3",
+            PAYPAL_BASE_URL=base_url,
+            PAYMENT_GATEWAY={"RETRIES": 0, "READ_TIMEOUT": 2, "BREAKER_THRESHOLD": 100, "TOKEN_REFRESH_MARGIN": 300},
+        )
+        cls.settings_override.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settings_override.disable()
+        cls.gateway.shutdown()
+        cls.gateway.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        gateways._clients.clear()
+        self.gateway.state = FakeGatewayState()
+
+
+class ReconcileTransactionsTests(FakeGatewayMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user(username="buyer", password="secret")
+
+    def make_transaction(self, ref, minutes_ago=30, amount="14.00", payment=None):
+        cart = Cart.objects.create(cart_code=ref[:11])
+        transaction = Transaction.objects.create(ref=ref, cart=cart, amount=amount, user=self.user)
+        Transaction.objects.filter(pk=transaction.pk).update(created_at=timezone.now() - timedelta(minutes=minutes_ago))
+        state = self.gateway.state
+        if payment == "error":
+            state.failing_refs.add(ref)
+        elif payment is not None:
+            state.add_flutterwave({"id": state.next_id(), "tx_ref": ref, **payment})
+        return transaction
+
+    def status_of(self, ref):
+        transaction = Transaction.objects.select_related("cart").get(ref=ref)
+        return transaction.status, transaction.cart.paid, transaction.cart.user_id
+
+    def test_reconcile_against_fake_gateway(self):
+        self.make_transaction("paid", payment={"status": "successful", "amount": 14, "currency": "NGN"})
+        self.make_transaction("underpaid", payment={"status": "successful", "amount": 1, "currency": "NGN"})
+        self.make_transaction("declined", payment={"status": "failed", "amount": 14, "currency": "NGN"})
+        self.make_transaction("never-paid")
+        self.make_transaction("abandoned", minutes_ago=3 * 24 * 60)
+        self.make_transaction("gateway-down", payment="error")
+        # Caducada, pero sin respuesta de la pasarela no se puede saber si se pagó
+        self.make_transaction("old-gateway-down", minutes_ago=3 * 24 * 60, payment="error")
+        self.make_transaction("too-recent", minutes_ago=1, payment={"status": "successful", "amount": 14, "currency": "NGN"})
+
+        totals = reconcile(older_than=15, batch_size=2, workers=4, expire_after=24 * 60)
+
+        self.assertEqual(totals, {"checked": 7, "completed": 1, "failed": 3, "pending": 3})
+        self.assertEqual(self.status_of("paid"), ("completed", True, self.user.id))
+        self.assertEqual(self.status_of("underpaid"), ("failed", False, None))
+        self.assertEqual(self.status_of("declined"), ("failed", False, None))
+        self.assertEqual(self.status_of("never-paid"), ("pending", False, None))
+        self.assertEqual(self.status_of("abandoned"), ("failed", False, None))
+        self.assertEqual(self.status_of("gateway-down"), ("pending", False, None))
+        self.assertEqual(self.status_of("old-gateway-down"), ("pending", False, None))
+        self.assertEqual(self.status_of("too-recent"), ("pending", False, None))
+        self.assertFalse(any("tx_ref=too-recent" in path for method, path in self.gateway.state.requests))
+
+    def test_reconcile_is_idempotent(self):
+        self.make_transaction("paid-twice", payment={"status": "successful", "amount": 14, "currency": "NGN"})
+        self.assertEqual(reconcile()["completed"], 1)
+        self.assertEqual(reconcile(), {"checked": 0, "completed": 0, "failed": 0, "pending": 0})
+        self.assertEqual(self.status_of("paid-twice"), ("completed", True, self.user.id))
+
+
+class PayPalTests(FakeGatewayMixin, APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.gateway.state.paypal["PAY-1"] = {"id": "PAY-1", "state": "created"}
+        self.cart = Cart.objects.create(cart_code="paypalcart1")
+        self.transaction = Transaction.objects.create(ref="ref-1", cart=self.cart, amount="14.00", currency="USD",
+                                                      provider="paypal", provider_ref="PAY-1")
+
+    def status(self):
+        return Transaction.objects.get(pk=self.transaction.pk).status
+
+    def test_token_is_reused_and_refreshed_before_expiry(self):
+        client = gateways.get_paypal_client()
+        for _ in range(3):
+            self.assertEqual(client.get_payment("PAY-1").status_code, 200)
+        self.assertEqual(self.gateway.state.paypal_tokens, ["fake-token-1"])
+
+        # Dentro del margen de renovación: si otro hilo ya la está renovando se sigue con el actual
+        client._token = ("fake-token-1", time.monotonic() + 10)
+        with client._token_lock:
+            self.assertEqual(client.get_access_token(), "fake-token-1")
+        self.assertEqual(client.get_access_token(), "fake-token-2")
+        self.assertEqual(client.get_access_token(), "fake-token-2")
+        self.assertEqual(self.gateway.state.paypal_tokens, ["fake-token-1", "fake-token-2"])
+
+    def test_revoked_token_is_replaced_once(self):
+        client = gateways.get_paypal_client()
+        client.get_payment("PAY-1")
+        self.gateway.state.paypal_valid_tokens.clear()
+        self.assertEqual(client.get_payment("PAY-1").status_code, 200)
+        self.assertEqual(self.gateway.state.paypal_tokens, ["fake-token-1", "fake-token-2"])
+
+    def test_non_json_token_response_is_a_gateway_error(self):
+        self.gateway.state.html_paths.add("/v1/oauth2/token")
+        with self.assertRaises(gateways.GatewayError):
+            gateways.get_paypal_client().get_payment("PAY-1")
+
+    def test_payment_must_belong_to_transaction(self):
+        self.gateway.state.paypal["PAY-2"] = {"id": "PAY-2", "state": "created"}
+        for provider_ref, payment_id in (("PAY-1", "PAY-2"), ("", "PAY-2"), ("", "")):
+            with self.subTest(provider_ref=provider_ref, payment_id=payment_id):
+                Transaction.objects.filter(pk=self.transaction.pk).update(provider_ref=provider_ref)
+                with self.assertRaises(ProviderError):
+                    payments.execute_paypal_payment("ref-1", payment_id, "PAYER")
+                self.assertEqual(self.status(), "pending")
+        self.assertEqual(self.gateway.state.paypal["PAY-2"]["state"], "created")
+
+    def test_recoverable_decline_keeps_transaction_pending(self):
+        self.gateway.state.paypal_execute_error = "INSTRUMENT_DECLINED"
+        response = self.client.get("/paypal_payment_callback?paymentId=PAY-1&PayerID=PAYER&ref=ref-1")
+        self.assertEqual((response.status_code, response.data["status"]), (400, "pending"))
+
+        # El comprador elige otro medio de pago en PayPal y vuelve
+        self.gateway.state.paypal_execute_error = None
+        response = self.client.get("/paypal_payment_callback?paymentId=PAY-1&PayerID=PAYER&ref=ref-1")
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(self.status(), "completed")
+
+    def test_terminal_error_fails_transaction(self):
+        self.gateway.state.paypal_execute_error = "PAYMENT_EXPIRED"
+        with self.assertRaises(ProviderError):
+            payments.execute_paypal_payment("ref-1", "PAY-1", "PAYER")
+        self.assertEqual(self.status(), "failed")
+
+    def test_already_executed_payment_completes(self):
+        # Ya ejecutado (p. ej. por la tarea en cola): PayPal responde PAYMENT_ALREADY_DONE
+        self.gateway.state.paypal["PAY-1"]["state"] = "approved"
+        self.assertEqual(payments.execute_paypal_payment("ref-1", "PAY-1", "PAYER"), "completed")
+
+    @override_settings(PAYPAL_EXECUTE_ASYNC=True)
+    @mock.patch("shop_app.services.tasks.submit")
+    def test_async_execution_is_polled(self, submit):
+        url = "/paypal_payment_callback?paymentId=PAY-1&PayerID=PAYER&ref=ref-1"
+        response = self.client.get(url)
+        self.assertEqual((response.status_code, response.data["status"]), (202, "pending"))
+        submit.assert_called_once_with(payments.execute_paypal_payment, "ref-1", "PAY-1", "PAYER")
+        self.assertEqual(self.client.get("/payment_status?tx_ref=ref-1").data["status"], "pending")
+
+        func, *args = submit.call_args.args
+        func(*args)
+        self.assertEqual(self.client.get("/payment_status?tx_ref=ref-1").data["status"], "completed")
+        # Recarga de la página de retorno: ya no se vuelve a encolar
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(submit.call_count, 1)
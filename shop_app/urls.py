@@ -4,18 +4,26 @@ from . import views
 urlpatterns = [
     path("products", views.products, name="products"),
     path("product_detail/<slug:slug>", views.product_detail, name="product_detail"),
+    path("search", views.search_products, name="search_products"),
     path("add_item/", views.add_item, name="add_item"),
     path("product_in_cart", views.product_in_cart, name="product_in_cart"),
+    path("products_in_cart", views.products_in_cart, name="products_in_cart"),
     path("get_cart_stat", views.get_cart_stat, name="get_cart_stat"),
     path("get_cart", views.get_cart, name="get_cart"),
     path("update_quantity/", views.update_quantity, name="update_quantity"),
     path("delete_cartitem", views.delete_cartitem, name="delete_cartitem"),
+    path("batch_update_cart/", views.batch_update_cart, name="batch_update_cart"),
     path("get_username", views.get_username, name="get_username"),
     path("user_info", views.user_info, name="user_info"),
+    path("orders", views.orders, name="orders"),
     path("initiate_payment/", views.initiate_payment, name="initiate_payment"),
     path("payment_callback/", views.payment_callback, name="payment_callback"),
+    path("flutterwave_webhook/", views.flutterwave_webhook, name="flutterwave_webhook"),
+    path("payment_status", views.payment_status, name="payment_status"),
     path("initiate_paypal_payment/", views.initiate_paypal_payment, name="initiate_paypal_payment"),
     path("paypal_payment_callback", views.paypal_payment_callback, name="paypal_payment_callback"),
+    path("gateway_metrics", views.gateway_metrics, name="gateway_metrics"),
+    path("sales_analytics", views.sales_analytics, name="sales_analytics"),
     path('register/', views.register_user, name='register_user')
 ]
 
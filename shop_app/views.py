@@ -1,39 +1,215 @@
+import logging
+
 from django.shortcuts import render
+from django.db.models import Prefetch, Sum
+from django.views.decorators.http import condition
 from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
-from .models import Product, Cart, CartItem, Transaction
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.views import TokenObtainPairView
+from .models import Product, Cart, CartItem, Transaction, Order, OrderLine
+from .pagination import KeysetPagination, InvalidPage
+from .services.similar_products import get_similar_limit
+from .services.catalog import catalog_etag, catalog_last_modified, product_etag, product_last_modified, \
+    get_request_catalog_state, get_request_product_state
+from .services.response_cache import cached_json_response
+from .services import search, cart_store, payments, tasks, analytics
+from .services.facets import get_facets
+from .services.gateways import get_gateway_metrics, GatewayError, GatewayUnavailable
+from .services.providers import get_provider, ProviderError
+from .services.orders import create_checkout_transaction
+from .services.cart import apply_cart_operations, add_to_cart, update_item_quantity, merge_carts, get_open_cart, \
+    get_cart_by_code, get_or_create_cart, CartOperationError
 from .serializers import ProductSerializer, DetailedProductSerializer, CartItemSerializer, SimpleCartSerializer, \
-    CartSerializer, UserSerializer
+    CartSerializer, UserSerializer, OrderSerializer
 from rest_framework import status
 from rest_framework.permissions import IsAuthenticated
 from django.conf import settings
-from decimal import Decimal
-import uuid
-import requests
-import paypalrestsdk
+from decimal import Decimal, InvalidOperation
 from django.conf import settings
 from core.models import CustomUser
 
+logger = logging.getLogger(__name__)
+
 BASE_URL = settings.REACT_BASE_URL
 
-paypalrestsdk.configure({
-    "mode": settings.PAYPAL_MODE,
-    "client_id": settings.PAYPAL_CLIENT_ID,
-    "client_secret": settings.PAYPAL_CLIENT_SECRET
-})
+# Máximo de productos por consulta en products_in_cart
+MAX_CART_LOOKUP_IDS = 500
+
+PRODUCT_ORDERINGS = {
+    "id": ("id",),
+    "newest": ("-id",),
+    "price": ("price", "id"),
+    "-price": ("-price", "id"),
+    "name": ("name", "id"),
+}
+
+ORDER_ORDERINGS = {
+    "newest": ("-created_at", "-id"),
+}
+
+
+def get_requested_fields(request):
+    """Lee ?fields=id,name,price y valida contra los campos de ProductSerializer"""
+    raw_fields = request.query_params.get("fields")
+    if not raw_fields:
+        return None
+    fields = [field.strip() for field in raw_fields.split(",") if field.strip()]
+    unknown = set(fields) - set(ProductSerializer.Meta.fields)
+    if unknown:
+        raise InvalidPage(f"Unknown fields: {', '.join(sorted(unknown))}")
+    return fields
+
+
+def parse_price(request, param):
+    raw = request.query_params.get(param)
+    if not raw:
+        return None
+    try:
+        price = Decimal(raw)
+    except InvalidOperation:
+        raise InvalidPage(f"Invalid {param} '{raw}'")
+    if not price.is_finite():
+        raise InvalidPage(f"Invalid {param} '{raw}'")
+    return price
+
+
+PRODUCT_FILTERS = ("category", "min_price", "max_price")
+
+
+def filter_products(products, request):
+    """Filtros del catálogo: ?category=, ?min_price=, ?max_price= (usan product_category_price_idx)"""
+    category = request.query_params.get("category")
+    if category:
+        products = products.filter(category=category)
+    min_price = parse_price(request, "min_price")
+    if min_price is not None:
+        products = products.filter(price__gte=min_price)
+    max_price = parse_price(request, "max_price")
+    if max_price is not None:
+        products = products.filter(price__lte=max_price)
+    return products
+
 
+def cart_queryset():
+    """Plan de consulta para CartSerializer: carrito + líneas con su producto (2 consultas)"""
+    return Cart.objects.prefetch_related(Prefetch("items", queryset=CartItem.objects.select_related("product")))
+
+
+def get_user_cart(request, cart_code):
+    """
+    Código que no es de un carrito abierto: el carrito en que se fusionó si se retiró al
+    iniciar sesión o, si no, el carrito abierto de un usuario autenticado
+    """
+    try:
+        return Cart.objects.get(retired_codes__cart_code=cart_code, paid=False)
+    except Cart.DoesNotExist:
+        cart = get_open_cart(request.user) if request.user.is_authenticated else None
+    if cart is None:
+        raise Cart.DoesNotExist("Cart matching query does not exist.")
+    return cart
+
+
+def claim_cart(request, cart):
+    """
+    Primer acceso autenticado a un carrito anónimo: se fusiona con el carrito abierto del
+    usuario. Devuelve el carrito resultante o None si no cambió.
+    """
+    if not request.user.is_authenticated or cart.user_id == request.user.id:
+        return None
+    merged = merge_carts(request.user, cart.cart_code)
+    return merged if merged is not None and (merged.pk != cart.pk or merged.user_id != cart.user_id) else None
+
+
+class CartTokenObtainPairView(TokenObtainPairView):
+    """
+    TokenObtainPairView que además devuelve el cart_code del carrito abierto del usuario.
+    Si el cliente envía su cart_code anónimo, se fusiona antes con el del usuario.
+    """
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        try:
+            serializer.is_valid(raise_exception=True)
+        except TokenError as e:
+            raise InvalidToken(e.args[0])
+
+        data = dict(serializer.validated_data)
+        cart_code = request.data.get("cart_code")
+        cart = merge_carts(serializer.user, cart_code) if cart_code else get_open_cart(serializer.user)
+        data["cart_code"] = cart.cart_code if cart else None
+        return Response(data, status=status.HTTP_200_OK)
+
+
+@condition(etag_func=catalog_etag, last_modified_func=catalog_last_modified)
 @api_view(["GET"])
 def products(request):
-    products = Product.objects.all()
-    serializer = ProductSerializer(products, many=True)
-    return Response(serializer.data)
+    try:
+        fields = get_requested_fields(request)
+        paginator = KeysetPagination(PRODUCT_ORDERINGS, default_ordering="id")
+        products = Product.objects.all()
+        if fields:
+            columns = {ProductSerializer.source_columns.get(field, field) for field in fields}
+            # Los campos del orden también: el cursor los lee y si no, serían consultas diferidas
+            ordering = {field.lstrip("-") for field in PRODUCT_ORDERINGS[paginator.get_ordering(request)]}
+            products = products.only(*columns | ordering | {"id"})
+
+        products = filter_products(products, request)
+
+        def build_data():
+            if not paginator.is_requested(request):
+                # Modo original: catálogo completo sin paginar
+                if "ordering" in request.query_params:
+                    ordered = products.order_by(*PRODUCT_ORDERINGS[paginator.get_ordering(request)])
+                    return ProductSerializer(ordered, many=True, fields=fields).data
+                return ProductSerializer(products, many=True, fields=fields).data
+            page, next_cursor = paginator.paginate_queryset(products, request)
+            serializer = ProductSerializer(page, many=True, fields=fields)
+            # Con filtros, las facetas se cuentan sobre el listado filtrado para que cuadren con él
+            filtered = any(request.query_params.get(param) for param in PRODUCT_FILTERS)
+            facets = get_facets(products if filtered else None)
+            return {"next_cursor": next_cursor, "results": serializer.data, "facets": facets}
+
+        version = get_request_catalog_state(request)[0]
+        return cached_json_response(request, "products", version, build_data)
+    except InvalidPage as e:
+        return Response({"error": str(e)}, status=400)
 
+@condition(etag_func=product_etag, last_modified_func=product_last_modified)
 @api_view(["GET"])
 def product_detail(request, slug):
-    product = Product.objects.get(slug = slug)
-    serializer = DetailedProductSerializer(product)
-    return Response(serializer.data)
+    similar_limit = request.query_params.get("similar_limit")
+    context = {}
+    if similar_limit and similar_limit.isdigit():
+        # Nunca más de lo que guarda el índice
+        context["similar_limit"] = min(int(similar_limit), get_similar_limit())
+
+    def build_data():
+        product = Product.objects.get(slug = slug)
+        serializer = DetailedProductSerializer(product, context=context)
+        return serializer.data
+
+    state = get_request_product_state(request, slug)
+    if state is None:
+        return Response(build_data())
+    return cached_json_response(request, f"product:{state['id']}", state["version"], build_data)
+
+@condition(etag_func=catalog_etag, last_modified_func=catalog_last_modified)
+@api_view(["GET"])
+def search_products(request):
+    query = request.query_params.get("q", "").strip()
+    limit = request.query_params.get("limit", "")
+    limit = min(int(limit), 50) if limit.isdigit() and int(limit) > 0 else 10
+    if not query:
+        return Response({"error": "Missing search query 'q'"}, status=400)
+
+    def build_data():
+        results = search.search_products(query, limit=limit)
+        return ProductSerializer(results, many=True).data
+
+    version = get_request_catalog_state(request)[0]
+    return cached_json_response(request, "search", version, build_data)
 
 @api_view(["POST"])
 def add_item(request):
@@ -41,12 +217,15 @@ def add_item(request):
         cart_code = request.data.get("cart_code")
         product_id = request.data.get("product_id")
 
-        cart, created = Cart.objects.get_or_create(cart_code = cart_code)
-        product = Product.objects.get(id = product_id)
+        quantity = int(request.data.get("quantity", 1))
+        if quantity < 1:
+            return Response({"error": "quantity must be positive"}, status=400)
 
-        cartitem, created = CartItem.objects.get_or_create(cart = cart, product = product)
-        cartitem.quantity = 1
-        cartitem.save()
+        product = Product.objects.get(id = product_id)
+        cartitem = cart_store.add_item(cart_code, product, quantity)
+        if cartitem is None:
+            cart = get_or_create_cart(cart_code)
+            cartitem = add_to_cart(cart, product, quantity)
 
         serializer = CartItemSerializer(cartitem)
         return Response({"datat": serializer.data, "message": "Cart Item created successfully"}, status=201)
@@ -58,24 +237,76 @@ def product_in_cart(request):
     cart_code = request.query_params.get("cart_code")
     product_id = request.query_params.get("product_id")
 
-    cart = Cart.objects.get(cart_code = cart_code)
-    product = Product.objects.get(id = product_id)
-
-    product_exists_in_cart = CartItem.objects.filter(cart = cart, product = product).exists()
+    product_exists_in_cart = cart_store.product_in_cart(cart_code, product_id)
+    if product_exists_in_cart is None:
+        # Una sola consulta usando el índice único de cart_code
+        product_exists_in_cart = CartItem.objects.filter(cart__cart_code = cart_code, product_id = product_id).exists()
+        if not product_exists_in_cart:
+            # Puede ser un código retirado tras una fusión: se mira en el carrito resultante
+            product_exists_in_cart = CartItem.objects.filter(cart__retired_codes__cart_code = cart_code,
+                                                             product_id = product_id).exists()
 
     return Response({"product_in_cart": product_exists_in_cart})
 
+@api_view(["GET"])
+def products_in_cart(request):
+    """
+    ?cart_code=...&product_ids=1,2,3 -> {"products": {"1": 2, "3": 1}} con las cantidades de los
+    productos pedidos que ya están en el carrito. Sin product_ids devuelve todos.
+    """
+    cart_code = request.query_params.get("cart_code")
+    if not cart_code:
+        return Response({"error": "Missing cart_code"}, status=400)
+    raw_ids = ",".join(request.query_params.getlist("product_ids"))
+    try:
+        product_ids = {int(product_id) for product_id in raw_ids.split(",") if product_id.strip()}
+    except ValueError:
+        return Response({"error": f"Invalid product_ids '{raw_ids}'"}, status=400)
+    if len(product_ids) > MAX_CART_LOOKUP_IDS:
+        return Response({"error": f"At most {MAX_CART_LOOKUP_IDS} product_ids per request"}, status=400)
+
+    quantities = cart_store.product_quantities(cart_code)
+    if quantities is None:
+        # Una sola consulta: índice único de cart_code + índice de cart_id en las líneas
+        def cart_quantities(**cart_filter):
+            items = CartItem.objects.filter(**cart_filter)
+            if product_ids:
+                items = items.filter(product_id__in = product_ids)
+            return dict(items.order_by().values("product_id").annotate(total=Sum("quantity"))
+                        .values_list("product_id", "total"))
+        quantities = cart_quantities(cart__cart_code = cart_code)
+        if not quantities:
+            # Puede ser un código retirado tras una fusión: se mira en el carrito resultante
+            quantities = cart_quantities(cart__retired_codes__cart_code = cart_code)
+    if product_ids:
+        quantities = {product_id: quantity for product_id, quantity in quantities.items() if product_id in product_ids}
+    return Response({"cart_code": cart_code, "products": quantities})
+
 @api_view(["GET"])
 def get_cart_stat(request):
     cart_code = request.query_params.get("cart_code")
-    cart = Cart.objects.get(cart_code = cart_code, paid = False)
+    cart = cart_store.get_cart(cart_code)
+    if cart is None:
+        try:
+            cart = Cart.objects.get(cart_code = cart_code, paid = False)
+        except Cart.DoesNotExist:
+            cart = get_user_cart(request, cart_code)
+    cart = claim_cart(request, cart) or cart
     serializer = SimpleCartSerializer(cart)
     return Response(serializer.data)
 
 @api_view(["GET"])
 def get_cart(request):
     cart_code = request.query_params.get("cart_code")
-    cart = Cart.objects.get(cart_code = cart_code, paid=False)
+    cart = cart_store.get_cart(cart_code, with_items=True)
+    if cart is None:
+        try:
+            cart = cart_queryset().get(cart_code = cart_code, paid=False)
+        except Cart.DoesNotExist:
+            cart = cart_queryset().get(pk = get_user_cart(request, cart_code).pk)
+    merged = claim_cart(request, cart)
+    if merged is not None:
+        cart = cart_queryset().get(pk = merged.pk)
     serializer = CartSerializer(cart)
     return Response(serializer.data)
 
@@ -83,11 +314,19 @@ def get_cart(request):
 def update_quantity(request):
     try:
         cartitem_id = request.data.get("item_id")
+        # quantity fija la cantidad; delta la suma o resta de forma atómica (+1 / -1 en los botones)
         quantity = request.data.get("quantity")
-        quantity = int(quantity)
-        cartitem = CartItem.objects.get(id = cartitem_id)
-        cartitem.quantity = quantity
-        cartitem.save()
+        delta = request.data.get("delta")
+        if (quantity is None) == (delta is None):
+            return Response({"error": "Send either quantity or delta"}, status=400)
+        quantity = int(quantity) if quantity is not None else None
+        delta = int(delta) if delta is not None else None
+
+        cartitem = cart_store.update_item(cartitem_id, quantity=quantity, delta=delta)
+        if cartitem is None:
+            cartitem = update_item_quantity(cartitem_id, quantity=quantity, delta=delta)
+        if cartitem.quantity <= 0:
+            return Response({"message": "Cart Item deleted successfully!"}, status=200)
         serializer = CartItemSerializer(cartitem)
         return Response({"data": serializer.data, "message": "Cart Item updated successfully!"}, status=201)
 
@@ -97,10 +336,25 @@ def update_quantity(request):
 @api_view(["POST"])
 def delete_cartitem(request):
     cartitem_id = request.data.get("item_id")
-    cartitem = CartItem.objects.get(id = cartitem_id)
-    cartitem.delete()
+    if not cart_store.remove_item(cartitem_id):
+        cartitem = CartItem.objects.get(id = cartitem_id)
+        cartitem.delete()
     return Response({"message": "Cart Item deleted successfully!"}, status=status.HTTP_204_NO_CONTENT)
 
+@api_view(["POST"])
+def batch_update_cart(request):
+    cart_code = request.data.get("cart_code")
+    if not cart_code:
+        return Response({"error": "Missing cart_code"}, status=400)
+    # Las operaciones en lote van directas a la base de datos
+    cart_store.invalidate(cart_code)
+    try:
+        cart = apply_cart_operations(cart_code, request.data.get("operations"))
+    except CartOperationError as e:
+        return Response({"error": str(e)}, status=400)
+    serializer = CartSerializer(cart_queryset().get(pk=cart.pk))
+    return Response({"data": serializer.data, "message": "Cart updated successfully!"})
+
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
 def get_username(request):
@@ -114,68 +368,64 @@ def user_info(request):
     serializer = UserSerializer(user)
     return Response(serializer.data)
 
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def orders(request):
+    # Pedidos pagados del usuario, del más reciente al más antiguo (índice order_user_paid_created_idx)
+    paginator = KeysetPagination(ORDER_ORDERINGS, default_ordering="newest",
+                                 page_size=getattr(settings, "ORDERS_PAGE_SIZE", 10),
+                                 max_page_size=getattr(settings, "ORDERS_MAX_PAGE_SIZE", 50))
+    queryset = Order.objects.filter(user=request.user, paid=True).prefetch_related(
+        Prefetch("lines", queryset=OrderLine.objects.order_by("id")))
+    try:
+        page, next_cursor = paginator.paginate_queryset(queryset, request)
+    except InvalidPage as e:
+        return Response({"error": str(e)}, status=400)
+    return Response({"next_cursor": next_cursor, "results": OrderSerializer(page, many=True).data})
+
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
 def initiate_payment(request):
     if request.user:
         try:
-            # Generate a unique transaction reference
-            tx_ref = str(uuid.uuid4())
             cart_code = request.data.get("cart_code")
-            cart = Cart.objects.get(cart_code = cart_code)
+            try:
+                cart = get_cart_by_code(cart_code)
+            except Cart.DoesNotExist:
+                return Response({"error": "Cart not found"}, status=status.HTTP_404_NOT_FOUND)
+            # El total se calcula sobre lo que ve el usuario: escribir antes los cambios pendientes
+            cart_store.flush([cart.cart_code])
             user = request.user
 
-            amount = sum([item.quantity * item.product.price for item in cart.items.all()])
-            tax = Decimal("4.00")
-            total_amount = amount + tax
-            currency = "NGN"
+            provider = get_provider("flutterwave")
             redirect_url = f"{BASE_URL}/payment-status/"
 
-            transaction = Transaction.objects.create(
-                ref=tx_ref,
-                cart=cart,
-                amount=total_amount,
-                currency=currency,
-                user=user,
-                status='pending'
-            )
+            # Transaction + Order con los precios de ahora
+            transaction = create_checkout_transaction(cart, user, provider)
 
-            flutterwave_payload = {
-                "tx_ref": tx_ref,
-                "amount": str(total_amount),
-                "currency": currency,
-                "redirect_url": redirect_url,
-                "customer" : {
-                    "email": user.email,
-                    "username": user.username,
-                    "phonenumber": user.phone
-                },
-                "customizations": {
-                    "title": "PulseBeat Tech Payment"
-                }
-            }
-
-            # Set up the headers for the request
-            headers = {
-                "Authorization": f"Bearer {settings.FLUTTERWAVE_SECRET_KEY}",
-                "Content-Type": "application/json"
-            }
-
-            # Make the API request to FLUTTERWAVE
-            response = requests.post(
-                'https://api.flutterwave.com/v3/payments',
-                json=flutterwave_payload,
-                headers=headers
-            )
+            response = provider.create_checkout(transaction, user, redirect_url)
+            try:
+                body = response.json()
+            except ValueError:
+                # p. ej. un 502 en HTML de un proxy intermedio
+                raise GatewayError(f"Flutterwave returned a non-JSON response ({response.status_code})")
 
             # Check if the request was successful
             if response.status_code == 200:
-                return Response(response.json(), status=status.HTTP_200_OK)
+                return Response(body, status=status.HTTP_200_OK)
             else:
-                return Response(response.json(), status=response.status_code)
+                return Response(body, status=response.status_code)
+
+        except GatewayUnavailable as e:
+            return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        except GatewayError as e:
+            return Response({"error": str(e)}, status=status.HTTP_502_BAD_GATEWAY)
 
-        except requests.exceptions.RequestException as e:
-            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+PAYMENT_MESSAGES = {
+    "completed": {'message': 'Payment succesful!', 'subMessage': 'You have succesfully made payment for items you purchased!'},
+    "failed": {'message': 'Payment verification failed.', 'subMessage': 'Your payment verification failed.'},
+    "pending": {'message': 'Verifying payment...', 'subMessage': 'We are confirming your payment with the payment provider.'},
+}
 
 @api_view(["POST"])
 def payment_callback(request):
@@ -183,100 +433,66 @@ def payment_callback(request):
     tx_ref = request.GET.get("tx_ref")
     transaction_id = request.GET.get("transaction_id")
 
-    user = request.user
-
     if status == "successful":
-        # Verify the transaction using Flutterwave's API
-        headers = {
-            "Authorization": f"Bearer {settings.FLUTTERWAVE_SECRET_KEY}"
-        }
-
-        response = requests.get(f"https://api.flutterwave.com/v3/transactions/{transaction_id}/verify", headers=headers)
-        response_data = response.json()
-
-        if response_data["status"] == "success":
-            transaction = Transaction.objects.get(ref=tx_ref)
-
-            # Confirm the transaction details
-            if(response_data['data']['status'] == "successful"
-                    and float(response_data['data']['amount']) == float(transaction.amount)
-                    and response_data['data']['currency'] == transaction.currency):
-                # Update transaction and cart status to paid
-                transaction.status = "completed"
-                transaction.save()
-
-                cart = transaction.cart
-                cart.paid = True
-                cart.user = user
-                cart.save()
-
-                return Response({'message': 'Payment succesful!', 'subMessage': 'You have succesfully made payment for items you purchased!'})
-            else:
-                # Payment verification failed
-                return Response({'message': 'Payment verification failed.', 'subMessage': 'Your payment verification failed.'})
-        else:
-            return Response({'message': 'Failed to verify transaction with Flutterwave.', 'subMessage': 'We could not verify transaction with Flutterwave.'})
+        transaction_status = payments.get_status(tx_ref)
+        if transaction_status is None:
+            return Response({'message': 'Transaction not found.'}, status=404)
+        if transaction_status == "pending":
+            # La verificación con Flutterwave va a la cola; el front consulta payment_status
+            payments.enqueue_flutterwave_verification(tx_ref, transaction_id)
+            transaction_status = payments.get_status(tx_ref)
+        return Response({**PAYMENT_MESSAGES.get(transaction_status, PAYMENT_MESSAGES["failed"]), "status": transaction_status, "tx_ref": tx_ref},
+                        status=202 if transaction_status == "pending" else 200)
     else:
         # Payment was not successful
         return Response({'message': 'Payment was not succesful.'}, status=400)
 
+@api_view(["POST"])
+def flutterwave_webhook(request):
+    if not payments.valid_flutterwave_signature(request):
+        return Response({"error": "Invalid signature"}, status=401)
+    event = payments.record_flutterwave_event(request.data)
+    if event is None:
+        # Evento repetido y ya procesado
+        return Response({"status": "duplicate"})
+    tasks.submit(payments.process_flutterwave_event, event.pk)
+    return Response({"status": "accepted"})
+
+@api_view(["GET"])
+def payment_status(request):
+    tx_ref = request.query_params.get("tx_ref")
+    transaction_status = payments.get_status(tx_ref) if tx_ref else None
+    if transaction_status is None:
+        return Response({"error": "Transaction not found"}, status=404)
+    return Response({"tx_ref": tx_ref, "status": transaction_status})
+
 @api_view(["POST"])
 def initiate_paypal_payment(request):
     if request.method == "POST" and request.user.is_authenticated:
-        tx_ref = str(uuid.uuid4())
         user = request.user
         cart_code = request.data.get('cart_code')
-        cart = Cart.objects.get(cart_code=cart_code)
-        amount = sum(item.product.price * item.quantity for item in cart.items.all())
-        tax = Decimal("4.00")
-        total_amount = amount + tax
-
-        # Create a PayPal payment object
-        payment = paypalrestsdk.Payment({
-            "intent": "sale",
-            "payer": {
-                "payment_method": "paypal"
-            },
-            "redirect_urls": {
-                "return_url": f"{BASE_URL}/payment-status?paymentStatus=success&ref={tx_ref}",
-                "cancel_url": f"{BASE_URL}/payment-status?paymentStatus=cancel"
-            },
-            "transactions": [{
-                "item_list": {
-                    "items": [{
-                        "name": "Cart Items",
-                        "sku": "cart",
-                        "price": str(total_amount),
-                        "currency": "USD",
-                        "quantity": 1
-                    }]
-                },
-                "amount": {
-                    "total": str(total_amount),
-                    "currency": "USD"
-                },
-                "description": "Payment for cart items."
-            }]
-        })
+        try:
+            cart = get_cart_by_code(cart_code)
+        except Cart.DoesNotExist:
+            return Response({"error": "Cart not found"}, status=status.HTTP_404_NOT_FOUND)
+        cart_store.flush([cart.cart_code])
 
-        print("pay_id", payment)
+        provider = get_provider("paypal")
+        transaction = create_checkout_transaction(cart, user, provider)
 
-        transaction, created = Transaction.objects.get_or_create(
-            ref=tx_ref,
-            cart=cart,
-            amount=total_amount,
-            user=user,
-            status="pending"
-        )
-
-        if payment.create():
-            for link in payment.links:
-                if link in payment.links:
-                    if link.rel == 'approval_url':
-                        approval_url = str(link.href)
-                        return Response({"approval_url": approval_url})
-        else:
-            return Response({'error': payment.error}, status=400)
+        try:
+            payment_id, approval_url = provider.create_checkout(
+                transaction,
+                return_url=f"{BASE_URL}/payment-status?paymentStatus=success&ref={transaction.ref}",
+                cancel_url=f"{BASE_URL}/payment-status?paymentStatus=cancel",
+            )
+        except ProviderError as e:
+            return Response({'error': e.args[0]}, status=400)
+        except GatewayError as e:
+            return Response({'error': str(e)}, status=status.HTTP_502_BAD_GATEWAY)
+        # El id del pago permite a reconcile_transactions consultarlo si el usuario no vuelve
+        Transaction.objects.filter(pk=transaction.pk).update(provider_ref=payment_id)
+        return Response({"approval_url": approval_url})
 
 
 @api_view(["GET"])  # Cambiado a GET
@@ -286,48 +502,62 @@ def paypal_payment_callback(request):
         payer_id = request.GET.get('PayerID')  # Cambiado a request.GET
         ref = request.GET.get('ref')  # Cambiado a request.GET
 
-        print(f"Callback recibido - payment_id: {payment_id}, payer_id: {payer_id}, ref: {ref}")
+        logger.info("PayPal callback for %s (payment %s)", ref, payment_id)
 
         if not payment_id or not payer_id or not ref:
             return Response({'error': 'Missing required parameters'}, status=400)
 
         # Encontrar la transacción sin depender del usuario autenticado
-        transaction = Transaction.objects.get(ref=ref)
-
-        # Obtener el usuario de la transacción, no de la solicitud
-        user = transaction.user
-
-        # Verifica el pago con PayPal y ejecuta la transacción
-        payment = paypalrestsdk.Payment.find(payment_id)
-
-        # Ejecutar el pago - paso crucial que faltaba
-        if payment.execute({"payer_id": payer_id}):
-            # Actualizar el estado de la transacción
-            transaction.status = "completed"
-            transaction.save()
-
-            # Actualizar el carrito
-            cart = transaction.cart
-            cart.paid = True
-            cart.user = user
-            cart.save()
-
-            return Response({
-                'message': 'Payment successful!',
-                'subMessage': 'You have successfully made payment for items you purchased!'
-            })
-        else:
-            return Response({'error': payment.error}, status=400)
-
-    except Transaction.DoesNotExist:
-        return Response({'error': 'Transaction not found'}, status=404)
+        transaction_status = payments.get_status(ref)
+        if transaction_status is None:
+            return Response({'error': 'Transaction not found'}, status=404)
+
+        if transaction_status == "pending" and getattr(settings, 'PAYPAL_EXECUTE_ASYNC', False):
+            # La ejecución va a la cola; el front consulta payment_status
+            payments.enqueue_paypal_execution(ref, payment_id, payer_id)
+            transaction_status = payments.get_status(ref)
+            return Response({**PAYMENT_MESSAGES.get(transaction_status, PAYMENT_MESSAGES["failed"]),
+                             "status": transaction_status, "tx_ref": ref},
+                            status=202 if transaction_status == "pending" else 200)
+
+        # Ejecuta el pago con PayPal; completa la transacción y el carrito (con el usuario de la transacción)
+        try:
+            transaction_status = payments.execute_paypal_payment(ref, payment_id, payer_id)
+        except ProviderError as e:
+            # 'pending' si el comprador puede reintentarlo (p. ej. tarjeta rechazada)
+            return Response({'error': e.args[0], 'status': payments.get_status(ref)}, status=400)
+        except GatewayError as e:
+            return Response({'error': str(e)}, status=status.HTTP_502_BAD_GATEWAY)
+
+        if transaction_status != "completed":
+            return Response({**PAYMENT_MESSAGES["failed"], "status": transaction_status}, status=400)
+        return Response({
+            'message': 'Payment successful!',
+            'subMessage': 'You have successfully made payment for items you purchased!'
+        })
+
     except Exception as e:
-        import traceback
-        print(f"Error en paypal_payment_callback: {str(e)}")
-        print(traceback.format_exc())
+        logger.exception("Error en paypal_payment_callback")
         return Response({'error': str(e)}, status=500)
 
 
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def gateway_metrics(request):
+    return Response(get_gateway_metrics())
+
+
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def sales_analytics(request):
+    # Solo lee los rollups de ventas: coste proporcional a los días del periodo
+    try:
+        start, end = analytics.get_period(request.query_params)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
+    return Response(analytics.sales_report(start, end, currency=request.query_params.get("currency") or None))
+
+
 @api_view(["POST"])
 def register_user(request):
     try: